@@ -0,0 +1,434 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import RealDictCursor
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+SNAPSHOT_PREFIX = os.environ.get('CATALOG_SNAPSHOT_PREFIX', 'catalog')
+SNAPSHOT_LOCK_KEY = 90017259008
+INLINE_IMAGE_MAX_LENGTH = 5000
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError
+
+def get_s3_client():
+    import boto3
+
+    return boto3.client(
+        's3',
+        endpoint_url=os.environ.get('S3_ENDPOINT'),
+        aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+        aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
+        region_name='ru-central1'
+    )
+
+def public_url(bucket_name: str, key: str) -> str:
+    return f"https://{bucket_name}.storage.yandexcloud.net/{key}"
+
+def read_manifest(s3_client, bucket_name: str) -> Optional[Dict[str, Any]]:
+    '''Currently published manifest, or None before the first build'''
+    from botocore.exceptions import ClientError
+
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=f'{SNAPSHOT_PREFIX}/manifest.json')
+    except ClientError:
+        return None
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+def load_catalog(conn) -> Dict[str, Any]:
+    '''
+    Catalog_version, active cities and every available product per city, read in one
+    REPEATABLE READ transaction so all files of a snapshot describe the same state.
+    '''
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute('SELECT version FROM t_p90017259_flo_rustic_shop.catalog_version WHERE id = 1')
+            row = cur.fetchone()
+            version = row['version'] if row else 0
+
+            cur.execute('''
+                SELECT c.id, c.name, c.region_id, r.name as region_name,
+                       c.timezone, c.work_hours, c.address, c.price_markup_percent
+                FROM cities c
+                JOIN regions r ON r.id = c.region_id
+                WHERE c.is_active = true AND r.is_active = true
+                ORDER BY r.name, c.name
+            ''')
+            cities = [dict(row) for row in cur.fetchall()]
+
+            cur.execute(f'''
+                SELECT pcc.city_id, p.id, p.name, p.description, p.composition,
+                       CASE WHEN octet_length(p.image_url) > {INLINE_IMAGE_MAX_LENGTH} THEN '' ELSE p.image_url END as image_url,
+                       p.category, p.is_featured, p.is_gift, p.is_recommended, p.subcategory_id,
+                       s.name as subcategory_name, pcc.sort_key as created_at, pcc.price
+                FROM product_city_catalog pcc
+                JOIN products p ON p.id = pcc.product_id
+                LEFT JOIN subcategories s ON s.id = p.subcategory_id
+                WHERE pcc.is_available = true
+                  AND pcc.city_id = ANY(%s::int[])
+                ORDER BY pcc.city_id, pcc.sort_key DESC, pcc.product_id DESC
+            ''', ([city['id'] for city in cities],))
+            products_by_city: Dict[int, List[Dict[str, Any]]] = {}
+            for row in cur.fetchall():
+                product = dict(row)
+                products_by_city.setdefault(product.pop('city_id'), []).append(product)
+
+            cur.execute('SELECT product_id, category FROM product_categories ORDER BY product_id, category')
+            categories_map: Dict[int, List[str]] = {}
+            for row in cur.fetchall():
+                categories_map.setdefault(row['product_id'], []).append(row['category'])
+
+            cur.execute('''
+                SELECT ps.product_id, ps.subcategory_id, s.name, s.category
+                FROM product_subcategories ps
+                JOIN subcategories s ON s.id = ps.subcategory_id
+                ORDER BY ps.product_id, s.name
+            ''')
+            subcategories_map: Dict[int, List[Dict[str, Any]]] = {}
+            for row in cur.fetchall():
+                subcategories_map.setdefault(row['product_id'], []).append({
+                    'subcategory_id': row['subcategory_id'],
+                    'name': row['name'],
+                    'category': row['category']
+                })
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    for products in products_by_city.values():
+        for product in products:
+            product['categories'] = categories_map.get(product['id'], [])
+            product['subcategories'] = subcategories_map.get(product['id'], [])
+
+    return {'version': version, 'cities': cities, 'products_by_city': products_by_city}
+
+def build_snapshot(conn, force: bool = False) -> Dict[str, Any]:
+    '''
+    Render one JSON file per active city, upload files whose content changed under
+    content-hash names, then publish the manifest that points at them.
+    Skips the work when the manifest already matches catalog_version.
+    '''
+    s3_client = get_s3_client()
+    bucket_name = os.environ.get('S3_BUCKET')
+
+    # Сессионная блокировка: параллельный запуск ждёт и потом видит уже свежий манифест
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_advisory_lock(%s)', (SNAPSHOT_LOCK_KEY,))
+    conn.commit()
+    try:
+        previous = read_manifest(s3_client, bucket_name) or {}
+        catalog = load_catalog(conn)
+        if not force and previous.get('version') == catalog['version']:
+            return {'rebuilt': False, 'manifest': previous}
+
+        published = {
+            entry['hash']: entry['file']
+            for region_cities in previous.get('cities', {}).values()
+            for entry in region_cities
+            if entry.get('hash')
+        }
+        generated_at = datetime.utcnow().isoformat() + 'Z'
+        uploaded = 0
+        grouped_cities: Dict[str, List[Dict[str, Any]]] = {}
+
+        for city in catalog['cities']:
+            products = catalog['products_by_city'].get(city['id'], [])
+            body = json.dumps(
+                {'city': city['name'], 'city_id': city['id'], 'products': products},
+                ensure_ascii=False, default=decimal_default, separators=(',', ':')
+            ).encode('utf-8')
+            content_hash = hashlib.sha256(body).hexdigest()[:16]
+            key = published.get(content_hash)
+            if not key:
+                key = f"{SNAPSHOT_PREFIX}/city-{city['id']}.{content_hash}.json"
+                s3_client.put_object(
+                    Bucket=bucket_name,
+                    Key=key,
+                    Body=body,
+                    ContentType='application/json; charset=utf-8',
+                    CacheControl='public, max-age=31536000, immutable',
+                    ACL='public-read'
+                )
+                uploaded += 1
+
+            grouped_cities.setdefault(city['region_name'], []).append({
+                'id': city['id'],
+                'name': city['name'],
+                'region': city['region_name'],
+                'region_id': city['region_id'],
+                'work_hours': city.get('work_hours'),
+                'timezone': city.get('timezone'),
+                'address': city.get('address'),
+                'price_markup_percent': city.get('price_markup_percent'),
+                'products_count': len(products),
+                'hash': content_hash,
+                'file': key,
+                'url': public_url(bucket_name, key)
+            })
+
+        manifest = {
+            'version': catalog['version'],
+            'generated_at': generated_at,
+            'cities': grouped_cities
+        }
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=f'{SNAPSHOT_PREFIX}/manifest.json',
+            Body=json.dumps(manifest, ensure_ascii=False, default=decimal_default).encode('utf-8'),
+            ContentType='application/json; charset=utf-8',
+            CacheControl='public, max-age=60',
+            ACL='public-read'
+        )
+        print(f"Catalog snapshot v{catalog['version']}: {len(catalog['cities'])} cities, {uploaded} files uploaded")
+        return {'rebuilt': True, 'uploaded': uploaded, 'manifest': manifest}
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (SNAPSHOT_LOCK_KEY,))
+        conn.commit()
+
+@instrument_db
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Build static per-city catalog JSON files in S3 for the CDN
+    Args: event with httpMethod (timer trigger, or POST from admin jobs);
+          POST body may contain force=true, otherwise an unchanged catalog_version is a no-op
+          context with request_id attribute
+    Returns: HTTP response with the published manifest
+    '''
+    method: str = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method == 'GET':
+        manifest = read_manifest(get_s3_client(), os.environ.get('S3_BUCKET'))
+        return {
+            'statusCode': 200 if manifest else 404,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps(manifest or {'error': 'Snapshot not built yet'}, ensure_ascii=False)
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Database configuration missing'})
+        }
+
+    body_data = json.loads(event.get('body') or '{}')
+    conn = get_db_connection(database_url)
+    try:
+        result = build_snapshot(conn, force=bool(body_data.get('force')))
+    finally:
+        release_db_connection(conn)
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps(result, ensure_ascii=False, default=decimal_default)
+    }
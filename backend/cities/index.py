@@ -1,15 +1,232 @@
+import functools
+import hashlib
 import json
 import os
-from typing import Dict, Any, List
+import re
+import time
+from typing import Dict, Any, List, Optional
 from decimal import Decimal
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
 from psycopg2.extras import RealDictCursor
 
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
 def decimal_default(obj):
     if isinstance(obj, Decimal):
         return float(obj)
     raise TypeError
 
+def refresh_city_catalog(cur, product_id: Optional[int] = None, city_id: Optional[int] = None) -> None:
+    '''Recompute product_city_catalog rows affected by an admin write (None means all)'''
+    cur.execute(
+        'SELECT t_p90017259_flo_rustic_shop.refresh_product_city_catalog(%s, %s)',
+        (product_id, city_id)
+    )
+
+def bump_catalog_version(cur) -> None:
+    '''Invalidate catalog response caches held by warm products containers'''
+    cur.execute('''
+        UPDATE t_p90017259_flo_rustic_shop.catalog_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    ''')
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    '''True when the request's If-None-Match already names this ETag (or is *)'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return False
+    candidates = [tag.strip() for tag in value.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def not_modified_response(etag: str, cache_control: str = 'no-cache') -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+def conditional_response(event: Dict[str, Any], response: Dict[str, Any], etag: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Attach a strong ETag to a 200 GET response (a hash of the body unless a version-based
+    tag is passed) and answer 304 without a body when If-None-Match already matches it
+    '''
+    if response.get('statusCode') != 200:
+        return response
+    etag = etag or make_etag(response['body'])
+    headers = dict(response.get('headers') or {})
+    headers['ETag'] = etag
+    headers.setdefault('Cache-Control', 'no-cache')
+    if etag_matches(event, etag):
+        return not_modified_response(etag, headers['Cache-Control'])
+    return dict(response, headers=headers)
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Manage cities, city contacts, reviews, and settlements data
@@ -46,7 +263,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database configuration missing'})
         }
     
-    conn = psycopg2.connect(database_url)
+    conn = get_db_connection(database_url)
     
     try:
         if method == 'GET':
@@ -71,7 +288,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     rows = cur.fetchall()
                     settlements = [dict(row) for row in rows]
                     
-                    return {
+                    return conditional_response(event, {
                         'statusCode': 200,
                         'headers': {
                             'Content-Type': 'application/json',
@@ -79,7 +296,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         },
                         'isBase64Encoded': False,
                         'body': json.dumps({'settlements': settlements}, ensure_ascii=False, default=decimal_default)
-                    }
+                    })
             elif action == 'reviews':
                 show_all = params.get('all') == 'true'
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -99,7 +316,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     rows = cur.fetchall()
                     reviews = [dict(row) for row in rows]
                     
-                    return {
+                    return conditional_response(event, {
                         'statusCode': 200,
                         'headers': {
                             'Content-Type': 'application/json',
@@ -107,7 +324,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         },
                         'isBase64Encoded': False,
                         'body': json.dumps({'reviews': reviews}, ensure_ascii=False, default=str)
-                    }
+                    })
             elif action == 'contacts':
                 city_name = params.get('city')
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -122,7 +339,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         row = cur.fetchone()
                         
                         if row:
-                            return {
+                            return conditional_response(event, {
                                 'statusCode': 200,
                                 'headers': {
                                     'Content-Type': 'application/json',
@@ -130,7 +347,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                                 },
                                 'isBase64Encoded': False,
                                 'body': json.dumps({'contact': dict(row)}, ensure_ascii=False)
-                            }
+                            })
                         else:
                             return {
                                 'statusCode': 404,
@@ -152,7 +369,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         rows = cur.fetchall()
                         contacts = [dict(row) for row in rows]
                         
-                        return {
+                        return conditional_response(event, {
                             'statusCode': 200,
                             'headers': {
                                 'Content-Type': 'application/json',
@@ -160,7 +377,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             },
                             'isBase64Encoded': False,
                             'body': json.dumps({'contacts': contacts}, ensure_ascii=False, default=decimal_default)
-                        }
+                        })
             elif action == 'regions':
                 show_all = params.get('all') == 'true'
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -186,7 +403,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     rows = cur.fetchall()
                     regions = [dict(row) for row in rows]
                     
-                    return {
+                    return conditional_response(event, {
                         'statusCode': 200,
                         'headers': {
                             'Content-Type': 'application/json',
@@ -194,13 +411,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         },
                         'isBase64Encoded': False,
                         'body': json.dumps({'regions': regions}, ensure_ascii=False, default=decimal_default)
-                    }
+                    })
             else:
                 show_all = params.get('all') == 'true'
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     if show_all:
                         cur.execute('''
-                            SELECT c.id, c.name, c.region_id, r.name as region_name, 
+                            SELECT c.id, c.name, c.slug, c.region_id, r.name as region_name, 
                                    c.timezone, c.work_hours, c.address, c.is_active, c.price_markup_percent
                             FROM cities c
                             JOIN regions r ON r.id = c.region_id
@@ -208,7 +425,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         ''')
                     else:
                         cur.execute('''
-                            SELECT c.id, c.name, c.region_id, r.name as region_name, 
+                            SELECT c.id, c.name, c.slug, c.region_id, r.name as region_name, 
                                    c.timezone, c.work_hours, c.address, c.price_markup_percent
                             FROM cities c
                             JOIN regions r ON r.id = c.region_id
@@ -225,6 +442,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         grouped_cities[region].append({
                             'id': city['id'],
                             'name': city['name'],
+                            'slug': city['slug'],
                             'region': city['region_name'],
                             'region_id': city['region_id'],
                             'work_hours': city.get('work_hours'),
@@ -236,7 +454,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     
                     cache_header = 'no-cache' if show_all else 'public, max-age=86400'
                     
-                    return {
+                    return conditional_response(event, {
                         'statusCode': 200,
                         'headers': {
                             'Content-Type': 'application/json',
@@ -245,7 +463,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         },
                         'isBase64Encoded': False,
                         'body': json.dumps({'cities': grouped_cities}, ensure_ascii=False, default=decimal_default)
-                    }
+                    })
         
         elif method == 'POST':
             if action == 'settlements_bulk':
@@ -450,6 +668,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         (name, region_name, region_id, timezone, work_hours, address, price_markup_percent)
                     )
                     new_city = cur.fetchone()
+                    cur.execute(
+                        'UPDATE cities SET slug = t_p90017259_flo_rustic_shop.city_slug_for(id, name) WHERE id = %s RETURNING slug',
+                        (new_city['id'],)
+                    )
+                    new_city['slug'] = cur.fetchone()['slug']
                     city_id = new_city['id']
                     
                     working_hours_text = 'Круглосуточно'
@@ -475,6 +698,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Бесплатная доставка в пределах центра'
                     ))
                     
+                    refresh_city_catalog(cur, city_id=city_id)
+                    bump_catalog_version(cur)
                     conn.commit()
                     
                     return {
@@ -663,6 +888,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         }
                     
                     updated = cur.fetchone()
+                    bump_catalog_version(cur)
                     conn.commit()
                     
                     return {
@@ -694,10 +920,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     if is_active is not None:
                         cur.execute('''
                             UPDATE cities 
-                            SET is_active = %s
+                            SET is_active = %s,
+                                slug = CASE
+                                    WHEN %s AND (slug IS NULL OR EXISTS (
+                                        SELECT 1 FROM cities other
+                                        WHERE other.slug = cities.slug AND other.is_active = true AND other.id <> cities.id
+                                    ))
+                                    THEN t_p90017259_flo_rustic_shop.city_slug_for(id, name)
+                                    ELSE slug
+                                END,
+                                updated_at = CURRENT_TIMESTAMP
                             WHERE id = %s
-                            RETURNING id, name, region_id, timezone, work_hours, address, is_active, price_markup_percent
-                        ''', (is_active, city_id))
+                            RETURNING id, name, slug, region_id, timezone, work_hours, address, is_active, price_markup_percent
+                        ''', (is_active, bool(is_active), city_id))
                         updated = cur.fetchone()
                     else:
                         name = body_data.get('name', '').strip()
@@ -736,10 +971,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         
                         cur.execute('''
                             UPDATE cities 
-                            SET name = %s, region = %s, region_id = %s, timezone = %s, work_hours = %s, address = %s, price_markup_percent = %s 
+                            SET name = %s,
+                                slug = CASE
+                                    WHEN slug IS NULL OR name IS DISTINCT FROM %s
+                                    THEN t_p90017259_flo_rustic_shop.city_slug_for(id, %s)
+                                    ELSE slug
+                                END,
+                                region = %s, region_id = %s, timezone = %s, work_hours = %s, address = %s, price_markup_percent = %s,
+                                updated_at = CURRENT_TIMESTAMP
                             WHERE id = %s
-                            RETURNING id, name, region_id, timezone, work_hours, address, is_active, price_markup_percent
-                        ''', (name, region_name, region_id, timezone, work_hours, address, price_markup_percent, city_id))
+                            RETURNING id, name, slug, region_id, timezone, work_hours, address, is_active, price_markup_percent
+                        ''', (name, name, name, region_name, region_id, timezone, work_hours, address, price_markup_percent, city_id))
                         
                         updated = cur.fetchone()
                         
@@ -750,6 +992,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                                 WHERE city_id = %s
                             ''', (address, city_id))
                     
+                    refresh_city_catalog(cur, city_id=int(city_id))
+                    bump_catalog_version(cur)
                     conn.commit()
                     
                     return {
@@ -833,6 +1077,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 with conn.cursor() as cur:
                     cur.execute('UPDATE regions SET is_active = false WHERE id = %s', (region_id,))
+                    bump_catalog_version(cur)
                     conn.commit()
                     
                     return {
@@ -859,7 +1104,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 with conn.cursor() as cur:
-                    cur.execute('UPDATE cities SET is_active = false WHERE id = %s', (city_id,))
+                    cur.execute('UPDATE cities SET is_active = false, updated_at = CURRENT_TIMESTAMP WHERE id = %s', (city_id,))
+                    refresh_city_catalog(cur, city_id=int(city_id))
+                    bump_catalog_version(cur)
                     conn.commit()
                     
                     return {
@@ -893,4 +1140,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
\ No newline at end of file
@@ -0,0 +1,334 @@
+import functools
+import json
+import os
+import re
+import smtplib
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, Any, List, Optional
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import RealDictCursor
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '120'))
+OUTBOX_BACKOFF_BASE = int(os.environ.get('OUTBOX_BACKOFF_BASE', '30'))
+OUTBOX_BACKOFF_MAX = int(os.environ.get('OUTBOX_BACKOFF_MAX', '3600'))
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.yandex.ru')
+SMTP_TIMEOUT = int(os.environ.get('SMTP_TIMEOUT', '15'))
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+def claim_batch(conn, limit: int) -> List[Dict[str, Any]]:
+    '''
+    Lease up to `limit` due messages. SKIP LOCKED lets parallel workers take disjoint rows;
+    the lease pushes next_attempt_at forward, so a worker that dies mid-batch only delays them.
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('''
+            UPDATE t_p90017259_flo_rustic_shop.notification_outbox o
+            SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE o.id IN (
+                SELECT id FROM t_p90017259_flo_rustic_shop.notification_outbox
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.kind, o.order_id, o.recipient, o.subject, o.body, o.attempts
+        ''', (OUTBOX_LEASE_SECONDS, limit))
+        messages = [dict(row) for row in cur.fetchall()]
+    conn.commit()
+    return sorted(messages, key=lambda m: m['id'])
+
+def mark_sent(conn, message_id: int) -> None:
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE t_p90017259_flo_rustic_shop.notification_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL
+            WHERE id = %s
+        ''', (message_id,))
+    conn.commit()
+
+def mark_failed(conn, message: Dict[str, Any], error: str) -> None:
+    '''Schedule a retry with exponential backoff, or give up after OUTBOX_MAX_ATTEMPTS'''
+    attempts = message['attempts'] + 1
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+    status = 'failed' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE t_p90017259_flo_rustic_shop.notification_outbox
+            SET status = %s, attempts = %s, last_error = %s,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id = %s
+        ''', (status, attempts, error[:1000], delay, message['id']))
+    conn.commit()
+
+def open_smtp(smtp_user: str, smtp_password: str) -> smtplib.SMTP:
+    server = smtplib.SMTP(SMTP_HOST, int(os.environ.get('SMTP_PORT', '587')), timeout=SMTP_TIMEOUT)
+    server.starttls()
+    server.login(smtp_user, smtp_password)
+    return server
+
+def close_smtp(server: Optional[smtplib.SMTP]) -> None:
+    if server is None:
+        return
+    try:
+        server.quit()
+    except smtplib.SMTPException:
+        server.close()
+    except OSError:
+        pass
+
+def build_message(message: Dict[str, Any], smtp_user: str) -> MIMEMultipart:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = message['subject']
+    msg['From'] = smtp_user
+    msg['To'] = message['recipient'] or smtp_user
+    msg.attach(MIMEText(message['body'], 'plain', 'utf-8'))
+    return msg
+
+def drain_outbox(conn, max_batches: int = 5) -> Dict[str, int]:
+    '''
+    Send due messages over a single SMTP session (reconnecting once per message if the
+    server drops it). Each result is committed right away, so a crash never resends mail
+    that was already recorded as sent.
+    '''
+    smtp_user = os.environ.get('SMTP_USER')
+    smtp_password = os.environ.get('SMTP_PASSWORD')
+    if not smtp_user or not smtp_password:
+        return {'sent': 0, 'failed': 0}
+
+    sent = failed = 0
+    server = None
+    try:
+        for _ in range(max_batches):
+            messages = claim_batch(conn, OUTBOX_BATCH_SIZE)
+            if not messages:
+                break
+            for message in messages:
+                msg = build_message(message, smtp_user)
+                try:
+                    try:
+                        if server is None:
+                            server = open_smtp(smtp_user, smtp_password)
+                        server.send_message(msg)
+                    except (smtplib.SMTPServerDisconnected, ConnectionError):
+                        close_smtp(server)
+                        server = open_smtp(smtp_user, smtp_password)
+                        server.send_message(msg)
+                except (smtplib.SMTPException, OSError) as e:
+                    print(f"Outbox message {message['id']} failed: {e}")
+                    mark_failed(conn, message, str(e))
+                    failed += 1
+                    if isinstance(e, smtplib.SMTPAuthenticationError):
+                        close_smtp(server)
+                        return {'sent': sent, 'failed': failed}
+                    continue
+                mark_sent(conn, message['id'])
+                sent += 1
+    finally:
+        close_smtp(server)
+    return {'sent': sent, 'failed': failed}
+
+@instrument_db
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Send queued order emails from notification_outbox
+    Args: event from the timer trigger (or a manual POST); orders and yukassa-webhook only enqueue
+          context with request_id attribute
+    Returns: HTTP response with sent and failed counters
+    '''
+    method: str = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Database not configured'}),
+            'isBase64Encoded': False
+        }
+
+    conn = get_db_connection(database_url)
+    try:
+        result = drain_outbox(conn)
+    finally:
+        release_db_connection(conn)
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
@@ -1,36 +1,444 @@
+import base64
+import csv
+import functools
+import gzip
+import io
 import json
 import os
+import re
+import time
 import psycopg2
+import psycopg2.errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
-from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from tempfile import SpooledTemporaryFile
 import uuid
 import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', '1000'))
+EXPORT_INLINE_MAX_BYTES = int(os.environ.get('EXPORT_INLINE_MAX_BYTES', str(1024 * 1024)))
+EXPORT_URL_TTL = int(os.environ.get('EXPORT_URL_TTL', '3600'))
+EXPORT_COLUMNS = [
+    'id', 'order_number', 'created_at', 'status', 'payment_status', 'payment_method', 'payment_id',
+    'city_name', 'customer_name', 'customer_phone', 'customer_email',
+    'recipient_name', 'recipient_phone', 'sender_name', 'sender_phone',
+    'delivery_address', 'delivery_date', 'delivery_time', 'postcard_text',
+    'items', 'total_amount', 'discount_amount', 'promo_code'
+]
+
+YUKASSA_API_URL = os.environ.get('YUKASSA_API_URL', 'https://api.yookassa.ru/v3').rstrip('/')
+YUKASSA_CONNECT_TIMEOUT = float(os.environ.get('YUKASSA_CONNECT_TIMEOUT', '3.05'))
+YUKASSA_READ_TIMEOUT = float(os.environ.get('YUKASSA_READ_TIMEOUT', '10'))
+YUKASSA_MAX_RETRIES = int(os.environ.get('YUKASSA_MAX_RETRIES', '2'))
+YUKASSA_IDEMPOTENCE_NAMESPACE = uuid.UUID('6f1c0a2e-4b7d-5e3a-9c1f-90017259f10e')
+
+_yukassa_session = None
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+# Номер заказа берётся из строки-счётчика в том же запросе, что и INSERT:
+# строка заблокирована до COMMIT, так что параллельные оформления получают разные номера без дыр
+INSERT_ORDER_SQL = '''
+    WITH next_number AS (
+        UPDATE t_p90017259_flo_rustic_shop.order_number_counter
+        SET last_value = last_value + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        RETURNING last_value
+    )
+    INSERT INTO orders (
+        order_number, customer_name, customer_phone, customer_email,
+        city_id, delivery_address, items, total_amount, status,
+        promo_code_id, discount_amount,
+        recipient_name, recipient_phone, sender_name, sender_phone,
+        delivery_date, delivery_time, postcard_text, payment_method
+    )
+    SELECT next_number.last_value::text, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    FROM next_number
+    RETURNING id, order_number
+'''
+
+# Одним запросом: привязать платёж к заказу и поставить письмо в outbox
+ATTACH_PAYMENT_SQL = '''
+    WITH updated AS (
+        UPDATE orders SET payment_id = %s
+        WHERE id = %s
+        RETURNING id
+    )
+    INSERT INTO t_p90017259_flo_rustic_shop.notification_outbox (kind, order_id, dedupe_key, subject, body)
+    SELECT 'order_email', updated.id, %s, %s, %s
+    FROM updated
+    ON CONFLICT (dedupe_key) DO NOTHING
+'''
+
+def encode_cursor(created_at: datetime, order_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), order_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    '''Opaque cursor -> (created_at, id) of the last order on the previous page; ValueError if malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def parse_page_size(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+def order_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''
+    WHERE conditions shared by the admin list and summary: status, payment_status, city_id
+    and an inclusive date_from/date_to (YYYY-MM-DD) range on created_at. ValueError on bad input.
+    '''
+    filters: List[str] = []
+    filter_params: List[Any] = []
+    for column in ('status', 'payment_status'):
+        if params.get(column):
+            filters.append(f'o.{column} = %s')
+            filter_params.append(params[column])
+    if params.get('city_id'):
+        filters.append('o.city_id = %s')
+        filter_params.append(int(params['city_id']))
+    if params.get('date_from'):
+        filters.append('o.created_at >= %s')
+        filter_params.append(date.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        filters.append('o.created_at < %s')
+        filter_params.append(date.fromisoformat(params['date_to']) + timedelta(days=1))
+    return filters, filter_params
+
+def fetch_orders_summary(cursor, filters: List[str], filter_params: List[Any]) -> Dict[str, Any]:
+    '''Order counts and revenue in total, per status, per payment_status and per day, in one GROUPING SETS query'''
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    cursor.execute(f'''
+        SELECT GROUPING(o.status) as all_statuses,
+               GROUPING(o.payment_status) as all_payment_statuses,
+               GROUPING(o.created_at::date) as all_days,
+               o.status, o.payment_status, o.created_at::date as day,
+               COUNT(*) as orders_count, COALESCE(SUM(o.total_amount), 0) as revenue
+        FROM orders o
+        {where}
+        GROUP BY GROUPING SETS ((), (o.status), (o.payment_status), (o.created_at::date))
+    ''', filter_params)
+    summary: Dict[str, Any] = {'total': {'count': 0, 'revenue': 0.0}, 'by_status': [],
+                               'by_payment_status': [], 'by_day': []}
+    for row in cursor.fetchall():
+        entry = {'count': row['orders_count'], 'revenue': float(row['revenue'])}
+        if not row['all_statuses']:
+            summary['by_status'].append(dict(entry, status=row['status']))
+        elif not row['all_payment_statuses']:
+            summary['by_payment_status'].append(dict(entry, payment_status=row['payment_status']))
+        elif not row['all_days']:
+            summary['by_day'].append(dict(entry, day=row['day'].isoformat()))
+        else:
+            summary['total'] = entry
+    summary['by_day'].sort(key=lambda item: item['day'])
+    return summary
+
+def export_value(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def iter_export_chunks(rows: Iterable[Dict[str, Any]], export_format: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    '''Encode rows as CSV (UTF-8 with BOM for Excel) or NDJSON, yielding ~chunk_size byte pieces'''
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        buffer.write('\ufeff')
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        if writer:
+            writer.writerow([export_value(row.get(column)) for column in EXPORT_COLUMNS])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in EXPORT_COLUMNS},
+                                    ensure_ascii=False, default=export_value))
+            buffer.write('\n')
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def export_orders(conn, event: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Stream filtered orders through a named (server-side) cursor into a spooled temp file.
+    Small exports are returned inline; larger ones go to S3 and the response carries a
+    presigned download URL, so neither the function memory nor the response size grows
+    with the order history.
+    '''
+    export_format = params.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        raise ValueError('format must be csv or ndjson')
+    filters, filter_params = order_filters(params)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+
+    spool = SpooledTemporaryFile(max_size=EXPORT_INLINE_MAX_BYTES)
+    with conn.cursor(name='orders_export', cursor_factory=RealDictCursor) as export_cursor:
+        export_cursor.itersize = EXPORT_ITERSIZE
+        export_cursor.execute(f'''
+            SELECT o.*, c.name as city_name, pc.code as promo_code
+            FROM orders o
+            LEFT JOIN cities c ON o.city_id = c.id
+            LEFT JOIN promo_codes pc ON o.promo_code_id = pc.id
+            {where}
+            ORDER BY o.created_at, o.id
+        ''', filter_params)
+        for chunk in iter_export_chunks(export_cursor, export_format):
+            spool.write(chunk)
+    size = spool.tell()
+    spool.seek(0)
+
+    content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    period = f"{params.get('date_from', 'start')}_{params.get('date_to', 'now')}"
+    filename = f'orders_{period}.{export_format}'
+
+    if size <= EXPORT_INLINE_MAX_BYTES and params.get('delivery') != 's3':
+        body = spool.read().decode('utf-8')
+        spool.close()
+        return compress_response(event, {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': content_type,
+                'Content-Disposition': f'attachment; filename="{filename}"',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': body,
+            'isBase64Encoded': False
+        })
+
+    import boto3
+
+    s3_client = boto3.client(
+        's3',
+        endpoint_url=os.environ.get('S3_ENDPOINT'),
+        aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+        aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
+        region_name='ru-central1'
+    )
+    bucket_name = os.environ.get('S3_BUCKET')
+    s3_key = f'exports/{uuid.uuid4()}/{filename}'
+    s3_client.upload_fileobj(spool, bucket_name, s3_key, ExtraArgs={
+        'ContentType': content_type,
+        'ContentDisposition': f'attachment; filename="{filename}"'
+    })
+    spool.close()
+    url = s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': bucket_name, 'Key': s3_key}, ExpiresIn=EXPORT_URL_TTL
+    )
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'url': url, 'expires_in': EXPORT_URL_TTL, 'bytes': size, 'filename': filename}),
+        'isBase64Encoded': False
+    }
+
+def resync_order_number_counter(cursor) -> None:
+    '''Move the counter past the largest numeric order_number (slow path, only after a collision)'''
+    cursor.execute('''
+        UPDATE t_p90017259_flo_rustic_shop.order_number_counter
+        SET last_value = GREATEST(last_value, (
+            SELECT COALESCE(MAX(CAST(order_number AS BIGINT)), 0)
+            FROM orders
+            WHERE order_number ~ '^[0-9]+$'
+        )), updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    ''')
 
 def decimal_to_float(obj):
     if isinstance(obj, Decimal):
         return float(obj)
     raise TypeError
 
-def send_order_notification(order: dict, payment_status: str):
-    smtp_user = os.environ.get('SMTP_USER')
-    smtp_password = os.environ.get('SMTP_PASSWORD')
-    smtp_port = os.environ.get('SMTP_PORT', '587')
-    
-    if not smtp_user or not smtp_password:
-        return
-    
+def render_order_notification(order: dict, payment_status: str) -> Tuple[str, str]:
+    '''Subject and plain-text body of the shop's new-order email'''
     status_emoji = '⏳' if payment_status == 'pending' else '✅'
     status_text = 'ОЖИДАЕТ ОПЛАТЫ' if payment_status == 'pending' else 'ОПЛАЧЕН'
     
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = f'Новый заказ #{order["order_number"]} - {status_text}'
-    msg['From'] = smtp_user
-    msg['To'] = smtp_user
+    subject = f'Новый заказ #{order["order_number"]} - {status_text}'
     
     items_text = '\n'.join([
         f"  - {item['name']} x {item['quantity']} = {item['price'] * item['quantity']} ₽"
@@ -86,17 +494,95 @@ def send_order_notification(order: dict, payment_status: str):
 Способ оплаты: {order.get('payment_method', 'online')}
 '''
     
-    msg.attach(MIMEText(text_content, 'plain', 'utf-8'))
-    
-    try:
-        server = smtplib.SMTP('smtp.yandex.ru', int(smtp_port))
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-        server.quit()
-    except Exception as e:
-        pass
+    return subject, text_content
+
+def get_yukassa_session() -> requests.Session:
+    '''
+    Warm-container HTTP session for the YooKassa API: keeps the TLS connection alive
+    between invocations and retries connection errors, 429 and 5xx with backoff.
+    POST is retried on purpose, the Idempotence-Key makes repeats return the same payment.
+    '''
+    global _yukassa_session
+    if _yukassa_session is None:
+        retry = Retry(
+            total=YUKASSA_MAX_RETRIES,
+            connect=YUKASSA_MAX_RETRIES,
+            read=YUKASSA_MAX_RETRIES,
+            status=YUKASSA_MAX_RETRIES,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            backoff_factor=0.3,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=4)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _yukassa_session = session
+    return _yukassa_session
+
+def payment_idempotence_key(order_id: Any, amount: Any) -> str:
+    '''Same order and amount give the same key, so a repeated click or retry never creates a second payment'''
+    return str(uuid.uuid5(YUKASSA_IDEMPOTENCE_NAMESPACE, f'order-{order_id}-{Decimal(str(amount)):.2f}'))
+
+def create_yukassa_payment(payment_data: Dict[str, Any], idempotence_key: str,
+                           shop_id: str, secret_key: str) -> requests.Response:
+    return get_yukassa_session().post(
+        f'{YUKASSA_API_URL}/payments',
+        json=payment_data,
+        headers={
+            'Idempotence-Key': idempotence_key,
+            'Content-Type': 'application/json'
+        },
+        auth=(shop_id, secret_key),
+        timeout=(YUKASSA_CONNECT_TIMEOUT, YUKASSA_READ_TIMEOUT)
+    )
 
+def accepted_encodings(event: Dict[str, Any]) -> Dict[str, float]:
+    '''Accept-Encoding parsed into {coding: q}, codings with q=0 left out'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    encodings: Dict[str, float] = {}
+    for part in value.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            encodings[coding.strip().lower()] = q
+    return encodings
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Compress a text body with br (if the brotli module is installed) or gzip when the client
+    accepts it and the body is at least COMPRESSION_MIN_SIZE bytes; the result is base64 with
+    isBase64Encoded=True. A strong ETag becomes weak because the bytes on the wire differ.
+    '''
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body:
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = dict(response.get('headers') or {})
+    headers['Vary'] = 'Accept-Encoding'
+    accepted = accepted_encodings(event)
+    if brotli is not None and 'br' in accepted:
+        encoding, compressed = 'br', brotli.compress(raw, quality=BROTLI_QUALITY)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    else:
+        return dict(response, headers=headers)
+    headers['Content-Encoding'] = encoding
+    if headers.get('ETag', '').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+    return dict(response, headers=headers, isBase64Encoded=True, body=base64.b64encode(compressed).decode('ascii'))
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление заказами интернет-магазина
@@ -129,13 +615,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(dsn)
+        conn = get_db_connection(dsn)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         if method == 'GET':
             params = event.get('queryStringParameters') or {}
             order_id = params.get('id')
             
+            if params.get('action') == 'export':
+                try:
+                    return export_orders(conn, event, params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
+            
             if order_id:
                 cursor.execute('''
                     SELECT o.*, c.name as city_name, c.region,
@@ -163,37 +660,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             else:
-                status_filter = params.get('status')
+                try:
+                    filters, filter_params = order_filters(params)
+                    paginated = bool(params.get('limit') or params.get('cursor'))
+                    limit = parse_page_size(params.get('limit'))
+                    after = decode_cursor(params['cursor']) if params.get('cursor') else None
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
+                
+                if params.get('summary') == 'true':
+                    return compress_response(event, {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'summary': fetch_orders_summary(cursor, filters, filter_params)}, default=str),
+                        'isBase64Encoded': False
+                    })
                 
-                if status_filter:
-                    cursor.execute('''
-                        SELECT o.*, c.name as city_name, c.region,
-                               pc.code as promo_code, pc.discount_percent as promo_discount
-                        FROM orders o
-                        LEFT JOIN cities c ON o.city_id = c.id
-                        LEFT JOIN promo_codes pc ON o.promo_code_id = pc.id
-                        WHERE o.status = %s
-                        ORDER BY o.created_at DESC
-                    ''', (status_filter,))
-                else:
-                    cursor.execute('''
-                        SELECT o.*, c.name as city_name, c.region,
-                               pc.code as promo_code, pc.discount_percent as promo_discount
-                        FROM orders o
-                        LEFT JOIN cities c ON o.city_id = c.id
-                        LEFT JOIN promo_codes pc ON o.promo_code_id = pc.id
-                        ORDER BY o.created_at DESC
-                    ''')
+                # Без limit/cursor отдаём прежний массив целиком, с ними — страницу и next_cursor
+                if after:
+                    filters.append('(o.created_at, o.id) < (%s::timestamp, %s)')
+                    filter_params.extend(after)
+                where = f"WHERE {' AND '.join(filters)}" if filters else ''
+                limit_clause = 'LIMIT %s' if paginated else ''
+                cursor.execute(f'''
+                    SELECT o.*, c.name as city_name, c.region,
+                           pc.code as promo_code, pc.discount_percent as promo_discount
+                    FROM orders o
+                    LEFT JOIN cities c ON o.city_id = c.id
+                    LEFT JOIN promo_codes pc ON o.promo_code_id = pc.id
+                    {where}
+                    ORDER BY o.created_at DESC, o.id DESC
+                    {limit_clause}
+                ''', filter_params + ([limit + 1] if paginated else []))
                 
                 orders = cursor.fetchall()
                 result = [dict(order) for order in orders]
+                if paginated:
+                    next_cursor = None
+                    if len(result) > limit:
+                        result = result[:limit]
+                        next_cursor = encode_cursor(result[-1]['created_at'], result[-1]['id'])
+                    result = {'orders': result, 'next_cursor': next_cursor}
                 
-                return {
+                return compress_response(event, {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps(result, default=str),
                     'isBase64Encoded': False
-                }
+                })
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -224,13 +743,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                idempotence_key = str(uuid.uuid4())
+                try:
+                    idempotence_key = payment_idempotence_key(order_id, amount)
+                except ArithmeticError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid amount'}),
+                        'isBase64Encoded': False
+                    }
                 
-                cursor.execute('''
-                    SELECT customer_name, customer_email, customer_phone, total_amount
-                    FROM orders WHERE id = %s
-                ''', (order_id,))
+                # Заказ читается без блокировки, и транзакция закрывается до запроса в ЮKassa,
+                # чтобы вебхук не ждал ответа провайдера. Параллельный повтор того же платежа
+                # получит от ЮKassa тот же платёж по Idempotence-Key, а письмо не задвоится по dedupe_key
+                cursor.execute('SELECT * FROM orders WHERE id = %s', (order_id,))
                 order_info = cursor.fetchone()
+                conn.commit()
                 
                 if not order_info:
                     return {
@@ -254,9 +782,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'payment_mode': 'full_prepayment'
                 }]
                 
-                cursor.execute('SELECT order_number FROM orders WHERE id = %s', (order_id,))
-                order_num_row = cursor.fetchone()
-                order_num = order_num_row['order_number'] if order_num_row else str(order_id)
+                order_num = order_info['order_number'] or str(order_id)
                 
                 payment_data = {
                     'amount': {
@@ -283,15 +809,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 print(f'Payment data with receipt: {json.dumps(payment_data, ensure_ascii=False)}')
                 
-                response = requests.post(
-                    'https://api.yookassa.ru/v3/payments',
-                    json=payment_data,
-                    headers={
-                        'Idempotence-Key': idempotence_key,
-                        'Content-Type': 'application/json'
-                    },
-                    auth=(shop_id, secret_key)
-                )
+                try:
+                    response = create_yukassa_payment(payment_data, idempotence_key, shop_id, secret_key)
+                except requests.RequestException as e:
+                    print(f'YooKassa API unreachable: {e}')
+                    return {
+                        'statusCode': 502,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Payment provider unavailable'}),
+                        'isBase64Encoded': False
+                    }
                 
                 if response.status_code != 200:
                     error_details = response.text
@@ -305,24 +832,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 payment_info = response.json()
                 
-                cursor.execute('''
-                    UPDATE orders
-                    SET payment_id = %s
-                    WHERE id = %s
-                    RETURNING *
-                ''', (payment_info['id'], order_id))
-                updated_order = cursor.fetchone()
+                order_dict = dict(order_info)
+                order_dict['payment_id'] = payment_info['id']
+                if isinstance(order_dict.get('items'), str):
+                    order_dict['items'] = json.loads(order_dict['items'])
+                subject, text_content = render_order_notification(order_dict, 'pending')
+                cursor.execute(ATTACH_PAYMENT_SQL, (
+                    payment_info['id'], order_id,
+                    f"order-{order_dict['id']}-pending-{payment_info['id']}", subject, text_content
+                ))
                 conn.commit()
                 
-                if updated_order:
-                    order_dict = dict(updated_order)
-                    if isinstance(order_dict.get('items'), str):
-                        order_dict['items'] = json.loads(order_dict['items'])
-                    send_order_notification(order_dict, 'pending')
-                
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
                     'body': json.dumps({
                         'payment_id': payment_info['id'],
                         'payment_url': payment_info['confirmation']['confirmation_url'],
@@ -331,10 +857,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cursor.execute("SELECT COALESCE(MAX(CAST(order_number AS INTEGER)), 0) + 1 as next_number FROM orders WHERE order_number ~ '^[0-9]+$'")
-            next_order_result = cursor.fetchone()
-            order_number = str(next_order_result['next_number'])
-            
             promo_code = body_data.get('promo_code')
             promo_code_id = None
             
@@ -344,17 +866,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if promo_result:
                     promo_code_id = promo_result['id']
             
-            cursor.execute('''
-                INSERT INTO orders (
-                    order_number, customer_name, customer_phone, customer_email,
-                    city_id, delivery_address, items, total_amount, status,
-                    promo_code_id, discount_amount,
-                    recipient_name, recipient_phone, sender_name, sender_phone,
-                    delivery_date, delivery_time, postcard_text, payment_method
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, order_number
-            ''', (
-                order_number,
+            order_values = (
                 body_data.get('customer_name'),
                 body_data.get('customer_phone'),
                 body_data.get('customer_email'),
@@ -373,7 +885,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('delivery_time'),
                 body_data.get('postcard_text'),
                 body_data.get('payment_method', 'cash')
-            ))
+            )
+            try:
+                cursor.execute(INSERT_ORDER_SQL, order_values)
+            except psycopg2.errors.UniqueViolation as e:
+                if 'order_number' not in (e.diag.constraint_name or ''):
+                    raise
+                # Номер занят заказом, созданным в обход счётчика: подтягиваем счётчик и повторяем один раз
+                conn.rollback()
+                resync_order_number_counter(cursor)
+                cursor.execute(INSERT_ORDER_SQL, order_values)
             
             result = cursor.fetchone()
             order_id = result['id']
@@ -496,4 +1017,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
@@ -1,10 +1,749 @@
+import base64
+import functools
+import hashlib
+import gzip
 import json
 import os
-from typing import Dict, Any, List, Optional
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
 from decimal import Decimal
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
 from psycopg2.extras import RealDictCursor
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+# Серверные prepared statements живут в сессии, поэтому привязаны к текущему соединению.
+# DB_PREPARED_STATEMENTS=0 отключает их (например, за пулером в режиме transaction).
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+DB_PREPARED_STATEMENTS_MAX = int(os.environ.get('DB_PREPARED_STATEMENTS_MAX', '64'))
+
+_prepared_statements: Dict[str, str] = {}
+
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', '256'))
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', '300'))
+CATALOG_VERSION_CHECK_INTERVAL = int(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', '5'))
+
+_catalog_cache: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+_catalog_version: Optional[int] = None
+_catalog_version_checked_at = 0.0
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 200
+
+# Встроенные base64-картинки длиннее этого порога в списках не отдаются
+INLINE_IMAGE_MAX_LENGTH = 5000
+
+# Выражения для fields=; price и created_at зависят от источника (матрица города или базовые цены).
+# octet_length читает размер из заголовка TOAST, так что огромные base64 даже не распаковываются.
+PRODUCT_COLUMNS = {
+    'id': 'p.id',
+    'name': 'p.name',
+    'description': 'p.description',
+    'composition': 'p.composition',
+    'image_url': f"CASE WHEN octet_length(p.image_url) > {INLINE_IMAGE_MAX_LENGTH} THEN '' ELSE p.image_url END",
+    'category': 'p.category',
+    'is_featured': 'p.is_featured',
+    'is_gift': 'p.is_gift',
+    'is_recommended': 'p.is_recommended',
+    'subcategory_id': 'p.subcategory_id',
+    'subcategory_name': 's.name',
+    'base_price': 'p.base_price',
+    'is_active': 'p.is_active',
+    'price': None,
+    'created_at': None,
+}
+# card — ровно то, что показывает ProductCard в сетке каталога
+FIELD_PRESETS = {
+    'card': ['id', 'name', 'description', 'price', 'image_url'],
+}
+CITY_LIST_FIELDS = ['id', 'name', 'description', 'composition', 'image_url', 'category', 'is_featured',
+                    'is_gift', 'is_recommended', 'subcategory_id', 'subcategory_name', 'created_at', 'price']
+BASE_LIST_FIELDS = ['id', 'name', 'description', 'composition', 'image_url', 'category', 'is_featured',
+                    'is_gift', 'is_recommended', 'subcategory_id', 'subcategory_name', 'created_at',
+                    'base_price', 'is_active']
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+    _prepared_statements.clear()
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+def build_select(projection: str, source: str, filters: List[str], params: List[Any],
+                 order_by: str = '', limit: Optional[int] = None) -> Tuple[str, List[Any]]:
+    '''
+    Assemble a SELECT from fragments that contain only %s placeholders.
+    Values always travel in params, so the SQL text depends on the query shape alone.
+    '''
+    sql = f'SELECT {projection} FROM {source}'
+    if filters:
+        sql += ' WHERE ' + ' AND '.join(filters)
+    if order_by:
+        sql += f' ORDER BY {order_by}'
+    params = list(params)
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    return sql, params
+
+def execute_prepared(cur, sql: str, params: List[Any]) -> None:
+    '''
+    Run a parameterized query through PREPARE/EXECUTE so the plan is reused by later
+    requests on the same warm connection. Statements are named by a hash of the SQL text;
+    past DB_PREPARED_STATEMENTS_MAX distinct shapes the query is executed directly.
+    '''
+    name = _prepared_statements.get(sql)
+    if name is None:
+        if not DB_PREPARED_STATEMENTS or len(_prepared_statements) >= DB_PREPARED_STATEMENTS_MAX:
+            cur.execute(sql, params)
+            return
+        name = 'products_' + hashlib.md5(sql.encode('utf-8')).hexdigest()[:16]
+        parts = sql.split('%s')
+        numbered = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], start=1))
+        cur.execute(f'PREPARE {name} AS {numbered}')
+        _prepared_statements[sql] = name
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError
+
+def refresh_city_catalog(cur, product_id: Optional[int] = None, city_id: Optional[int] = None) -> None:
+    '''Recompute product_city_catalog rows affected by an admin write (None means all)'''
+    cur.execute(
+        'SELECT t_p90017259_flo_rustic_shop.refresh_product_city_catalog(%s, %s)',
+        (product_id, city_id)
+    )
+
+def bump_catalog_version(cur) -> None:
+    '''Invalidate catalog caches in every warm container, starting with this one'''
+    global _catalog_version
+    cur.execute('''
+        UPDATE t_p90017259_flo_rustic_shop.catalog_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    ''')
+    _catalog_cache.clear()
+    _catalog_version = None
+
+def catalog_cache_key(query_params: Dict[str, Any]) -> Optional[str]:
+    '''Normalized cache key for a catalog GET; admin listings (show_all) are never cached'''
+    if query_params.get('show_all') == 'true':
+        return None
+    normalized = sorted(
+        (key, str(value).strip()) for key, value in query_params.items()
+        if value is not None and str(value).strip() != ''
+    )
+    return json.dumps(normalized, ensure_ascii=False)
+
+def catalog_version_is_fresh() -> bool:
+    '''Whether the locally known catalog_version was checked within CATALOG_VERSION_CHECK_INTERVAL'''
+    return (
+        _catalog_version is not None
+        and time.monotonic() - _catalog_version_checked_at <= CATALOG_VERSION_CHECK_INTERVAL
+    )
+
+def catalog_etag(cache_key: str) -> str:
+    '''Version-based ETag: the same query under the same catalog_version has the same body'''
+    digest = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()[:16]
+    return f'"catalog-{_catalog_version}-{digest}"'
+
+def get_cached_catalog(cache_key: str) -> Optional[str]:
+    '''
+    Cached response body, or None when missing, past CATALOG_CACHE_TTL, or when
+    catalog_version has not been re-checked within CATALOG_VERSION_CHECK_INTERVAL
+    '''
+    if not catalog_version_is_fresh():
+        return None
+    now = time.monotonic()
+    entry = _catalog_cache.get(cache_key)
+    if entry is None:
+        return None
+    stored_at, body = entry
+    if now - stored_at > CATALOG_CACHE_TTL:
+        del _catalog_cache[cache_key]
+        return None
+    _catalog_cache.move_to_end(cache_key)
+    return body
+
+def store_cached_catalog(cache_key: str, body: str) -> None:
+    _catalog_cache[cache_key] = (time.monotonic(), body)
+    _catalog_cache.move_to_end(cache_key)
+    while len(_catalog_cache) > CATALOG_CACHE_SIZE:
+        _catalog_cache.popitem(last=False)
+
+def sync_catalog_version(conn) -> None:
+    '''Read catalog_version and drop every cached response if an admin write bumped it'''
+    global _catalog_version, _catalog_version_checked_at
+    with conn.cursor() as cur:
+        execute_prepared(cur, 'SELECT version FROM t_p90017259_flo_rustic_shop.catalog_version WHERE id = 1', [])
+        row = cur.fetchone()
+    version = row[0] if row else 0
+    if version != _catalog_version:
+        _catalog_cache.clear()
+        _catalog_version = version
+    _catalog_version_checked_at = time.monotonic()
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    '''True when the request's If-None-Match already names this ETag (or is *)'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return False
+    candidates = [tag.strip() for tag in value.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def not_modified_response(etag: str, cache_control: str = 'no-cache') -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+def conditional_response(event: Dict[str, Any], response: Dict[str, Any], etag: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Attach a strong ETag to a 200 GET response (a hash of the body unless a version-based
+    tag is passed) and answer 304 without a body when If-None-Match already matches it
+    '''
+    if response.get('statusCode') != 200:
+        return response
+    etag = etag or make_etag(response['body'])
+    headers = dict(response.get('headers') or {})
+    headers['ETag'] = etag
+    headers.setdefault('Cache-Control', 'no-cache')
+    if etag_matches(event, etag):
+        return not_modified_response(etag, headers['Cache-Control'])
+    return dict(response, headers=headers)
+
+def cached_catalog_response(body: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+def encode_cursor(sort_key: datetime, product_id: int) -> str:
+    raw = json.dumps([sort_key.isoformat(), product_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    '''Opaque cursor -> (created_at, id) of the last row on the previous page; ValueError if malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_key, product_id = json.loads(raw)
+        return datetime.fromisoformat(sort_key), int(product_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def parse_page_size(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+def paginate(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''Trim the extra look-ahead row and build next_cursor from the last row kept'''
+    products = [dict(row) for row in rows[:limit]]
+    if len(rows) <= limit:
+        return products, None
+    last = products[-1]
+    return products, encode_cursor(last['created_at'], last['id'])
+
+def parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    '''Expand fields= (names and presets such as "card") into column names; ValueError on unknown ones'''
+    if not value:
+        return None
+    fields: List[str] = []
+    for name in (part.strip() for part in value.split(',')):
+        for field in FIELD_PRESETS.get(name, [name]):
+            if field not in PRODUCT_COLUMNS:
+                raise ValueError(f'Unknown field: {field}')
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+def select_list(fields: List[str], price_expr: str, sort_expr: str,
+                single_product: bool = False) -> Tuple[str, str]:
+    '''
+    SQL projection for the requested fields plus the subcategories join if it is needed.
+    id and created_at are always selected because pagination and relations rely on them.
+    A single product (id=) gets its image as stored, inline base64 included.
+    '''
+    expressions = dict(PRODUCT_COLUMNS, price=price_expr, created_at=sort_expr)
+    if single_product:
+        expressions['image_url'] = 'p.image_url'
+    columns = [name for name in ['id', 'created_at'] + fields if name in expressions]
+    projection = ', '.join(f'{expressions[name]} as {name}' for name in dict.fromkeys(columns))
+    subcategory_join = 'LEFT JOIN subcategories s ON s.id = p.subcategory_id' if 'subcategory_name' in fields else ''
+    return projection, subcategory_join
+
+def project_fields(products: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    return [{name: product.get(name) for name in fields} for product in products]
+
+def relation_filters(category: Optional[str], subcategory_id: Optional[int]) -> Tuple[str, List[str], List[Any]]:
+    if subcategory_id:
+        return 'JOIN product_subcategories ps ON ps.product_id = p.id', ['ps.subcategory_id = %s'], [subcategory_id]
+    if category:
+        return 'JOIN product_categories pc ON pc.product_id = p.id', ['pc.category = %s'], [category]
+    return '', [], []
+
+def fetch_city_catalog(cur, city_name: str, product_id: Optional[int] = None,
+                       category: Optional[str] = None,
+                       subcategory_id: Optional[int] = None,
+                       after: Optional[Tuple[datetime, int]] = None,
+                       limit: int = DEFAULT_PAGE_SIZE,
+                       fields: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''
+    Read one page of products with final city prices from the precomputed product_city_catalog.
+    Unknown or inactive cities fall back to base prices, as the former live join did.
+    '''
+    fields = fields or CITY_LIST_FIELDS
+    projection, subcategory_join = select_list(fields, 'pcc.price', 'pcc.sort_key', single_product=bool(product_id))
+    joins, filters, params = relation_filters(category, subcategory_id)
+    if product_id:
+        filters.append('p.id = %s')
+        params.append(product_id)
+    catalog_filters = ['c.name = %s', 'c.is_active = true'] + filters
+    catalog_params = [city_name] + params
+    if after:
+        catalog_filters.append('(pcc.sort_key, pcc.product_id) < (%s::timestamp, %s)')
+        catalog_params.extend(after)
+
+    source = ' '.join(part for part in [
+        'cities c',
+        'JOIN product_city_catalog pcc ON pcc.city_id = c.id AND pcc.is_available = true',
+        'JOIN products p ON p.id = pcc.product_id',
+        subcategory_join,
+        joins
+    ] if part)
+    sql, sql_params = build_select(projection, source, catalog_filters, catalog_params,
+                                   order_by='pcc.sort_key DESC, pcc.product_id DESC', limit=limit + 1)
+    execute_prepared(cur, sql, sql_params)
+    rows = cur.fetchall()
+    if rows:
+        return paginate(rows, limit)
+
+    execute_prepared(cur, 'SELECT 1 FROM cities WHERE name = %s AND is_active = true', [city_name])
+    if cur.fetchone():
+        return [], None
+
+    fallback_fields = [('price' if name in ('base_price', 'is_active') else name) for name in fields]
+    return fetch_product_list(cur, category, subcategory_id, product_id=product_id,
+                              after=after, limit=limit, fields=list(dict.fromkeys(fallback_fields)))
+
+def fetch_product_list(cur, category: Optional[str] = None, subcategory_id: Optional[int] = None,
+                       show_all: bool = False, product_id: Optional[int] = None,
+                       after: Optional[Tuple[datetime, int]] = None,
+                       limit: int = DEFAULT_PAGE_SIZE,
+                       fields: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''One page of products at base price, newest first, keyed on (created_at, id)'''
+    projection, subcategory_join = select_list(fields or BASE_LIST_FIELDS, 'p.base_price', 'p.created_at',
+                                               single_product=bool(product_id))
+    joins, filters, params = relation_filters(category, subcategory_id)
+    if not show_all:
+        filters.insert(0, 'p.is_active = true')
+    if product_id:
+        filters.append('p.id = %s')
+        params.append(product_id)
+    if after:
+        filters.append('(p.created_at, p.id) < (%s::timestamp, %s)')
+        params.extend(after)
+
+    source = ' '.join(part for part in ['products p', subcategory_join, joins] if part)
+    sql, sql_params = build_select(projection, source, filters, params,
+                                   order_by='p.created_at DESC, p.id DESC', limit=limit + 1)
+    execute_prepared(cur, sql, sql_params)
+    return paginate(cur.fetchall(), limit)
+
+def get_products(conn, event: Dict[str, Any]) -> Dict[str, Any]:
+    '''Catalog reads: subcategories, a single product, or a filtered product list'''
+    query_params = event.get('queryStringParameters') or {}
+    action = query_params.get('action')
+    product_id = query_params.get('id')
+    city_name = query_params.get('city')
+    category = query_params.get('category')
+    subcategory_id = query_params.get('subcategory_id')
+    with_relations = query_params.get('with_relations') == 'true'
+    show_all = query_params.get('show_all') == 'true'
+    
+    try:
+        limit = parse_page_size(query_params.get('limit'))
+        after = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Invalid cursor or limit'})
+        }
+    
+    try:
+        fields = parse_fields(query_params.get('fields'))
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    if action == 'subcategories':
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if category:
+                execute_prepared(cur, '''
+                    SELECT id, name, category, is_active
+                    FROM subcategories
+                    WHERE category = %s AND is_active = true
+                    ORDER BY name
+                ''', [category])
+            else:
+                cur.execute('''
+                    SELECT id, name, category, is_active
+                    FROM subcategories
+                    WHERE is_active = true
+                    ORDER BY category, name
+                ''')
+            
+            subcategories = [dict(row) for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'subcategories': subcategories}, ensure_ascii=False)
+            }
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if product_id:
+            if city_name:
+                products, _ = fetch_city_catalog(cur, city_name, product_id=int(product_id))
+            else:
+                filters = ['p.id = %s'] if show_all else ['p.id = %s', 'p.is_active = true']
+                sql, sql_params = build_select(
+                    'p.id, p.name, p.description, p.composition, p.image_url, p.base_price, p.category, p.is_featured, '
+                    'p.is_gift, p.is_recommended, p.is_active, p.subcategory_id, s.name as subcategory_name',
+                    'products p LEFT JOIN subcategories s ON s.id = p.subcategory_id',
+                    filters, [int(product_id)]
+                )
+                execute_prepared(cur, sql, sql_params)
+                products = [dict(row) for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'products': products}, default=decimal_default, ensure_ascii=False)
+            }
+        
+        elif city_name:
+            products, next_cursor = fetch_city_catalog(
+                cur, city_name,
+                category=category,
+                subcategory_id=int(subcategory_id) if subcategory_id else None,
+                after=after,
+                limit=limit,
+                fields=fields
+            )
+        else:
+            products, next_cursor = fetch_product_list(
+                cur,
+                category=category,
+                subcategory_id=int(subcategory_id) if subcategory_id else None,
+                show_all=show_all,
+                after=after,
+                limit=limit,
+                fields=fields
+            )
+        
+        # Добавляем categories/subcategories если запрошено или для конкретного товара
+        if (with_relations or product_id) and products:
+            product_ids = [p['id'] for p in products]
+            
+            # Получаем все категории одним запросом
+            execute_prepared(cur, '''
+                SELECT product_id, category 
+                FROM product_categories 
+                WHERE product_id = ANY(%s::int[])
+            ''', [product_ids])
+            categories_map = {}
+            for row in cur.fetchall():
+                pid = row['product_id']
+                if pid not in categories_map:
+                    categories_map[pid] = []
+                categories_map[pid].append(row['category'])
+            
+            # Получаем все подкатегории одним запросом
+            execute_prepared(cur, '''
+                SELECT ps.product_id, ps.subcategory_id, s.name, s.category 
+                FROM product_subcategories ps
+                JOIN subcategories s ON s.id = ps.subcategory_id
+                WHERE ps.product_id = ANY(%s::int[])
+            ''', [product_ids])
+            subcategories_map = {}
+            for row in cur.fetchall():
+                pid = row['product_id']
+                if pid not in subcategories_map:
+                    subcategories_map[pid] = []
+                subcategories_map[pid].append({
+                    'subcategory_id': row['subcategory_id'],
+                    'name': row['name'],
+                    'category': row['category']
+                })
+            
+            # Добавляем к товарам
+            for product in products:
+                product['categories'] = categories_map.get(product['id'], [])
+                product['subcategories'] = subcategories_map.get(product['id'], [])
+        
+        if fields:
+            output_fields = fields + (['categories', 'subcategories'] if with_relations else [])
+            products = project_fields(products, output_fields)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'products': products, 'next_cursor': next_cursor}, ensure_ascii=False, default=decimal_default)
+        }
+
+def accepted_encodings(event: Dict[str, Any]) -> Dict[str, float]:
+    '''Accept-Encoding parsed into {coding: q}, codings with q=0 left out'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    encodings: Dict[str, float] = {}
+    for part in value.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            encodings[coding.strip().lower()] = q
+    return encodings
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Compress a text body with br (if the brotli module is installed) or gzip when the client
+    accepts it and the body is at least COMPRESSION_MIN_SIZE bytes; the result is base64 with
+    isBase64Encoded=True. A strong ETag becomes weak because the bytes on the wire differ.
+    '''
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body:
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = dict(response.get('headers') or {})
+    headers['Vary'] = 'Accept-Encoding'
+    accepted = accepted_encodings(event)
+    if brotli is not None and 'br' in accepted:
+        encoding, compressed = 'br', brotli.compress(raw, quality=BROTLI_QUALITY)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    else:
+        return dict(response, headers=headers)
+    headers['Content-Encoding'] = encoding
+    if headers.get('ETag', '').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+    return dict(response, headers=headers, isBase64Encoded=True, body=base64.b64encode(compressed).decode('ascii'))
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Manage products (get, create, update, delete) and city-specific prices
@@ -38,274 +777,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database configuration missing'})
         }
     
+    cache_key = None
+    if method == 'GET':
+        cache_key = catalog_cache_key(event.get('queryStringParameters') or {})
+        if cache_key and catalog_version_is_fresh():
+            etag = catalog_etag(cache_key)
+            if etag_matches(event, etag):
+                return not_modified_response(etag)
+            cached_body = get_cached_catalog(cache_key)
+            if cached_body is not None:
+                return compress_response(event, conditional_response(event, cached_catalog_response(cached_body), etag))
+    
     conn = None
     try:
-        conn = psycopg2.connect(database_url, connect_timeout=5)
+        conn = get_db_connection(database_url)
         if method == 'GET':
-            query_params = event.get('queryStringParameters') or {}
-            action = query_params.get('action')
-            product_id = query_params.get('id')
-            city_name = query_params.get('city')
-            category = query_params.get('category')
-            subcategory_id = query_params.get('subcategory_id')
-            with_relations = query_params.get('with_relations') == 'true'
-            show_all = query_params.get('show_all') == 'true'
+            etag = None
+            if cache_key:
+                sync_catalog_version(conn)
+                etag = catalog_etag(cache_key)
+                # Клиент уже держит ответ для этой версии каталога: запрос к товарам не нужен
+                if etag_matches(event, etag):
+                    return not_modified_response(etag)
+                cached_body = get_cached_catalog(cache_key)
+                if cached_body is not None:
+                    return compress_response(event, conditional_response(event, cached_catalog_response(cached_body), etag))
             
-            if action == 'subcategories':
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    if category:
-                        safe_category = category.replace("'", "''")
-                        cur.execute(f'''
-                            SELECT id, name, category, is_active
-                            FROM subcategories
-                            WHERE category = '{safe_category}' AND is_active = true
-                            ORDER BY name
-                        ''')
-                    else:
-                        cur.execute('''
-                            SELECT id, name, category, is_active
-                            FROM subcategories
-                            WHERE is_active = true
-                            ORDER BY category, name
-                        ''')
-                    
-                    subcategories = [dict(row) for row in cur.fetchall()]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'subcategories': subcategories}, ensure_ascii=False)
-                    }
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if product_id:
-                    if city_name:
-                        safe_city_name = city_name.replace("'", "''")
-                        cur.execute(f'''
-                            SELECT p.id, p.name, p.description, p.composition, p.image_url, p.category, p.is_featured, p.is_gift, p.is_recommended, p.subcategory_id,
-                                   s.name as subcategory_name,
-                                   COALESCE(pcp.price, 
-                                           ROUND(p.base_price * (1 + COALESCE(c.price_markup_percent, 0) / 100), 2)
-                                   ) as price
-                            FROM products p
-                            LEFT JOIN cities c ON c.name = '{safe_city_name}' AND c.is_active = true
-                            LEFT JOIN product_city_prices pcp ON pcp.product_id = p.id AND pcp.city_id = c.id
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            WHERE p.is_active = true 
-                            AND p.id = {int(product_id)}
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_city_exclusions pce
-                                WHERE pce.product_id = p.id AND pce.city_id = c.id
-                            )
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_region_exclusions pre
-                                WHERE pre.product_id = p.id AND pre.region_id = c.region_id
-                            )
-                        ''')
-                    else:
-                        active_filter = '' if show_all else 'AND p.is_active = true'
-                        cur.execute(f'''
-                            SELECT p.id, p.name, p.description, p.composition, p.image_url, p.base_price, p.category, p.is_featured, p.is_gift, p.is_recommended, p.is_active, p.subcategory_id,
-                                   s.name as subcategory_name
-                            FROM products p
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            WHERE p.id = {int(product_id)} {active_filter}
-                        ''')
-                    
-                    products = [dict(row) for row in cur.fetchall()]
-                    
-                    def decimal_default(obj):
-                        if isinstance(obj, Decimal):
-                            return float(obj)
-                        raise TypeError
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'products': products}, default=decimal_default, ensure_ascii=False)
-                    }
-                
-                elif city_name:
-                    safe_city_name = city_name.replace("'", "''")
-                    if subcategory_id:
-                        cur.execute(f'''
-                            SELECT DISTINCT p.id, p.name, p.description, p.composition, p.image_url, p.category, p.is_featured, p.is_gift, p.is_recommended, p.subcategory_id,
-                                   s.name as subcategory_name, p.created_at,
-                                   COALESCE(pcp.price, 
-                                           ROUND(p.base_price * (1 + COALESCE(c.price_markup_percent, 0) / 100), 2)
-                                   ) as price
-                            FROM products p
-                            LEFT JOIN cities c ON c.name = '{safe_city_name}' AND c.is_active = true
-                            LEFT JOIN product_city_prices pcp ON pcp.product_id = p.id AND pcp.city_id = c.id
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            JOIN product_subcategories ps ON ps.product_id = p.id
-                            WHERE p.is_active = true 
-                            AND ps.subcategory_id = {int(subcategory_id)}
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_city_exclusions pce
-                                WHERE pce.product_id = p.id AND pce.city_id = c.id
-                            )
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_region_exclusions pre
-                                WHERE pre.product_id = p.id AND pre.region_id = c.region_id
-                            )
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                    elif category:
-                        safe_category = category.replace("'", "''")
-                        cur.execute(f'''
-                            SELECT DISTINCT p.id, p.name, p.description, p.composition, p.image_url, p.category, p.is_featured, p.is_gift, p.is_recommended, p.subcategory_id,
-                                   s.name as subcategory_name, p.created_at,
-                                   COALESCE(pcp.price, 
-                                           ROUND(p.base_price * (1 + COALESCE(c.price_markup_percent, 0) / 100), 2)
-                                   ) as price
-                            FROM products p
-                            LEFT JOIN cities c ON c.name = '{safe_city_name}' AND c.is_active = true
-                            LEFT JOIN product_city_prices pcp ON pcp.product_id = p.id AND pcp.city_id = c.id
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            JOIN product_categories pc ON pc.product_id = p.id
-                            WHERE p.is_active = true 
-                            AND pc.category = '{safe_category}'
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_city_exclusions pce
-                                WHERE pce.product_id = p.id AND pce.city_id = c.id
-                            )
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                    else:
-                        cur.execute(f'''
-                            SELECT p.id, p.name, p.description, p.composition, p.image_url, p.category, p.is_featured, p.is_gift, p.is_recommended, p.subcategory_id,
-                                   s.name as subcategory_name,
-                                   COALESCE(pcp.price, 
-                                           ROUND(p.base_price * (1 + COALESCE(c.price_markup_percent, 0) / 100), 2)
-                                   ) as price
-                            FROM products p
-                            LEFT JOIN cities c ON c.name = '{safe_city_name}' AND c.is_active = true
-                            LEFT JOIN product_city_prices pcp ON pcp.product_id = p.id AND pcp.city_id = c.id
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            WHERE p.is_active = true
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_city_exclusions pce
-                                WHERE pce.product_id = p.id AND pce.city_id = c.id
-                            )
-                            AND NOT EXISTS (
-                                SELECT 1 FROM t_p90017259_flo_rustic_shop.product_region_exclusions pre
-                                WHERE pre.product_id = p.id AND pre.region_id = c.region_id
-                            )
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                else:
-                    active_filter = '' if show_all else 'p.is_active = true AND'
-                    if subcategory_id:
-                        cur.execute(f'''
-                            SELECT DISTINCT p.id, p.name, p.description, p.composition, p.image_url, p.base_price, p.category, p.is_featured, p.is_gift, p.is_recommended, p.is_active, p.subcategory_id,
-                                   s.name as subcategory_name, p.created_at
-                            FROM products p
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            JOIN product_subcategories ps ON ps.product_id = p.id
-                            WHERE {active_filter} ps.subcategory_id = {int(subcategory_id)}
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                    elif category:
-                        safe_category = category.replace("'", "''")
-                        cur.execute(f'''
-                            SELECT DISTINCT p.id, p.name, p.description, p.composition, p.image_url, p.base_price, p.category, p.is_featured, p.is_gift, p.is_recommended, p.is_active, p.subcategory_id,
-                                   s.name as subcategory_name, p.created_at
-                            FROM products p
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            JOIN product_categories pc ON pc.product_id = p.id
-                            WHERE {active_filter} pc.category = '{safe_category}'
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                    else:
-                        active_condition = '' if show_all else 'WHERE p.is_active = true'
-                        cur.execute(f'''
-                            SELECT p.id, p.name, p.description, p.composition, p.image_url, p.base_price, p.category, p.is_featured, p.is_gift, p.is_recommended, p.is_active, p.subcategory_id,
-                                   s.name as subcategory_name
-                            FROM products p
-                            LEFT JOIN subcategories s ON s.id = p.subcategory_id
-                            {active_condition}
-                            ORDER BY p.created_at DESC
-                            LIMIT 100
-                        ''')
-                
-                products = [dict(row) for row in cur.fetchall()]
-                
-                # Очищаем base64 изображения (слишком большие для ответа)
-                for product in products:
-                    if product.get('image_url') and len(product['image_url']) > 5000:
-                        product['image_url'] = ''
-                
-                # Добавляем categories/subcategories если запрошено или для конкретного товара
-                if (with_relations or product_id) and products:
-                    product_ids = [p['id'] for p in products]
-                    product_ids_str = ','.join(map(str, product_ids))
-                    
-                    # Получаем все категории одним запросом
-                    cur.execute(f'''
-                        SELECT product_id, category 
-                        FROM product_categories 
-                        WHERE product_id IN ({product_ids_str})
-                    ''')
-                    categories_map = {}
-                    for row in cur.fetchall():
-                        pid = row['product_id']
-                        if pid not in categories_map:
-                            categories_map[pid] = []
-                        categories_map[pid].append(row['category'])
-                    
-                    # Получаем все подкатегории одним запросом
-                    cur.execute(f'''
-                        SELECT ps.product_id, ps.subcategory_id, s.name, s.category 
-                        FROM product_subcategories ps
-                        JOIN subcategories s ON s.id = ps.subcategory_id
-                        WHERE ps.product_id IN ({product_ids_str})
-                    ''')
-                    subcategories_map = {}
-                    for row in cur.fetchall():
-                        pid = row['product_id']
-                        if pid not in subcategories_map:
-                            subcategories_map[pid] = []
-                        subcategories_map[pid].append({
-                            'subcategory_id': row['subcategory_id'],
-                            'name': row['name'],
-                            'category': row['category']
-                        })
-                    
-                    # Добавляем к товарам
-                    for product in products:
-                        product['categories'] = categories_map.get(product['id'], [])
-                        product['subcategories'] = subcategories_map.get(product['id'], [])
-                
-                def decimal_default(obj):
-                    if isinstance(obj, Decimal):
-                        return float(obj)
-                    if hasattr(obj, 'isoformat'):
-                        return obj.isoformat()
-                    raise TypeError
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'products': products}, ensure_ascii=False, default=decimal_default)
-                }
+            response = get_products(conn, event)
+            if cache_key and response['statusCode'] == 200:
+                store_cached_catalog(cache_key, response['body'])
+            return compress_response(event, conditional_response(event, response, etag))
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -326,16 +827,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Name and category are required'})
                     }
                 
-                safe_name = name.replace("'", "''")
-                safe_category = category.replace("'", "''")
-                
                 with conn.cursor() as cur:
-                    cur.execute(f'''
+                    cur.execute('''
                         INSERT INTO subcategories (name, category, is_active)
-                        VALUES ('{safe_name}', '{safe_category}', true)
+                        VALUES (%s, %s, true)
                         RETURNING id
-                    ''')
+                    ''', (name, category))
                     subcategory_id = cur.fetchone()[0]
+                    bump_catalog_version(cur)
                     conn.commit()
                 
                 return {
@@ -370,58 +869,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Name and base_price are required'})
                     }
                 
-                safe_name = name.replace("'", "''")
-                safe_desc = description.replace("'", "''")
-                safe_comp = composition.replace("'", "''")
-                safe_img = image_url.replace("'", "''")
-                safe_cat = category.replace("'", "''")
-                
                 with conn.cursor() as cur:
-                    if subcategory_id:
-                        cur.execute(f'''
-                            INSERT INTO products (name, description, composition, image_url, base_price, category, subcategory_id)
-                            VALUES ('{safe_name}', '{safe_desc}', '{safe_comp}', '{safe_img}', {float(base_price)}, '{safe_cat}', {int(subcategory_id)})
-                            RETURNING id
-                        ''')
-                    else:
-                        cur.execute(f'''
-                            INSERT INTO products (name, description, composition, image_url, base_price, category)
-                            VALUES ('{safe_name}', '{safe_desc}', '{safe_comp}', '{safe_img}', {float(base_price)}, '{safe_cat}')
-                            RETURNING id
-                        ''')
+                    cur.execute('''
+                        INSERT INTO products (name, description, composition, image_url, base_price, category, subcategory_id)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    ''', (name, description, composition, image_url, float(base_price), category,
+                          int(subcategory_id) if subcategory_id else None))
                     product_id = cur.fetchone()[0]
                     
                     # Добавляем множественные категории
-                    if categories:
-                        for cat in categories:
-                            safe_category = cat.replace("'", "''")
-                            cur.execute(f'''
-                                INSERT INTO product_categories (product_id, category)
-                                VALUES ({product_id}, '{safe_category}')
-                                ON CONFLICT (product_id, category) DO NOTHING
-                            ''')
-                    elif category:
-                        cur.execute(f'''
+                    for cat in (categories or ([category] if category else [])):
+                        cur.execute('''
                             INSERT INTO product_categories (product_id, category)
-                            VALUES ({product_id}, '{safe_cat}')
+                            VALUES (%s, %s)
                             ON CONFLICT (product_id, category) DO NOTHING
-                        ''')
+                        ''', (product_id, cat))
                     
                     # Добавляем множественные подкатегории
-                    if subcategory_ids:
-                        for sub_id in subcategory_ids:
-                            cur.execute(f'''
-                                INSERT INTO product_subcategories (product_id, subcategory_id)
-                                VALUES ({product_id}, {int(sub_id)})
-                                ON CONFLICT (product_id, subcategory_id) DO NOTHING
-                            ''')
-                    elif subcategory_id:
-                        cur.execute(f'''
+                    for sub_id in (subcategory_ids or ([subcategory_id] if subcategory_id else [])):
+                        cur.execute('''
                             INSERT INTO product_subcategories (product_id, subcategory_id)
-                            VALUES ({product_id}, {int(subcategory_id)})
+                            VALUES (%s, %s)
                             ON CONFLICT (product_id, subcategory_id) DO NOTHING
-                        ''')
+                        ''', (product_id, int(sub_id)))
                     
+                    refresh_city_catalog(cur, product_id=product_id)
+                    bump_catalog_version(cur)
                     conn.commit()
                 
                 return {
@@ -450,12 +924,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'product_id, city_name, and price are required'})
                     }
                 
-                safe_city_name = city_name.replace("'", "''")
-                
                 with conn.cursor() as cur:
-                    cur.execute(f'''
-                        SELECT id FROM cities WHERE name = '{safe_city_name}' AND is_active = true
-                    ''')
+                    cur.execute('''
+                        SELECT id FROM cities WHERE name = %s AND is_active = true
+                    ''', (city_name,))
                     city_row = cur.fetchone()
                     
                     if not city_row:
@@ -471,12 +943,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     
                     city_id = city_row[0]
                     
-                    cur.execute(f'''
+                    cur.execute('''
                         INSERT INTO product_city_prices (product_id, city_id, price)
-                        VALUES ({int(product_id)}, {int(city_id)}, {float(price)})
+                        VALUES (%s, %s, %s)
                         ON CONFLICT (product_id, city_id) 
-                        DO UPDATE SET price = {float(price)}
-                    ''')
+                        DO UPDATE SET price = EXCLUDED.price
+                    ''', (int(product_id), int(city_id), float(price)))
+                    refresh_city_catalog(cur, product_id=int(product_id), city_id=int(city_id))
+                    bump_catalog_version(cur)
                     conn.commit()
                 
                 return {
@@ -507,36 +981,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             updates = []
-            if 'name' in body_data:
-                safe_name = body_data['name'].replace("'", "''")
-                updates.append(f"name = '{safe_name}'")
-            if 'description' in body_data:
-                safe_desc = body_data['description'].replace("'", "''")
-                updates.append(f"description = '{safe_desc}'")
-            if 'composition' in body_data:
-                safe_comp = body_data['composition'].replace("'", "''")
-                updates.append(f"composition = '{safe_comp}'")
-            if 'image_url' in body_data:
-                safe_img = body_data['image_url'].replace("'", "''")
-                updates.append(f"image_url = '{safe_img}'")
+            update_params = []
+            for column in ('name', 'description', 'composition', 'image_url', 'category'):
+                if column in body_data:
+                    updates.append(f'{column} = %s')
+                    update_params.append(body_data[column])
             if 'base_price' in body_data:
-                updates.append(f"base_price = {float(body_data['base_price'])}")
-            if 'category' in body_data:
-                safe_cat = body_data['category'].replace("'", "''")
-                updates.append(f"category = '{safe_cat}'")
+                updates.append('base_price = %s')
+                update_params.append(float(body_data['base_price']))
             if 'subcategory_id' in body_data:
-                if body_data['subcategory_id'] is None:
-                    updates.append("subcategory_id = NULL")
-                else:
-                    updates.append(f"subcategory_id = {int(body_data['subcategory_id'])}")
-            if 'is_featured' in body_data:
-                updates.append(f"is_featured = {bool(body_data['is_featured'])}")
-            if 'is_gift' in body_data:
-                updates.append(f"is_gift = {bool(body_data['is_gift'])}")
-            if 'is_recommended' in body_data:
-                updates.append(f"is_recommended = {bool(body_data['is_recommended'])}")
-            if 'is_active' in body_data:
-                updates.append(f"is_active = {bool(body_data['is_active'])}")
+                updates.append('subcategory_id = %s')
+                update_params.append(None if body_data['subcategory_id'] is None else int(body_data['subcategory_id']))
+            for column in ('is_featured', 'is_gift', 'is_recommended', 'is_active'):
+                if column in body_data:
+                    updates.append(f'{column} = %s')
+                    update_params.append(bool(body_data[column]))
             
             if not updates:
                 return {
@@ -550,33 +1009,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             with conn.cursor() as cur:
-                if updates:
-                    update_query = f"UPDATE products SET {', '.join(updates)} WHERE id = {int(product_id)}"
-                    cur.execute(update_query)
+                cur.execute(f"UPDATE products SET {', '.join(updates + ['updated_at = CURRENT_TIMESTAMP'])} WHERE id = %s",
+                            update_params + [int(product_id)])
                 
                 # Обновляем категории если переданы
                 if 'categories' in body_data:
                     # Удаляем старые
-                    cur.execute(f"DELETE FROM product_categories WHERE product_id = {int(product_id)}")
+                    cur.execute('DELETE FROM product_categories WHERE product_id = %s', (int(product_id),))
                     # Добавляем новые
                     for cat in body_data['categories']:
-                        safe_cat = cat.replace("'", "''")
-                        cur.execute(f'''
+                        cur.execute('''
                             INSERT INTO product_categories (product_id, category)
-                            VALUES ({int(product_id)}, '{safe_cat}')
-                        ''')
+                            VALUES (%s, %s)
+                        ''', (int(product_id), cat))
                 
                 # Обновляем подкатегории если переданы
                 if 'subcategory_ids' in body_data:
                     # Удаляем старые
-                    cur.execute(f"DELETE FROM product_subcategories WHERE product_id = {int(product_id)}")
+                    cur.execute('DELETE FROM product_subcategories WHERE product_id = %s', (int(product_id),))
                     # Добавляем новые
                     for sub_id in body_data['subcategory_ids']:
-                        cur.execute(f'''
+                        cur.execute('''
                             INSERT INTO product_subcategories (product_id, subcategory_id)
-                            VALUES ({int(product_id)}, {int(sub_id)})
-                        ''')
+                            VALUES (%s, %s)
+                        ''', (int(product_id), int(sub_id)))
                 
+                refresh_city_catalog(cur, product_id=int(product_id))
+                bump_catalog_version(cur)
                 conn.commit()
             
             return {
@@ -605,7 +1064,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             with conn.cursor() as cur:
-                cur.execute(f"UPDATE products SET is_active = false WHERE id = {int(product_id)}")
+                cur.execute('UPDATE products SET is_active = false, updated_at = CURRENT_TIMESTAMP WHERE id = %s', (int(product_id),))
+                refresh_city_catalog(cur, product_id=int(product_id))
+                bump_catalog_version(cur)
                 conn.commit()
             
             return {
@@ -630,4 +1091,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
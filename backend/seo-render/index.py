@@ -1,15 +1,200 @@
 '''
-Business: Dynamic SEO rendering - returns HTML with proper meta tags for bots
-Args: event with path, headers, httpMethod; context with request_id  
+Business: Dynamic SEO rendering - returns HTML with proper meta tags for bots, cached per path
+Args: event with path, headers, httpMethod (POST {"action": "prewarm"} pre-renders the sitemap); context with request_id  
 Returns: HTML with SEO meta tags or redirect to main site
 '''
 
+import functools
+import hashlib
 import json
 import os
 import re
-from typing import Dict, Any, Optional
-import urllib.request
-import urllib.error
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from xml.sax.saxutils import unescape
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import RealDictCursor
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+SITE_URL = 'https://florustic.ru'
+
+# Готовый HTML страниц для ботов: LRU в памяти тёплого контейнера и копия в S3,
+# общая для всех контейнеров. Ключ S3 включает catalog_version, так что правка
+# товара или города (она поднимает версию) сразу уводит запросы на новые ключи.
+# В S3 страницы пишет только prewarm: промах кеша отвечает боту, не дожидаясь загрузки.
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '512'))
+RENDER_VERSION_CHECK_INTERVAL = int(os.environ.get('RENDER_VERSION_CHECK_INTERVAL', '5'))
+RENDER_CACHE_PREFIX = os.environ.get('RENDER_CACHE_PREFIX', 'seo-render')
+RENDER_CACHE_CONTROL = 'public, max-age=3600'
+PREWARM_MAX_SECONDS = float(os.environ.get('PREWARM_MAX_SECONDS', '240'))
+PREWARM_UPLOAD_WORKERS = int(os.environ.get('PREWARM_UPLOAD_WORKERS', '8'))
+INLINE_IMAGE_MAX_LENGTH = 5000
+
+_render_cache: 'OrderedDict[str, bytes]' = OrderedDict()
+_render_version: Optional[int] = None
+_render_version_checked_at = 0.0
+_s3_client = None
+# Кешируются только адреса из sitemap: остальные пути под /city/ и /product/ не плодят ключи
+CACHEABLE_PATH_RE = re.compile(r'/|/catalog|/product/\d+|/city/[^/?#]+(?:/delivery)?')
 
 # Определяем ботов по User-Agent
 BOT_USER_AGENTS = [
@@ -28,20 +213,6 @@ def is_bot(user_agent: str) -> bool:
     ua_lower = user_agent.lower()
     return any(bot in ua_lower for bot in BOT_USER_AGENTS)
 
-def create_slug(name: str) -> str:
-    """Convert city name to URL slug"""
-    transliteration = {
-        'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
-        'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'j', 'к': 'k', 'л': 'l', 'м': 'm',
-        'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-        'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-        'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', ' ': '-'
-    }
-    result = ''
-    for char in name.lower():
-        result += transliteration.get(char, char)
-    return result
-
 def get_city_prepositional(city: str) -> str:
     """Convert city name to prepositional case"""
     endings = {
@@ -51,24 +222,29 @@ def get_city_prepositional(city: str) -> str:
     }
     return endings.get(city, city + 'е')
 
-def fetch_cities() -> Dict[str, Any]:
-    """Fetch cities from API"""
-    url = 'https://functions.poehali.dev/f33ee89c-e17b-4d45-a1fb-52de0d0e4ec9'
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    with urllib.request.urlopen(req, timeout=5) as response:
-        return json.loads(response.read().decode('utf-8'))
-
-def fetch_product(product_id: str) -> Optional[Dict[str, Any]]:
-    """Fetch product from API"""
-    url = f'https://functions.poehali.dev/f3ffc9b4-fbea-48e8-959d-c34ea68e6531?id={product_id}'
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    try:
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            products = data.get('products', [])
-            return products[0] if products else None
-    except Exception:
+def find_city_by_slug(conn, city_slug: str) -> Optional[Dict[str, Any]]:
+    """Active city by its stored slug: one lookup on idx_cities_slug_active"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('''
+            SELECT c.name, r.name AS region
+            FROM t_p90017259_flo_rustic_shop.cities c
+            JOIN t_p90017259_flo_rustic_shop.regions r ON r.id = c.region_id
+            WHERE c.slug = %s AND c.is_active = true AND r.is_active = true
+        ''', (city_slug,))
+        return cur.fetchone()
+
+def find_product(conn, product_id: str) -> Optional[Dict[str, Any]]:
+    """Active product by id, with only the fields the meta tags use"""
+    if not product_id.isdigit():
         return None
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT name, base_price AS price, LEFT(description, 200) AS description,
+                   CASE WHEN octet_length(image_url) > {INLINE_IMAGE_MAX_LENGTH} THEN '' ELSE image_url END AS image_url
+            FROM t_p90017259_flo_rustic_shop.products
+            WHERE id = %s AND is_active = true
+        ''', (int(product_id),))
+        return cur.fetchone()
 
 def generate_city_meta(city_name: str, region: str, city_slug: str) -> Dict[str, str]:
     """Generate meta tags for city page"""
@@ -168,6 +344,242 @@ def get_base_html(meta: Dict[str, str]) -> str:
 </body>
 </html>'''
 
+def is_cacheable_path(path: str) -> bool:
+    """Paths whose HTML is cached, exactly the shapes the sitemap publishes"""
+    return CACHEABLE_PATH_RE.fullmatch(path) is not None
+
+def resolve_meta(path: str,
+                 get_product: Callable[[str], Optional[Dict[str, Any]]],
+                 get_city: Callable[[str], Optional[Dict[str, Any]]]) -> Tuple[Dict[str, str], bool]:
+    """Meta tags for a path and whether the page is worth caching (known page or entity found)"""
+    meta = generate_default_meta()
+    found = path == '/'
+    
+    # Product pages
+    if path.startswith('/product/'):
+        product_id = path.replace('/product/', '').split('/')[0].split('?')[0]
+        product = get_product(product_id)
+        if product:
+            meta = generate_product_meta(product, product_id)
+            found = True
+    
+    # Catalog page
+    elif path.startswith('/catalog'):
+        meta = generate_catalog_meta()
+        found = path == '/catalog'
+    
+    # City pages
+    elif path.startswith('/city/'):
+        city_slug = path.replace('/city/', '').split('/')[0].split('?')[0]
+        city = get_city(city_slug) if city_slug else None
+        if city:
+            meta = generate_city_meta(city['name'], city['region'] or '', city_slug)
+            found = True
+    
+    meta['path'] = path
+    return meta, found and is_cacheable_path(path)
+
+def render_page(path: str,
+                get_product: Callable[[str], Optional[Dict[str, Any]]],
+                get_city: Callable[[str], Optional[Dict[str, Any]]]) -> Tuple[bytes, bool]:
+    meta, cacheable = resolve_meta(path, get_product, get_city)
+    return get_base_html(meta).encode('utf-8'), cacheable
+
+def get_s3_client():
+    """boto3 client kept for the life of the warm container"""
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT'),
+            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+            aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
+            region_name='ru-central1'
+        )
+    return _s3_client
+
+def sync_render_version(conn) -> int:
+    """Current catalog_version, re-read at most every RENDER_VERSION_CHECK_INTERVAL seconds; a change empties the LRU"""
+    global _render_version, _render_version_checked_at
+    if _render_version is not None and time.monotonic() - _render_version_checked_at <= RENDER_VERSION_CHECK_INTERVAL:
+        return _render_version
+    with conn.cursor() as cur:
+        cur.execute('SELECT version FROM t_p90017259_flo_rustic_shop.catalog_version WHERE id = 1')
+        row = cur.fetchone()
+    version = row[0] if row else 0
+    if version != _render_version:
+        _render_cache.clear()
+        _render_version = version
+    _render_version_checked_at = time.monotonic()
+    return version
+
+def get_cached_page(path: str) -> Optional[bytes]:
+    html = _render_cache.get(path)
+    if html is not None:
+        _render_cache.move_to_end(path)
+    return html
+
+def store_cached_page(path: str, html: bytes) -> None:
+    _render_cache[path] = html
+    _render_cache.move_to_end(path)
+    while len(_render_cache) > RENDER_CACHE_SIZE:
+        _render_cache.popitem(last=False)
+
+def version_prefix(version: int) -> str:
+    return f'{RENDER_CACHE_PREFIX}/v{version}/'
+
+def page_object_key(version: int, path: str) -> str:
+    return version_prefix(version) + hashlib.sha256(path.encode('utf-8')).hexdigest()[:32] + '.html'
+
+def read_persisted_page(version: int, path: str) -> Optional[bytes]:
+    """HTML rendered by any container under this catalog_version, or None"""
+    bucket_name = os.environ.get('S3_BUCKET')
+    if not bucket_name:
+        return None
+    try:
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=page_object_key(version, path))
+        return response['Body'].read()
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            print(f'Render cache read failed: {e}')
+        return None
+
+def persist_page(version: int, path: str, html: bytes) -> bool:
+    bucket_name = os.environ.get('S3_BUCKET')
+    if not bucket_name:
+        return False
+    try:
+        get_s3_client().put_object(
+            Bucket=bucket_name,
+            Key=page_object_key(version, path),
+            Body=html,
+            ContentType='text/html; charset=utf-8'
+        )
+        return True
+    except Exception as e:
+        print(f'Render cache write failed: {e}')
+        return False
+
+def persisted_keys(prefix: str) -> List[str]:
+    bucket_name = os.environ.get('S3_BUCKET')
+    if not bucket_name:
+        return []
+    keys = []
+    for page in get_s3_client().get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    return keys
+
+def delete_stale_versions(version: int) -> int:
+    """Drop pages rendered under older catalog versions"""
+    bucket_name = os.environ.get('S3_BUCKET')
+    current = version_prefix(version)
+    stale = [key for key in persisted_keys(RENDER_CACHE_PREFIX + '/') if not key.startswith(current)]
+    for start in range(0, len(stale), 1000):
+        get_s3_client().delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in stale[start:start + 1000]], 'Quiet': True}
+        )
+    return len(stale)
+
+def sitemap_paths(conn) -> List[str]:
+    """Every URL of the stored sitemap shards as a site path, in sitemap order"""
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT key FROM t_p90017259_flo_rustic_shop.site_artifacts
+            WHERE key LIKE 'sitemap-%%' ORDER BY key
+        ''')
+        keys = [row[0] for row in cur.fetchall()]
+    paths: List[str] = []
+    seen = set()
+    for key in keys:
+        with conn.cursor() as cur:
+            cur.execute('SELECT content FROM t_p90017259_flo_rustic_shop.site_artifacts WHERE key = %s', (key,))
+            row = cur.fetchone()
+        if row is None:
+            continue
+        for loc in re.findall(r'<loc>([^<]+)</loc>', bytes(row[0]).decode('utf-8')):
+            url = unescape(loc.strip())
+            path = (url[len(SITE_URL):] or '/') if url.startswith(SITE_URL) else None
+            if path and path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+def prewarm_pages(conn, offset: int = 0) -> Dict[str, Any]:
+    """
+    Render every sitemap URL under the current catalog_version and upload the pages
+    S3 does not have yet. Products and cities are loaded in two bulk queries.
+    Stops after PREWARM_MAX_SECONDS and returns next_offset to continue from.
+    """
+    started = time.monotonic()
+    version = sync_render_version(conn)
+    paths = sitemap_paths(conn)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT id, name, base_price AS price, LEFT(description, 200) AS description,
+                   CASE WHEN octet_length(image_url) > {INLINE_IMAGE_MAX_LENGTH} THEN '' ELSE image_url END AS image_url
+            FROM t_p90017259_flo_rustic_shop.products
+            WHERE is_active = true
+        ''')
+        products = {str(row['id']): row for row in cur.fetchall()}
+        cur.execute('''
+            SELECT c.slug, c.name, r.name AS region
+            FROM t_p90017259_flo_rustic_shop.cities c
+            JOIN t_p90017259_flo_rustic_shop.regions r ON r.id = c.region_id
+            WHERE c.is_active = true AND r.is_active = true AND c.slug IS NOT NULL
+        ''')
+        cities = {row['slug']: row for row in cur.fetchall()}
+    conn.rollback()
+
+    existing = set(persisted_keys(version_prefix(version)))
+    rendered = skipped = 0
+    next_offset = None
+    uploads = []
+    with ThreadPoolExecutor(max_workers=PREWARM_UPLOAD_WORKERS) as pool:
+        for index in range(offset, len(paths)):
+            if time.monotonic() - started > PREWARM_MAX_SECONDS:
+                next_offset = index
+                break
+            path = paths[index]
+            html, cacheable = render_page(path, products.get, cities.get)
+            if not cacheable:
+                continue
+            rendered += 1
+            store_cached_page(path, html)
+            if page_object_key(version, path) in existing:
+                skipped += 1
+            else:
+                uploads.append(pool.submit(persist_page, version, path, html))
+    uploaded = sum(1 for upload in uploads if upload.result())
+
+    deleted = delete_stale_versions(version) if next_offset is None and os.environ.get('S3_BUCKET') else 0
+    print(f'Prewarm v{version}: {rendered} pages rendered, {uploaded} uploaded, {skipped} already stored')
+    return {
+        'version': version,
+        'paths': len(paths),
+        'rendered': rendered,
+        'uploaded': uploaded,
+        'already_stored': skipped,
+        'deleted_stale': deleted,
+        'next_offset': next_offset
+    }
+
+def html_response(html: bytes, cache_status: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/html; charset=utf-8',
+            'Cache-Control': RENDER_CACHE_CONTROL,
+            'X-Robots-Tag': 'index, follow',
+            'X-Render-Cache': cache_status
+        },
+        'isBase64Encoded': False,
+        'body': html.decode('utf-8')
+    }
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -177,7 +589,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, User-Agent',
                 'Access-Control-Max-Age': '86400'
             },
@@ -185,6 +597,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    # Bulk pre-render of every sitemap URL; body {"action": "prewarm", "offset": N} continues a partial run
+    if method == 'POST':
+        try:
+            body_data = json.loads(event.get('body') or '{}')
+        except ValueError:
+            body_data = {}
+        dsn = os.environ.get('DATABASE_URL')
+        if body_data.get('action') != 'prewarm' or not dsn:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Expected {"action": "prewarm"} and a configured database'}),
+                'isBase64Encoded': False
+            }
+        conn = get_db_connection(dsn)
+        try:
+            result = prewarm_pages(conn, offset=int(body_data.get('offset') or 0))
+        finally:
+            release_db_connection(conn)
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+    
     # Check if request is from a bot
     headers = event.get('headers', {})
     user_agent = headers.get('user-agent', headers.get('User-Agent', ''))
@@ -202,54 +646,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     # Parse path
-    path = event.get('path', event.get('queryStringParameters', {}).get('path', '/'))
-    
-    # Generate meta tags based on path
-    meta = generate_default_meta()
-    meta['path'] = path
-    
-    # Product pages
-    if path.startswith('/product/'):
-        product_id = path.replace('/product/', '').split('/')[0].split('?')[0]
-        try:
-            product = fetch_product(product_id)
-            if product:
-                meta = generate_product_meta(product, product_id)
-                meta['path'] = path
-        except Exception as e:
-            print(f'Failed to fetch product: {e}')
-    
-    # Catalog page
-    elif path.startswith('/catalog'):
-        meta = generate_catalog_meta()
-        meta['path'] = path
+    path = event.get('path', (event.get('queryStringParameters') or {}).get('path', '/'))
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        html, _ = render_page(path, lambda product_id: None, lambda city_slug: None)
+        return html_response(html, 'bypass')
     
-    # City pages
-    elif path.startswith('/city/'):
-        city_slug = path.replace('/city/', '').split('/')[0]
+    conn = None
+    try:
+        conn = get_db_connection(dsn)
+        version = sync_render_version(conn)
         
-        # Fetch cities and find matching city
-        try:
-            cities_data = fetch_cities()
-            for region in cities_data.get('cities', {}).values():
-                for city in region:
-                    if create_slug(city['name']) == city_slug:
-                        meta = generate_city_meta(city['name'], city.get('region', ''), city_slug)
-                        meta['path'] = path
-                        break
-        except Exception as e:
-            print(f'Failed to fetch cities: {e}')
-    
-    # Generate HTML
-    html = get_base_html(meta)
-    
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/html; charset=utf-8',
-            'Cache-Control': 'public, max-age=3600',
-            'X-Robots-Tag': 'index, follow'
-        },
-        'isBase64Encoded': False,
-        'body': html
-    }
\ No newline at end of file
+        html = get_cached_page(path)
+        if html is not None:
+            return html_response(html, 'memory')
+        
+        if is_cacheable_path(path):
+            html = read_persisted_page(version, path)
+            if html is not None:
+                store_cached_page(path, html)
+                return html_response(html, 's3')
+        
+        html, cacheable = render_page(
+            path,
+            lambda product_id: find_product(conn, product_id),
+            lambda city_slug: find_city_by_slug(conn, city_slug)
+        )
+        if cacheable:
+            store_cached_page(path, html)
+        return html_response(html, 'miss')
+    except Exception as e:
+        print(f'Failed to render {path}: {e}')
+        html, _ = render_page(path, lambda product_id: None, lambda city_slug: None)
+        return html_response(html, 'error')
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -1,15 +1,356 @@
 """
-Business: Fetch complete sitemap XML and return it
+Business: Return the stored sitemap XML (index or a shard via ?file=) with its URL count
 Args: event - cloud function event, context - cloud function context
-Returns: Full sitemap XML as text
+Returns: Sitemap XML as text, 304 when If-None-Match names the current ETag
 """
 
-import urllib.request
+import base64
+import functools
 import json
-from typing import Dict, Any
+import os
+import re
+import time
+import urllib.request
+from typing import Dict, Any, List, Optional
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import RealDictCursor
+
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
 
-SITEMAP_URL = 'https://functions.poehali.dev/58b61451-ee69-439e-b94c-195335bd5057'
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
 
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+SITEMAP_ARTIFACT_KEY = 'sitemap.xml'
+SITEMAP_FILE_RE = re.compile(r'^sitemap(-[a-z]+(?:-[a-z]+)*-\d+)?\.xml$')
+# Функция sitemap: пересобирает устаревшие файлы по POST {"force": false}
+SITEMAP_FUNCTION_URL = os.environ.get('SITEMAP_FUNCTION_URL', 'https://functions.poehali.dev/58b61451-ee69-439e-b94c-195335bd5057')
+SITEMAP_REFRESH_TIMEOUT = float(os.environ.get('SITEMAP_REFRESH_TIMEOUT', '30'))
+
+def load_artifact_stats(cur, key: str) -> Dict[str, Any]:
+    '''
+    Precomputed stats of a stored sitemap file (sizes, URL and line counts, sparse line index)
+    and whether it lags catalog_version or the latest page_contents edit; the content is not read
+    '''
+    cur.execute('''
+        SELECT cv.version AS current_version, a.key, a.etag, a.source_version,
+               (a.source_version IS DISTINCT FROM cv.version
+                OR a.source_pages_updated_at IS DISTINCT FROM pc.pages_updated_at) AS stale,
+               a.url_count,
+               a.byte_size, a.char_count, a.line_count, a.line_index_step, a.line_index, a.generated_at
+        FROM t_p90017259_flo_rustic_shop.catalog_version cv
+        CROSS JOIN (SELECT MAX(updated_at) AS pages_updated_at FROM t_p90017259_flo_rustic_shop.page_contents) pc
+        LEFT JOIN t_p90017259_flo_rustic_shop.site_artifacts a ON a.key = %s
+        WHERE cv.id = 1
+    ''', (key,))
+    return dict(cur.fetchone() or {'current_version': 0, 'key': None})
+
+def snapshot_artifact_stats(conn, key: str) -> Dict[str, Any]:
+    '''
+    Stats read as the first statement of a REPEATABLE READ transaction, so the ranged
+    reads that follow see the same version of the file even if it is rebuilt meanwhile
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        return load_artifact_stats(cur, key)
+
+def artifact_is_stored(stats: Dict[str, Any]) -> bool:
+    '''The file and its precomputed stats exist, however stale they are'''
+    return stats.get('key') is not None and stats['line_index'] is not None
+
+def refresh_sitemap() -> bool:
+    '''Ask the sitemap function to build missing or stale files; it answers with a few bytes of JSON'''
+    if not SITEMAP_FUNCTION_URL:
+        return False
+    try:
+        request = urllib.request.Request(
+            SITEMAP_FUNCTION_URL,
+            data=json.dumps({'force': False}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=SITEMAP_REFRESH_TIMEOUT) as response:
+            response.read()
+        return True
+    except Exception as e:
+        print(f'Sitemap refresh failed: {e}')
+        return False
+
+def get_artifact_stats(conn, key: str) -> Dict[str, Any]:
+    '''
+    Stats of a stored file. A stale one is served as is and flagged by artifact_summary,
+    the sitemap function catches up on its own; only a missing file is built here, once
+    '''
+    stats = snapshot_artifact_stats(conn, key)
+    if not artifact_is_stored(stats):
+        conn.rollback()
+        if refresh_sitemap():
+            stats = snapshot_artifact_stats(conn, key)
+    return stats
+
+def read_artifact_lines(cur, stats: Dict[str, Any], start: int, stop: int) -> List[str]:
+    '''
+    Lines [start, stop) numbered as content.split('\n') would number them, read with one
+    substring() over the blocks of the sparse line index that cover the range
+    '''
+    start, stop = max(start, 0), min(stop, stats['line_count'])
+    if start >= stop:
+        return []
+    step = stats['line_index_step']
+    line_index = stats['line_index']
+    first_block = start // step
+    last_block = (stop - 1) // step + 1
+    byte_from = line_index[first_block]
+    byte_to = line_index[last_block] - 1 if last_block < len(line_index) else stats['byte_size']
+    cur.execute('''
+        SELECT substring(content FROM %s FOR %s) AS chunk
+        FROM t_p90017259_flo_rustic_shop.site_artifacts
+        WHERE key = %s
+    ''', (byte_from + 1, byte_to - byte_from, stats['key']))
+    row = cur.fetchone()
+    if row is None:
+        return []
+    lines = bytes(row['chunk']).decode('utf-8').split('\n')
+    offset = first_block * step
+    return lines[start - offset:stop - offset]
+
+def read_artifact_content(cur, key: str, gzipped: bool = False) -> Optional[bytes]:
+    column = 'content_gzip' if gzipped else 'content'
+    cur.execute(f'SELECT {column} AS content FROM t_p90017259_flo_rustic_shop.site_artifacts WHERE key = %s', (key,))
+    row = cur.fetchone()
+    return bytes(row['content']) if row and row['content'] is not None else None
+
+def artifact_summary(stats: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'file': stats['key'],
+        'etag': stats['etag'],
+        'total_bytes': stats['byte_size'],
+        'generated_at': stats['generated_at'].isoformat() if stats['generated_at'] else None,
+        'stale': stats['stale']
+    }
+
+def accepted_encodings(event: Dict[str, Any]) -> Dict[str, float]:
+    '''Accept-Encoding parsed into {coding: q}, codings with q=0 left out'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    encodings: Dict[str, float] = {}
+    for part in value.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            encodings[coding.strip().lower()] = q
+    return encodings
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    '''True when the request's If-None-Match already names this ETag (or is *)'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return False
+    candidates = [tag.strip() for tag in value.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def not_modified_response(etag: str, cache_control: str = 'no-cache') -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+def xml_file_response(event: Dict[str, Any], cur, stats: Dict[str, Any],
+                      extra_headers: Dict[str, str]) -> Dict[str, Any]:
+    '''The stored file as is: gzip copy for clients that accept it, plain XML otherwise'''
+    etag = stats['etag']
+    if etag_matches(event, etag):
+        return not_modified_response(etag)
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache',
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        **extra_headers
+    }
+    if 'gzip' in accepted_encodings(event):
+        content_gzip = read_artifact_content(cur, stats['key'], gzipped=True)
+        if content_gzip is not None:
+            headers['Content-Encoding'] = 'gzip'
+            headers['ETag'] = 'W/' + etag
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': base64.b64encode(content_gzip).decode('ascii'),
+                'isBase64Encoded': True
+            }
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': (read_artifact_content(cur, stats['key']) or b'').decode('utf-8'),
+        'isBase64Encoded': False
+    }
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -19,31 +360,81 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
-            'body': ''
+            'body': '',
+            'isBase64Encoded': False
         }
     
     if method != 'GET':
         return {
             'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
         }
     
-    with urllib.request.urlopen(SITEMAP_URL) as response:
-        xml_content = response.read().decode('utf-8')
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Database not configured'}),
+            'isBase64Encoded': False
+        }
     
-    url_count = xml_content.count('<url>')
+    params = event.get('queryStringParameters') or {}
+    file_key = params.get('file') or SITEMAP_ARTIFACT_KEY
+    if not SITEMAP_FILE_RE.match(file_key):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Unknown sitemap file'}),
+            'isBase64Encoded': False
+        }
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/xml',
-            'Access-Control-Allow-Origin': '*',
-            'X-URL-Count': str(url_count)
-        },
-        'isBase64Encoded': False,
-        'body': xml_content
-    }
+    conn = None
+    try:
+        conn = get_db_connection(dsn)
+        stats = get_artifact_stats(conn, file_key)
+        if not artifact_is_stored(stats):
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Sitemap file not found'}),
+                'isBase64Encoded': False
+            }
+        
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return xml_file_response(event, cur, stats, {
+                'Content-Type': 'application/xml',
+                'X-URL-Count': str(stats['url_count'] or 0),
+                'X-Sitemap-Stale': 'true' if artifact_summary(stats)['stale'] else 'false',
+                'Access-Control-Expose-Headers': 'ETag, X-URL-Count, X-Sitemap-Stale'
+            })
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
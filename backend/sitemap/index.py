@@ -1,11 +1,600 @@
+import base64
+import functools
+import gzip
+import hashlib
+import io
 import json
+import os
+import re
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import RealDictCursor
 
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+SITE_URL = os.environ.get('SITE_URL', 'https://florustic.ru').rstrip('/')
+SITEMAP_ARTIFACT_KEY = 'sitemap.xml'
+SITEMAP_PUBLIC_URL = os.environ.get('SITEMAP_PUBLIC_URL', 'https://functions.poehali.dev/58b61451-ee69-439e-b94c-195335bd5057')
+# Протокол: не больше 50 000 URL и 50 МБ на файл, держим запас
+SITEMAP_MAX_URLS = int(os.environ.get('SITEMAP_MAX_URLS', '45000'))
+SITEMAP_MAX_BYTES = int(os.environ.get('SITEMAP_MAX_BYTES', str(45 * 1024 * 1024)))
+SITEMAP_CITY_CATEGORY_PAGES = os.environ.get('SITEMAP_CITY_CATEGORY_PAGES', 'false').lower() in ('1', 'true', 'yes')
+SITEMAP_FILE_RE = re.compile(r'^sitemap(-[a-z]+(?:-[a-z]+)*-\d+)?\.xml$')
+DB_ITERSIZE = 2000
+# Шаг разреженного индекса строк: превью читает не больше одного блока на запрос
+LINE_INDEX_STEP = 100
+SITEMAP_LOCK_KEY = 90017259021
+SITEMAP_CACHE_CONTROL = 'public, max-age=3600'
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '9'))
+INDEXNOW_URL = os.environ.get('INDEXNOW_URL', 'https://functions.poehali.dev/f9051455-576c-4094-8413-8c03926b2370')
+INDEXNOW_TIMEOUT = float(os.environ.get('INDEXNOW_TIMEOUT', '2'))
+
+# Статические страницы: (путь, changefreq, priority, page_key в page_contents для lastmod)
+STATIC_PAGES = [
+    ('/', 'daily', '1.0', None),
+    ('/catalog', 'daily', '0.9', None),
+    ('/about', 'monthly', '0.6', 'about'),
+    ('/delivery', 'monthly', '0.7', 'delivery'),
+    ('/guarantees', 'monthly', '0.6', 'guarantees'),
+    ('/contacts', 'monthly', '0.7', 'contacts'),
+    ('/reviews', 'weekly', '0.6', None),
+]
+
+def accepted_encodings(event: Dict[str, Any]) -> Dict[str, float]:
+    '''Accept-Encoding parsed into {coding: q}, codings with q=0 left out'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    encodings: Dict[str, float] = {}
+    for part in value.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            encodings[coding.strip().lower()] = q
+    return encodings
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    '''True when the request's If-None-Match already names this ETag (or is *)'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return False
+    candidates = [tag.strip() for tag in value.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def not_modified_response(etag: str, cache_control: str = 'no-cache') -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+def create_slug(name: str) -> str:
+    return (name.lower()
+            .replace('ё', 'e')
+            .replace(' ', '-')
+            .replace('а', 'a').replace('б', 'b').replace('в', 'v').replace('г', 'g')
+            .replace('д', 'd').replace('е', 'e').replace('ж', 'zh').replace('з', 'z')
+            .replace('и', 'i').replace('й', 'j').replace('к', 'k').replace('л', 'l')
+            .replace('м', 'm').replace('н', 'n').replace('о', 'o').replace('п', 'p')
+            .replace('р', 'r').replace('с', 's').replace('т', 't').replace('у', 'u')
+            .replace('ф', 'f').replace('х', 'h').replace('ц', 'c').replace('ч', 'ch')
+            .replace('ш', 'sh').replace('щ', 'sch').replace('ъ', '').replace('ы', 'y')
+            .replace('ь', '').replace('э', 'e').replace('ю', 'yu').replace('я', 'ya'))
+
+def lastmod(value: Optional[datetime]) -> Optional[str]:
+    return value.strftime('%Y-%m-%d') if value else None
+
+def url_entry(path: str, modified: Optional[str], changefreq: str, priority: str) -> str:
+    lastmod_line = f'\n    <lastmod>{modified}</lastmod>' if modified else ''
+    return f'''  <url>
+    <loc>{escape(SITE_URL + path)}</loc>{lastmod_line}
+    <changefreq>{changefreq}</changefreq>
+    <priority>{priority}</priority>
+  </url>
+'''
+
+URLSET_HEADER = b'''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+        xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9
+        http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">
+'''
+URLSET_FOOTER = b'</urlset>\n'
+
+class ShardWriter:
+    '''
+    One child sitemap file written entry by entry into a plain and a gzip buffer at once,
+    so a shard is never assembled as a list of strings and only one shard is in memory
+    '''
+
+    def __init__(self, key: str):
+        self.key = key
+        self.url_count = 0
+        self.lastmod: Optional[str] = None
+        self.raw = io.BytesIO()
+        self._gzip_buffer = io.BytesIO()
+        self._gzip = gzip.GzipFile(fileobj=self._gzip_buffer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+        self._write(URLSET_HEADER)
+
+    def _write(self, data: bytes) -> None:
+        self.raw.write(data)
+        self._gzip.write(data)
+
+    def fits(self, entry: bytes) -> bool:
+        return (self.url_count < SITEMAP_MAX_URLS
+                and self.raw.tell() + len(entry) + len(URLSET_FOOTER) <= SITEMAP_MAX_BYTES)
+
+    def add(self, entry: bytes, modified: Optional[str]) -> None:
+        self._write(entry)
+        self.url_count += 1
+        if modified and (self.lastmod is None or modified > self.lastmod):
+            self.lastmod = modified
+
+    def close(self) -> Dict[str, Any]:
+        self._write(URLSET_FOOTER)
+        self._gzip.close()
+        content = self.raw.getvalue()
+        return {
+            'key': self.key,
+            'content': content,
+            'content_gzip': self._gzip_buffer.getvalue(),
+            'etag': '"' + hashlib.sha256(content).hexdigest()[:32] + '"',
+            'url_count': self.url_count,
+            'lastmod': self.lastmod
+        }
+
+def write_shards(name: str, entries: Iterator[Tuple[str, Optional[str]]]) -> Iterator[Dict[str, Any]]:
+    '''Split a stream of (url_xml, lastmod) into sitemap-<name>-N.xml files within the protocol limits'''
+    number = 1
+    writer = ShardWriter(f'sitemap-{name}-{number}.xml')
+    for entry_xml, modified in entries:
+        entry = entry_xml.encode('utf-8')
+        if writer.url_count and not writer.fits(entry):
+            yield writer.close()
+            number += 1
+            writer = ShardWriter(f'sitemap-{name}-{number}.xml')
+        writer.add(entry, modified)
+    if writer.url_count:
+        yield writer.close()
+
+def stream_rows(conn, name: str, sql: str) -> Iterator[Dict[str, Any]]:
+    '''Rows through a named server-side cursor, DB_ITERSIZE at a time'''
+    with conn.cursor(name=name, cursor_factory=RealDictCursor) as cur:
+        cur.itersize = DB_ITERSIZE
+        cur.execute(sql)
+        for row in cur:
+            yield row
+
+def static_entries(conn) -> Iterator[Tuple[str, Optional[str]]]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('''
+            SELECT GREATEST(
+                (SELECT MAX(c.updated_at) FROM cities c WHERE c.is_active = true),
+                (SELECT MAX(p.updated_at) FROM products p WHERE p.is_active = true)
+            ) AS catalog_updated,
+            (SELECT MAX(created_at) FROM reviews WHERE is_approved = true) AS reviews_updated
+        ''')
+        row = cur.fetchone()
+        catalog_updated, reviews_updated = row['catalog_updated'], row['reviews_updated']
+        cur.execute('SELECT page_key, updated_at FROM page_contents')
+        page_updates = {page['page_key']: page['updated_at'] for page in cur.fetchall()}
+
+    for path, changefreq, priority, page_key in STATIC_PAGES:
+        if page_key:
+            modified = lastmod(page_updates.get(page_key))
+        elif path == '/reviews':
+            modified = lastmod(reviews_updated)
+        else:
+            modified = lastmod(catalog_updated)
+        yield url_entry(path, modified, changefreq, priority), modified
+
+ACTIVE_CITIES_SQL = '''
+    SELECT c.slug, c.updated_at
+    FROM cities c
+    JOIN regions r ON r.id = c.region_id
+    WHERE c.is_active = true AND r.is_active = true AND c.slug IS NOT NULL
+    ORDER BY r.name, c.name
+'''
+
+def city_entries(conn) -> Iterator[Tuple[str, Optional[str]]]:
+    # slug уникален среди активных городов (idx_cities_slug_active)
+    for city in stream_rows(conn, 'sitemap_cities', ACTIVE_CITIES_SQL):
+        city_slug = city['slug']
+        modified = lastmod(city['updated_at'])
+        yield url_entry(f'/city/{city_slug}', modified, 'daily', '0.9'), modified
+        yield url_entry(f'/city/{city_slug}/delivery', modified, 'weekly', '0.8'), modified
+
+def product_entries(conn) -> Iterator[Tuple[str, Optional[str]]]:
+    for product in stream_rows(conn, 'sitemap_products',
+                               'SELECT id, updated_at FROM products WHERE is_active = true ORDER BY id'):
+        modified = lastmod(product['updated_at'])
+        yield url_entry(f"/product/{product['id']}", modified, 'weekly', '0.8'), modified
+
+def city_category_entries(conn) -> Iterator[Tuple[str, Optional[str]]]:
+    '''Landing pages city x category that have at least one available product'''
+    seen = set()
+    for row in stream_rows(conn, 'sitemap_city_categories', '''
+        SELECT c.slug, pc.category, MAX(p.updated_at) AS updated_at
+        FROM product_city_catalog pcc
+        JOIN cities c ON c.id = pcc.city_id
+        JOIN regions r ON r.id = c.region_id
+        JOIN products p ON p.id = pcc.product_id
+        JOIN product_categories pc ON pc.product_id = pcc.product_id
+        WHERE pcc.is_available = true AND r.is_active = true AND c.slug IS NOT NULL
+        GROUP BY r.name, c.name, c.slug, pc.category
+        ORDER BY r.name, c.name, pc.category
+    '''):
+        path = f"/city/{row['slug']}/{create_slug(row['category'])}"
+        if path in seen:
+            continue
+        seen.add(path)
+        modified = lastmod(row['updated_at'])
+        yield url_entry(path, modified, 'weekly', '0.7'), modified
+
+def shard_sources(conn) -> List[Tuple[str, Iterator[Tuple[str, Optional[str]]]]]:
+    sources = [
+        ('static', static_entries(conn)),
+        ('cities', city_entries(conn)),
+        ('products', product_entries(conn)),
+    ]
+    # Посадочных страниц город x категория во фронтенде пока нет, шард включается вместе с ними
+    if SITEMAP_CITY_CATEGORY_PAGES:
+        sources.append(('city-categories', city_category_entries(conn)))
+    return sources
+
+def render_index(shards: List[Dict[str, Any]]) -> bytes:
+    entries = []
+    for shard in shards:
+        lastmod_line = f"\n    <lastmod>{shard['lastmod']}</lastmod>" if shard['lastmod'] else ''
+        entries.append(f'''  <sitemap>
+    <loc>{escape(f"{SITEMAP_PUBLIC_URL}?file={shard['key']}")}</loc>{lastmod_line}
+  </sitemap>''')
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+{chr(10).join(entries)}
+</sitemapindex>
+'''.encode('utf-8')
+
+def load_artifact(cur, key: str) -> Dict[str, Any]:
+    '''
+    Current catalog_version, the latest page_contents edit and the stored artifact in one
+    query; the bytes come back only when the artifact was built from both of them
+    '''
+    cur.execute('''
+        SELECT cv.version AS current_version, pc.pages_updated_at AS current_pages_updated_at,
+               a.key, a.source_version, a.etag,
+               CASE WHEN a.source_version = cv.version
+                         AND a.source_pages_updated_at IS NOT DISTINCT FROM pc.pages_updated_at
+                    THEN a.content END AS content,
+               CASE WHEN a.source_version = cv.version
+                         AND a.source_pages_updated_at IS NOT DISTINCT FROM pc.pages_updated_at
+                    THEN a.content_gzip END AS content_gzip
+        FROM t_p90017259_flo_rustic_shop.catalog_version cv
+        CROSS JOIN (SELECT MAX(updated_at) AS pages_updated_at FROM t_p90017259_flo_rustic_shop.page_contents) pc
+        LEFT JOIN t_p90017259_flo_rustic_shop.site_artifacts a ON a.key = %s
+        WHERE cv.id = 1
+    ''', (key,))
+    return dict(cur.fetchone() or {'current_version': 0, 'current_pages_updated_at': None, 'key': None,
+                                   'source_version': None, 'etag': None, 'content': None, 'content_gzip': None})
+
+def line_stats(content: bytes) -> Tuple[int, List[int]]:
+    '''
+    Line count as content.split('\n') would give it, and the byte offset where every
+    LINE_INDEX_STEP-th line starts, so readers can fetch a line range with one substring()
+    '''
+    line_index = [0]
+    line_count = 1
+    position = content.find(b'\n')
+    while position != -1:
+        if line_count % LINE_INDEX_STEP == 0:
+            line_index.append(position + 1)
+        line_count += 1
+        position = content.find(b'\n', position + 1)
+    return line_count, line_index
+
+def store_artifact(cur, artifact: Dict[str, Any], version: int, pages_updated_at: Optional[datetime]) -> None:
+    content = artifact['content']
+    line_count, line_index = line_stats(content)
+    cur.execute('''
+        INSERT INTO t_p90017259_flo_rustic_shop.site_artifacts
+            (key, content, content_gzip, content_type, etag, source_version, source_pages_updated_at,
+             url_count, byte_size, char_count, line_count, line_index_step, line_index, generated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (key) DO UPDATE SET
+            content = EXCLUDED.content,
+            content_gzip = EXCLUDED.content_gzip,
+            content_type = EXCLUDED.content_type,
+            etag = EXCLUDED.etag,
+            source_version = EXCLUDED.source_version,
+            source_pages_updated_at = EXCLUDED.source_pages_updated_at,
+            url_count = EXCLUDED.url_count,
+            byte_size = EXCLUDED.byte_size,
+            char_count = EXCLUDED.char_count,
+            line_count = EXCLUDED.line_count,
+            line_index_step = EXCLUDED.line_index_step,
+            line_index = EXCLUDED.line_index,
+            generated_at = EXCLUDED.generated_at
+    ''', (artifact['key'], psycopg2.Binary(content), psycopg2.Binary(artifact['content_gzip']),
+          'application/xml; charset=utf-8', artifact['etag'], version, pages_updated_at, artifact['url_count'],
+          len(content), len(content.decode('utf-8')), line_count, LINE_INDEX_STEP, line_index))
+
+def regenerate_sitemap(conn, want_key: str = SITEMAP_ARTIFACT_KEY,
+                       force: bool = False) -> Tuple[Optional[Dict[str, Any]], bool]:
+    '''
+    Rebuild the sitemap index and every shard when catalog_version moved past them
+    or a page_contents text was edited after they were built.
+    Each shard is stored as soon as it is written, so memory holds one shard at a time.
+    A transaction-level advisory lock makes concurrent stale requests wait for one build.
+    Returns (artifact for want_key or None if there is no such file, content_changed).
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (SITEMAP_LOCK_KEY,))
+        artifact = load_artifact(cur, want_key)
+        if artifact['content'] is not None and not force:
+            conn.commit()
+            return artifact, False
+        if want_key != SITEMAP_ARTIFACT_KEY and not force:
+            # Индекс свежий, а такого шарда в нём нет: отвечаем 404 без пересборки
+            if load_artifact(cur, SITEMAP_ARTIFACT_KEY)['content'] is not None:
+                conn.commit()
+                return None, False
+        version = artifact['current_version']
+        pages_updated_at = artifact['current_pages_updated_at']
+        cur.execute("SELECT key, etag FROM t_p90017259_flo_rustic_shop.site_artifacts WHERE key LIKE 'sitemap%%'")
+        previous_etags = {row['key']: row['etag'] for row in cur.fetchall()}
+
+    wanted: Optional[Dict[str, Any]] = None
+    shards: List[Dict[str, Any]] = []
+    changed = False
+    with conn.cursor() as cur:
+        for name, entries in shard_sources(conn):
+            for shard in write_shards(name, entries):
+                store_artifact(cur, shard, version, pages_updated_at)
+                changed = changed or previous_etags.get(shard['key']) != shard['etag']
+                if shard['key'] == want_key:
+                    wanted = shard
+                shards.append({'key': shard['key'], 'lastmod': shard['lastmod'], 'url_count': shard['url_count']})
+
+        index_content = render_index(shards)
+        index = {
+            'key': SITEMAP_ARTIFACT_KEY,
+            'content': index_content,
+            'content_gzip': gzip.compress(index_content, compresslevel=GZIP_LEVEL, mtime=0),
+            'etag': '"' + hashlib.sha256(index_content).hexdigest()[:32] + '"',
+            'url_count': sum(shard['url_count'] for shard in shards)
+        }
+        store_artifact(cur, index, version, pages_updated_at)
+        changed = changed or previous_etags.get(SITEMAP_ARTIFACT_KEY) != index['etag']
+        if want_key == SITEMAP_ARTIFACT_KEY:
+            wanted = index
+
+        # Шарды прошлой сборки, которых больше нет (например, товаров стало меньше)
+        cur.execute('''
+            DELETE FROM t_p90017259_flo_rustic_shop.site_artifacts
+            WHERE key LIKE 'sitemap-%%' AND NOT (key = ANY(%s))
+        ''', ([shard['key'] for shard in shards],))
+    conn.commit()
+    print(f"Sitemap regenerated for catalog v{version}: {len(shards)} shards, {index['url_count']} urls")
+    return wanted, changed
+
+def notify_search_engines() -> None:
+    '''Tell IndexNow the sitemap changed; called only after a regeneration that changed it'''
+    if not INDEXNOW_URL:
+        return
+    try:
+        import urllib.request
+
+        request = urllib.request.Request(
+            INDEXNOW_URL,
+            data=json.dumps({'urls': ['/sitemap.xml']}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        urllib.request.urlopen(request, timeout=INDEXNOW_TIMEOUT)
+    except Exception as e:
+        print(f'IndexNow notification failed: {e}')
+
+def sitemap_response(event: Dict[str, Any], artifact: Dict[str, Any]) -> Dict[str, Any]:
+    '''Stored bytes as they are: the gzip copy for clients that accept it, plain XML otherwise'''
+    etag = artifact['etag']
+    if etag_matches(event, etag):
+        return not_modified_response(etag, SITEMAP_CACHE_CONTROL)
+    headers = {
+        'Content-Type': 'application/xml; charset=utf-8',
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': SITEMAP_CACHE_CONTROL,
+        'ETag': etag,
+        'Vary': 'Accept-Encoding'
+    }
+    if artifact.get('content_gzip') is not None and 'gzip' in accepted_encodings(event):
+        headers['Content-Encoding'] = 'gzip'
+        headers['ETag'] = 'W/' + etag
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': base64.b64encode(bytes(artifact['content_gzip'])).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': bytes(artifact['content']).decode('utf-8'),
+        'isBase64Encoded': False
+    }
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Generate dynamic XML sitemap with all cities and products
-    Args: event with httpMethod
+    Business: Serve the sitemap index and its shards stored in site_artifacts, rebuilding them from the DB when the catalog changed
+    Args: event with httpMethod (GET serves, POST rebuilds; body {"force": false} only if stale), queryStringParameters.file (shard name, default sitemap.xml)
     Returns: XML sitemap response
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -15,15 +604,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    if method != 'GET':
+    if method not in ('GET', 'POST'):
         return {
             'statusCode': 405,
             'headers': {
@@ -34,144 +623,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    try:
-        import urllib.request
-        
-        cities_response = urllib.request.urlopen('https://functions.poehali.dev/3f4d37f0-b84f-4157-83b7-55bdb568e459?action=list')
-        cities_data = json.loads(cities_response.read().decode('utf-8'))
-        
-        products_response = urllib.request.urlopen('https://functions.poehali.dev/f3ffc9b4-fbea-48e8-959d-c34ea68e6531?action=list')
-        products_data = json.loads(products_response.read().decode('utf-8'))
-        
-        # Уведомление поисковиков через IndexNow
-        def notify_search_engines():
-            try:
-                indexnow_payload = json.dumps({'urls': ['/sitemap.xml']}).encode('utf-8')
-                indexnow_req = urllib.request.Request(
-                    'https://functions.poehali.dev/f9051455-576c-4094-8413-8c03926b2370',
-                    data=indexnow_payload,
-                    headers={'Content-Type': 'application/json'}
-                )
-                urllib.request.urlopen(indexnow_req, timeout=5)
-            except:
-                pass  # Не блокируем основной ответ если уведомление не удалось
-        
-        # Запускаем уведомление в фоне
-        notify_search_engines()
-        
-        def create_slug(name: str) -> str:
-            return (name.lower()
-                    .replace('ё', 'e')
-                    .replace(' ', '-')
-                    .replace('а', 'a').replace('б', 'b').replace('в', 'v').replace('г', 'g')
-                    .replace('д', 'd').replace('е', 'e').replace('ж', 'zh').replace('з', 'z')
-                    .replace('и', 'i').replace('й', 'j').replace('к', 'k').replace('л', 'l')
-                    .replace('м', 'm').replace('н', 'n').replace('о', 'o').replace('п', 'p')
-                    .replace('р', 'r').replace('с', 's').replace('т', 't').replace('у', 'u')
-                    .replace('ф', 'f').replace('х', 'h').replace('ц', 'c').replace('ч', 'ch')
-                    .replace('ш', 'sh').replace('щ', 'sch').replace('ъ', '').replace('ы', 'y')
-                    .replace('ь', '').replace('э', 'e').replace('ю', 'yu').replace('я', 'ya'))
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        xml_urls = []
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>daily</changefreq>
-    <priority>1.0</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/catalog</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>daily</changefreq>
-    <priority>0.9</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/about</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>monthly</changefreq>
-    <priority>0.6</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/delivery</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>monthly</changefreq>
-    <priority>0.7</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/guarantees</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>monthly</changefreq>
-    <priority>0.6</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/contacts</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>monthly</changefreq>
-    <priority>0.7</priority>
-  </url>''')
-        
-        xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/reviews</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>weekly</changefreq>
-    <priority>0.6</priority>
-  </url>''')
-        
-        if cities_data.get('cities'):
-            for region_cities in cities_data['cities'].values():
-                for city in region_cities:
-                    city_slug = create_slug(city['name'])
-                    xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/city/{city_slug}</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>daily</changefreq>
-    <priority>0.9</priority>
-  </url>''')
-                    xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/city/{city_slug}/delivery</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>weekly</changefreq>
-    <priority>0.8</priority>
-  </url>''')
-        
-        if products_data.get('products'):
-            for product in products_data['products']:
-                xml_urls.append(f'''  <url>
-    <loc>https://florustic.ru/product/{product["id"]}</loc>
-    <lastmod>{today}</lastmod>
-    <changefreq>weekly</changefreq>
-    <priority>0.8</priority>
-  </url>''')
-        
-        sitemap_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
-        xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-        xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9
-        http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">
-  
-{chr(10).join(xml_urls)}
-  
-</urlset>'''
-        
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
         return {
-            'statusCode': 200,
+            'statusCode': 500,
             'headers': {
-                'Content-Type': 'application/xml; charset=utf-8',
-                'Access-Control-Allow-Origin': '*',
-                'Cache-Control': 'public, max-age=3600'
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
             },
-            'body': sitemap_xml,
+            'body': json.dumps({'error': 'Database not configured'}),
             'isBase64Encoded': False
         }
-        
+    
+    params = event.get('queryStringParameters') or {}
+    file_key = params.get('file') or SITEMAP_ARTIFACT_KEY
+    if not SITEMAP_FILE_RE.match(file_key):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Unknown sitemap file'}),
+            'isBase64Encoded': False
+        }
+    
+    changed = False
+    conn = None
+    try:
+        conn = get_db_connection(dsn)
+        if method == 'POST':
+            # {"force": false} — пересобрать, только если каталог изменился (так делают превью и выгрузка)
+            try:
+                body = json.loads(event.get('body') or '{}')
+            except ValueError:
+                body = {}
+            force = not (isinstance(body, dict) and body.get('force') is False)
+            artifact, changed = regenerate_sitemap(conn, force=force)
+        else:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                artifact = load_artifact(cur, file_key)
+            if artifact['content'] is None:
+                artifact, changed = regenerate_sitemap(conn, want_key=file_key)
     except Exception as e:
         print(f'Ошибка генерации sitemap: {str(e)}')
         return {
@@ -182,4 +675,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             },
             'body': json.dumps({'error': f'Failed to generate sitemap: {str(e)}'}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+    
+    if changed:
+        notify_search_engines()
+    
+    if method == 'POST':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'regenerated': force or changed, 'changed': changed, 'etag': artifact['etag']}),
+            'isBase64Encoded': False
+        }
+    if artifact is None:
+        return {
+            'statusCode': 404,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Sitemap file not found'}),
+            'isBase64Encoded': False
+        }
+    return sitemap_response(event, artifact)
@@ -4,6 +4,45 @@ import uuid
 import os
 from typing import Dict, Any
 
+def store_image(image_data: str, filename: str = 'image.jpg') -> Dict[str, str]:
+    '''
+    Decode base64 (optionally a data: URL) and put it to the public images/ prefix in S3.
+    Returns url and filename of the stored object.
+    '''
+    import boto3
+    
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    
+    image_bytes = base64.b64decode(image_data)
+    
+    file_ext = filename.split('.')[-1] if '.' in filename else 'jpg'
+    unique_filename = f"{uuid.uuid4()}.{file_ext}"
+    
+    s3_client = boto3.client(
+        's3',
+        endpoint_url=os.environ.get('S3_ENDPOINT'),
+        aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+        aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
+        region_name='ru-central1'
+    )
+    
+    bucket_name = os.environ.get('S3_BUCKET')
+    s3_key = f"images/{unique_filename}"
+    
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=s3_key,
+        Body=image_bytes,
+        ContentType=f"image/{file_ext}",
+        ACL='public-read'
+    )
+    
+    return {
+        'url': f"https://{bucket_name}.storage.yandexcloud.net/{s3_key}",
+        'filename': unique_filename
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Upload images to S3 and return public URL
@@ -36,8 +75,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        import boto3
-        
         body_data = json.loads(event.get('body', '{}'))
         image_data = body_data.get('image')
         filename = body_data.get('filename', 'image.jpg')
@@ -53,34 +90,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'No image data provided'})
             }
         
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        
-        file_ext = filename.split('.')[-1] if '.' in filename else 'jpg'
-        unique_filename = f"{uuid.uuid4()}.{file_ext}"
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=os.environ.get('S3_ENDPOINT'),
-            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
-            aws_secret_access_key=os.environ.get('S3_SECRET_KEY'),
-            region_name='ru-central1'
-        )
-        
-        bucket_name = os.environ.get('S3_BUCKET')
-        s3_key = f"images/{unique_filename}"
-        
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=image_bytes,
-            ContentType=f"image/{file_ext}",
-            ACL='public-read'
-        )
-        
-        public_url = f"https://{bucket_name}.storage.yandexcloud.net/{s3_key}"
+        stored = store_image(image_data, filename)
         
         return {
             'statusCode': 200,
@@ -89,10 +99,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'isBase64Encoded': False,
-            'body': json.dumps({
-                'url': public_url,
-                'filename': unique_filename
-            })
+            'body': json.dumps(stored)
         }
         
     except Exception as e:
@@ -0,0 +1,112 @@
+'''
+One-shot job: move base64 images still stored inline in products.image_url to S3.
+
+Each image goes through store_image() from this function's handler, so the
+object key, content type and public URL match what the admin upload produces.
+Run from this directory with DATABASE_URL and the S3_* variables set:
+
+    python migrate_inline_images.py [--dry-run]
+
+With CATALOG_SNAPSHOT_URL set, the catalog snapshot is rebuilt right after the
+catalog_version bump instead of waiting for the timer trigger.
+
+psycopg2 is needed only for this job and is not part of the function's requirements.
+'''
+import json
+import os
+import re
+import sys
+import urllib.request
+from typing import Optional
+
+import psycopg2
+
+from index import store_image
+
+INLINE_IMAGE_MIN_LENGTH = 5000
+CATALOG_SNAPSHOT_URL = os.environ.get('CATALOG_SNAPSHOT_URL', '')
+CATALOG_SNAPSHOT_TIMEOUT = float(os.environ.get('CATALOG_SNAPSHOT_TIMEOUT', '60'))
+DATA_URL_RE = re.compile(r'^data:image/([a-zA-Z0-9.+-]+);base64,')
+
+def inline_image_extension(image_url: str) -> Optional[str]:
+    '''File extension for a data: URL, None if the value does not look like an inline image'''
+    match = DATA_URL_RE.match(image_url[:100])
+    if match:
+        ext = match.group(1).lower()
+        return {'jpeg': 'jpg', 'svg+xml': 'svg'}.get(ext, ext)
+    if image_url.startswith(('http://', 'https://', '/')):
+        return None
+    # Голый base64 без префикса data: встречается в старых записях
+    return 'jpg'
+
+def rebuild_catalog_snapshot() -> None:
+    '''Ask catalog-snapshot to rebuild now; it skips the build if catalog_version is already published'''
+    if not CATALOG_SNAPSHOT_URL:
+        print('CATALOG_SNAPSHOT_URL not set, snapshot will be rebuilt by the timer trigger')
+        return
+    request = urllib.request.Request(
+        CATALOG_SNAPSHOT_URL,
+        data=json.dumps({'force': False}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=CATALOG_SNAPSHOT_TIMEOUT) as response:
+            print(f'catalog snapshot: {response.status} {response.read().decode("utf-8")}')
+    except Exception as e:
+        print(f'catalog snapshot rebuild failed, the timer trigger will retry: {e}')
+
+def migrate(dry_run: bool = False) -> int:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=5)
+    moved = 0
+    try:
+        with conn.cursor() as cur:
+            # Список только по id: сами картинки читаем по одной, чтобы не держать их все в памяти
+            cur.execute('''
+                SELECT id FROM products
+                WHERE octet_length(image_url) > %s
+                ORDER BY id
+            ''', (INLINE_IMAGE_MIN_LENGTH,))
+            product_ids = [row[0] for row in cur.fetchall()]
+
+        for product_id in product_ids:
+            with conn.cursor() as cur:
+                cur.execute('SELECT image_url, md5(image_url) FROM products WHERE id = %s', (product_id,))
+                row = cur.fetchone()
+                if not row:
+                    continue
+                image_url, digest = row
+                ext = inline_image_extension(image_url)
+                if not ext:
+                    print(f'product {product_id}: long non-inline image_url, skipped')
+                    continue
+                if dry_run:
+                    print(f'product {product_id}: would upload {len(image_url)} chars as .{ext}')
+                    continue
+
+                stored = store_image(image_data=image_url, filename=f'product-{product_id}.{ext}')
+                # md5 защищает от перезаписи, если картинку успели поменять в админке
+                cur.execute('''
+                    UPDATE products SET image_url = %s
+                    WHERE id = %s AND md5(image_url) = %s
+                ''', (stored['url'], product_id, digest))
+                if cur.rowcount:
+                    moved += 1
+                    print(f'product {product_id}: {stored["url"]}')
+                else:
+                    print(f'product {product_id}: changed concurrently, uploaded object left unused')
+            conn.commit()
+
+        if moved:
+            with conn.cursor() as cur:
+                cur.execute('UPDATE t_p90017259_flo_rustic_shop.catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1')
+            conn.commit()
+    finally:
+        conn.close()
+    return moved
+
+if __name__ == '__main__':
+    count = migrate(dry_run='--dry-run' in sys.argv[1:])
+    print(f'moved {count} images')
+    if count:
+        rebuild_catalog_snapshot()
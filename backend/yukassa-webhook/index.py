@@ -1,12 +1,189 @@
+import functools
 import json
 import os
+import re
+import time
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection, cursor as PgCursor
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from typing import Dict, Any, Tuple
 
+DB_MAX_CONNECTION_AGE = int(os.environ.get('DB_MAX_CONNECTION_AGE', '300'))
+DB_PING_IDLE_AFTER = int(os.environ.get('DB_PING_IDLE_AFTER', '30'))
+
+_db_conn = None
+_db_conn_opened_at = 0.0
+_db_conn_used_at = 0.0
+
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+DB_STATS_LOG = os.environ.get('DB_STATS_LOG', 'true').lower() not in ('0', 'false', 'no')
+
+_db_stats: Dict[str, Any] = {}
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+PAYMENT_STATUS_BY_YUKASSA = {'succeeded': 'paid', 'canceled': 'failed'}
+
+# Переходы payment_status: paid конечный, поздний pending/failed его не откатывает.
+# failed применяется только к текущему платежу заказа, чтобы отмена старой попытки
+# не перечёркивала новую.
+APPLY_PAYMENT_STATUS_SQL = '''
+    UPDATE orders
+    SET payment_id = %(payment_id)s, payment_status = %(status)s, updated_at = CURRENT_TIMESTAMP
+    WHERE id = %(order_id)s
+      AND payment_status IS DISTINCT FROM 'paid'
+      AND (
+            %(status)s = 'paid'
+         OR (%(status)s = 'failed' AND (payment_id IS NULL OR payment_id = %(payment_id)s))
+         OR (%(status)s = 'pending' AND (payment_status IS NULL OR payment_status = 'pending'))
+      )
+    RETURNING *
+'''
+
+def reset_db_stats() -> None:
+    _db_stats.update(queries=0, seconds=0.0, rows=0, slowest_seconds=0.0, slowest_sql=None)
+
+def normalize_sql(sql: Any) -> str:
+    '''Query text for logs: literals replaced with ?, whitespace collapsed'''
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = re.sub(r"'(?:[^']|'')*'", '?', str(sql))
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())[:1000]
+
+def record_db_statement(query: Any, seconds: float, rows: int) -> None:
+    if not _db_stats:
+        reset_db_stats()
+    _db_stats['queries'] += 1
+    _db_stats['seconds'] += seconds
+    _db_stats['rows'] += max(rows, 0)
+    if seconds > _db_stats['slowest_seconds']:
+        _db_stats['slowest_seconds'] = seconds
+        _db_stats['slowest_sql'] = query
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        print(json.dumps({
+            'event': 'slow_query',
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'sql': normalize_sql(query)
+        }, ensure_ascii=False))
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every statement to record_db_statement'''
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started,
+                                        self.rowcount if self.description else 0)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_db_statement(query, time.perf_counter() - started, 0)
+
+        cls = _instrumented_cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(PgConnection):
+    '''Connection whose cursors, whatever cursor_factory is asked for, feed _db_stats'''
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or PgCursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+def instrument_db(func):
+    '''
+    Wrap the handler: reset per-invocation DB stats, add X-DB-Time / X-DB-Queries /
+    Server-Timing headers and print one JSON line with the totals and slowest statement.
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        reset_db_stats()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = func(event, context)
+            if isinstance(response, dict):
+                db_ms = _db_stats['seconds'] * 1000
+                total_ms = (time.perf_counter() - started) * 1000
+                response['headers'] = {
+                    'X-DB-Time': f'{db_ms:.1f}',
+                    'X-DB-Queries': str(_db_stats['queries']),
+                    'Server-Timing': f'db;dur={db_ms:.1f};desc="{_db_stats["queries"]} queries", total;dur={total_ms:.1f}',
+                    **(response.get('headers') or {})
+                }
+            return response
+        finally:
+            if DB_STATS_LOG:
+                print(json.dumps({
+                    'event': 'db_stats',
+                    'function': getattr(context, 'function_name', None),
+                    'request_id': getattr(context, 'request_id', None),
+                    'method': (event or {}).get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else None,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'db_queries': _db_stats['queries'],
+                    'db_ms': round(_db_stats['seconds'] * 1000, 1),
+                    'db_rows': _db_stats['rows'],
+                    'slowest_ms': round(_db_stats['slowest_seconds'] * 1000, 1),
+                    'slowest_sql': normalize_sql(_db_stats['slowest_sql']) if _db_stats['slowest_sql'] else None
+                }, ensure_ascii=False))
+    return wrapper
+
+def _discard_db_connection() -> None:
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+    _db_conn = None
+
+def get_db_connection(dsn: str):
+    '''
+    Borrow the warm-container connection instead of opening a new one per request.
+    Reopened when older than DB_MAX_CONNECTION_AGE, pinged after DB_PING_IDLE_AFTER
+    seconds of inactivity, and dropped if the socket or transaction state is broken.
+    '''
+    global _db_conn, _db_conn_opened_at, _db_conn_used_at
+    now = time.monotonic()
+    if _db_conn is not None:
+        healthy = (
+            not _db_conn.closed
+            and _db_conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            and now - _db_conn_opened_at < DB_MAX_CONNECTION_AGE
+        )
+        if healthy and now - _db_conn_used_at > DB_PING_IDLE_AFTER:
+            try:
+                with _db_conn.cursor() as ping:
+                    ping.execute('SELECT 1')
+                _db_conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            _discard_db_connection()
+    if _db_conn is None:
+        _db_conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=InstrumentedConnection)
+        _db_conn_opened_at = now
+    _db_conn_used_at = now
+    return _db_conn
+
+def release_db_connection(conn) -> None:
+    '''Return the connection to the warm pool, rolling back anything left uncommitted'''
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        if conn is _db_conn:
+            _discard_db_connection()
+
+@instrument_db
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Обработка webhook уведомлений от ЮKassa о статусе оплаты
@@ -62,53 +239,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    new_payment_status = 'pending'
-    if payment_status == 'succeeded':
-        new_payment_status = 'paid'
-    elif payment_status == 'canceled':
-        new_payment_status = 'failed'
-    
-    cursor.execute('''
-        UPDATE orders
-        SET payment_id = %s, payment_status = %s, updated_at = CURRENT_TIMESTAMP
-        WHERE id = %s
-        RETURNING *
-    ''', (payment_id, new_payment_status, order_id))
-    
-    updated_order = cursor.fetchone()
-    conn.commit()
-    
-    if updated_order and new_payment_status == 'paid':
-        order_dict = dict(updated_order)
-        if isinstance(order_dict.get('items'), str):
-            order_dict['items'] = json.loads(order_dict['items'])
-        send_order_email(order_dict)
+    new_payment_status = PAYMENT_STATUS_BY_YUKASSA.get(payment_status, 'pending')
+    event_name = notification_type or f'payment.{payment_status}'
     
-    cursor.close()
-    conn.close()
+    conn = get_db_connection(dsn)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        # Повтор уже обработанного уведомления: одна вставка по первичному ключу и 200
+        cursor.execute('''
+            INSERT INTO t_p90017259_flo_rustic_shop.payment_events (payment_id, event, order_id, status)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (payment_id, event) DO NOTHING
+            RETURNING payment_id
+        ''', (payment_id, event_name, order_id, payment_status))
+        if cursor.fetchone() is None:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'status': 'duplicate'}),
+                'isBase64Encoded': False
+            }
+        
+        cursor.execute(APPLY_PAYMENT_STATUS_SQL, {
+            'payment_id': payment_id,
+            'status': new_payment_status,
+            'order_id': order_id
+        })
+        updated_order = cursor.fetchone()
+        
+        if updated_order and new_payment_status == 'paid':
+            order_dict = dict(updated_order)
+            if isinstance(order_dict.get('items'), str):
+                order_dict['items'] = json.loads(order_dict['items'])
+            enqueue_order_email(cursor, order_dict, f"order-{order_dict['id']}-paid")
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'status': 'ok'}),
+        'body': json.dumps({'status': 'ok' if updated_order else 'ignored'}),
         'isBase64Encoded': False
     }
 
-def send_order_email(order: dict):
-    smtp_user = os.environ.get('SMTP_USER')
-    smtp_password = os.environ.get('SMTP_PASSWORD')
-    smtp_port = os.environ.get('SMTP_PORT', '587')
-    
-    if not smtp_user or not smtp_password:
-        return
-    
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = f'Новый заказ #{order["order_number"]} - ОПЛАЧЕН'
-    msg['From'] = smtp_user
-    msg['To'] = smtp_user
+def render_order_email(order: dict) -> Tuple[str, str]:
+    '''Subject and plain-text body of the shop's paid-order email'''
+    subject = f'Новый заказ #{order["order_number"]} - ОПЛАЧЕН'
     
     items_text = '\n'.join([
         f"  - {item['name']} x {item['quantity']} = {item['price'] * item['quantity']} ₽"
@@ -159,13 +337,16 @@ def send_order_email(order: dict):
 Статус оплаты: Оплачен
 '''
     
-    msg.attach(MIMEText(text_content, 'plain', 'utf-8'))
-    
-    try:
-        server = smtplib.SMTP('smtp.yandex.ru', int(smtp_port))
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-        server.quit()
-    except Exception as e:
-        pass
\ No newline at end of file
+    return subject, text_content
+
+def enqueue_order_email(cursor, order: dict, dedupe_key: str) -> None:
+    '''
+    Queue the paid-order email in the same transaction as the payment status update.
+    YooKassa retries webhooks, so a repeated dedupe_key is ignored instead of mailing twice.
+    '''
+    subject, text_content = render_order_email(order)
+    cursor.execute('''
+        INSERT INTO t_p90017259_flo_rustic_shop.notification_outbox (kind, order_id, dedupe_key, subject, body)
+        VALUES ('order_email', %s, %s, %s, %s)
+        ON CONFLICT (dedupe_key) DO NOTHING
+    ''', (order['id'], dedupe_key, subject, text_content))
@@ -0,0 +1,56 @@
+-- Предрасчитанная матрица каталога: одна строка на пару (товар, город)
+-- с итоговой ценой, доступностью и ключом сортировки.
+-- Обновляется точечно функцией refresh_product_city_catalog после изменений в админке.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.product_city_catalog (
+    product_id INTEGER NOT NULL,
+    city_id INTEGER NOT NULL,
+    price DECIMAL(10, 2) NOT NULL,
+    is_available BOOLEAN NOT NULL,
+    sort_key TIMESTAMP NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_id, city_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_city_catalog_city_sort
+    ON t_p90017259_flo_rustic_shop.product_city_catalog(city_id, sort_key DESC, product_id DESC)
+    WHERE is_available = true;
+
+-- NULL в параметре означает «все»: (product, NULL) — товар во всех городах,
+-- (NULL, city) — все товары города, (NULL, NULL) — полная перестройка.
+CREATE OR REPLACE FUNCTION t_p90017259_flo_rustic_shop.refresh_product_city_catalog(
+    p_product_id INTEGER DEFAULT NULL,
+    p_city_id INTEGER DEFAULT NULL
+) RETURNS void AS $$
+    INSERT INTO t_p90017259_flo_rustic_shop.product_city_catalog
+        (product_id, city_id, price, is_available, sort_key, refreshed_at)
+    SELECT p.id, c.id,
+           COALESCE(pcp.price,
+                    ROUND(p.base_price * (1 + COALESCE(c.price_markup_percent, 0) / 100), 2)),
+           COALESCE(p.is_active, false) AND COALESCE(c.is_active, false)
+               AND NOT EXISTS (
+                   SELECT 1 FROM t_p90017259_flo_rustic_shop.product_city_exclusions pce
+                   WHERE pce.product_id = p.id AND pce.city_id = c.id
+               )
+               AND NOT EXISTS (
+                   SELECT 1 FROM t_p90017259_flo_rustic_shop.product_region_exclusions pre
+                   WHERE pre.product_id = p.id AND pre.region_id = c.region_id
+               ),
+           COALESCE(p.created_at, CURRENT_TIMESTAMP),
+           CURRENT_TIMESTAMP
+    FROM t_p90017259_flo_rustic_shop.products p
+    CROSS JOIN t_p90017259_flo_rustic_shop.cities c
+    LEFT JOIN t_p90017259_flo_rustic_shop.product_city_prices pcp
+        ON pcp.product_id = p.id AND pcp.city_id = c.id
+    WHERE (p_product_id IS NULL OR p.id = p_product_id)
+      AND (p_city_id IS NULL OR c.id = p_city_id)
+    ON CONFLICT (product_id, city_id) DO UPDATE SET
+        price = EXCLUDED.price,
+        is_available = EXCLUDED.is_available,
+        sort_key = EXCLUDED.sort_key,
+        refreshed_at = EXCLUDED.refreshed_at;
+$$ LANGUAGE sql;
+
+SELECT t_p90017259_flo_rustic_shop.refresh_product_city_catalog();
+
+COMMENT ON TABLE t_p90017259_flo_rustic_shop.product_city_catalog IS 'Итоговая цена и доступность товара в каждом городе для чтения каталога одним индексным сканом';
@@ -0,0 +1,13 @@
+-- Монотонный номер версии каталога.
+-- Каждая запись в админке (товары, цены, города, исключения) увеличивает version,
+-- по нему тёплые контейнеры функции products сбрасывают кеш ответов каталога.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.catalog_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p90017259_flo_rustic_shop.catalog_version (id, version)
+VALUES (1, 1)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,14 @@
+-- Индексы для keyset-пагинации списков товаров по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_products_created_at_id
+    ON t_p90017259_flo_rustic_shop.products(created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_products_active_created_at_id
+    ON t_p90017259_flo_rustic_shop.products(created_at DESC, id DESC)
+    WHERE is_active = true;
+
+-- Фильтры по категории и подкатегории сразу дают product_id для соединения
+CREATE INDEX IF NOT EXISTS idx_product_categories_category_product
+    ON t_p90017259_flo_rustic_shop.product_categories(category, product_id);
+
+CREATE INDEX IF NOT EXISTS idx_product_subcategories_subcategory_product
+    ON t_p90017259_flo_rustic_shop.product_subcategories(subcategory_id, product_id);
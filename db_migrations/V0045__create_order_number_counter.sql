@@ -0,0 +1,18 @@
+-- Счётчик номеров заказов: одна строка, номер выдаётся через UPDATE ... RETURNING
+-- в той же транзакции, что и INSERT заказа. Блокировка строки держится до COMMIT,
+-- поэтому при откате номер не сгорает (в отличие от SEQUENCE) и нумерация остаётся без дыр.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.order_number_counter (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    last_value BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p90017259_flo_rustic_shop.order_number_counter (id, last_value)
+SELECT 1, COALESCE(MAX(CAST(order_number AS BIGINT)), 0)
+FROM t_p90017259_flo_rustic_shop.orders
+WHERE order_number ~ '^[0-9]+$'
+ON CONFLICT (id) DO UPDATE SET last_value = GREATEST(
+    t_p90017259_flo_rustic_shop.order_number_counter.last_value,
+    EXCLUDED.last_value
+);
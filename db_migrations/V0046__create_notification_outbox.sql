@@ -0,0 +1,26 @@
+-- Очередь исходящих уведомлений (transactional outbox).
+-- Письмо записывается в той же транзакции, что и изменение заказа,
+-- а отправляет его функция notification-worker: пачками, через одну SMTP-сессию, с повторами.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    order_id INTEGER,
+    dedupe_key VARCHAR(255) UNIQUE,
+    recipient VARCHAR(255),
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending
+    ON t_p90017259_flo_rustic_shop.notification_outbox(next_attempt_at, id)
+    WHERE status = 'pending';
+
+COMMENT ON COLUMN t_p90017259_flo_rustic_shop.notification_outbox.recipient IS 'NULL — почтовый ящик магазина (SMTP_USER воркера)';
+COMMENT ON COLUMN t_p90017259_flo_rustic_shop.notification_outbox.next_attempt_at IS 'Время следующей попытки; при захвате пачки сдвигается на срок аренды';
@@ -0,0 +1,14 @@
+-- Индексы под постраничный список заказов в админке:
+-- ORDER BY created_at DESC, id DESC с курсором (created_at, id) и фильтрами по статусам и городу.
+
+CREATE INDEX IF NOT EXISTS idx_orders_created_at_id
+    ON t_p90017259_flo_rustic_shop.orders(created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_at
+    ON t_p90017259_flo_rustic_shop.orders(status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_payment_status_created_at
+    ON t_p90017259_flo_rustic_shop.orders(payment_status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_city_created_at
+    ON t_p90017259_flo_rustic_shop.orders(city_id, created_at DESC, id DESC);
@@ -0,0 +1,17 @@
+-- Журнал уведомлений ЮKassa: одна строка на (платёж, событие).
+-- ЮKassa повторяет webhook до получения 200, повтор отсекается вставкой
+-- с ON CONFLICT DO NOTHING и не трогает ни orders, ни outbox.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.payment_events (
+    payment_id VARCHAR(255) NOT NULL,
+    event VARCHAR(100) NOT NULL,
+    order_id INTEGER,
+    status VARCHAR(50),
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (payment_id, event)
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_payment_id
+    ON t_p90017259_flo_rustic_shop.orders(payment_id);
+
+COMMENT ON COLUMN t_p90017259_flo_rustic_shop.payment_events.event IS 'Тип уведомления ЮKassa: payment.succeeded, payment.canceled, payment.waiting_for_capture';
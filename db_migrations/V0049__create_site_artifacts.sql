@@ -0,0 +1,22 @@
+-- Готовые файлы сайта (sitemap и т.п.), собранные из БД.
+-- source_version — значение catalog_version, из которого файл собран:
+-- пока версия не изменилась, функция отдаёт сохранённые байты без пересборки.
+
+CREATE TABLE IF NOT EXISTS t_p90017259_flo_rustic_shop.site_artifacts (
+    key VARCHAR(255) PRIMARY KEY,
+    content BYTEA NOT NULL,
+    content_gzip BYTEA,
+    content_type VARCHAR(100) NOT NULL,
+    etag VARCHAR(100) NOT NULL,
+    source_version BIGINT NOT NULL,
+    url_count INTEGER,
+    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- lastmod городов в sitemap берётся из updated_at
+ALTER TABLE t_p90017259_flo_rustic_shop.cities ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+UPDATE t_p90017259_flo_rustic_shop.cities
+SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP);
+
+COMMENT ON COLUMN t_p90017259_flo_rustic_shop.site_artifacts.content_gzip IS 'Тот же файл в gzip, отдаётся клиентам с Accept-Encoding: gzip без сжатия на каждый запрос';
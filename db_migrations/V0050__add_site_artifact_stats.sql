@@ -0,0 +1,15 @@
+-- Статистика готовых файлов, чтобы превью и выгрузка sitemap не читали весь файл:
+-- размер, число символов и строк и разреженный индекс строк — байтовое смещение
+-- начала каждой line_index_step-й строки (строка 0, step, 2*step, ...).
+
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS byte_size BIGINT;
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS char_count BIGINT;
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS line_count INTEGER;
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS line_index_step INTEGER;
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS line_index BIGINT[];
+
+-- Без сжатия в TOAST substring() по content читает только нужные чанки, а не весь файл
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ALTER COLUMN content SET STORAGE EXTERNAL;
+
+-- Сохранённые файлы пересоберутся при следующем запросе и получат статистику
+UPDATE t_p90017259_flo_rustic_shop.site_artifacts SET source_version = -1;
@@ -0,0 +1,50 @@
+-- Постоянный slug города для /city/<slug>: seo-render и sitemap находят город одним
+-- запросом по индексу вместо транслитерации всех названий на каждый запрос.
+-- Транслитерация та же, что в create_slug/createSlug (бэкенд и фронтенд).
+
+CREATE OR REPLACE FUNCTION t_p90017259_flo_rustic_shop.city_slug(p_name TEXT) RETURNS TEXT AS $$
+    SELECT translate(
+        replace(replace(replace(replace(replace(replace(
+            -- кириллица в нижний регистр явно: lower() в локали C её не трогает
+            lower(translate(p_name,
+                'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ',
+                'абвгдеёжзийклмнопрстуфхцчшщъыьэюя')),
+            'ж', 'zh'), 'ч', 'ch'), 'щ', 'sch'), 'ш', 'sh'), 'ю', 'yu'), 'я', 'ya'),
+        'абвгдеёзийклмнопрстуфхцыэ ъь',
+        'abvgdeezijklmnoprstufhcye-'
+    )
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Slug для города p_city_id: базовый, если он не занят другим активным городом,
+-- иначе с суффиксом -<id> (одноимённые города в разных регионах)
+CREATE OR REPLACE FUNCTION t_p90017259_flo_rustic_shop.city_slug_for(p_city_id INTEGER, p_name TEXT) RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN EXISTS (
+            SELECT 1 FROM t_p90017259_flo_rustic_shop.cities
+            WHERE slug = t_p90017259_flo_rustic_shop.city_slug(p_name)
+              AND is_active = true AND id <> p_city_id
+        )
+        THEN t_p90017259_flo_rustic_shop.city_slug(p_name) || '-' || p_city_id
+        ELSE t_p90017259_flo_rustic_shop.city_slug(p_name)
+    END
+$$ LANGUAGE sql STABLE;
+
+ALTER TABLE t_p90017259_flo_rustic_shop.cities ADD COLUMN IF NOT EXISTS slug VARCHAR(255);
+
+-- Из активных одноимённых базовый slug остаётся у города с меньшим id
+UPDATE t_p90017259_flo_rustic_shop.cities c
+SET slug = CASE WHEN ranked.duplicate THEN ranked.base || '-' || c.id ELSE ranked.base END
+FROM (
+    SELECT id,
+           t_p90017259_flo_rustic_shop.city_slug(name) AS base,
+           is_active AND row_number() OVER (
+               PARTITION BY t_p90017259_flo_rustic_shop.city_slug(name), is_active ORDER BY id
+           ) > 1 AS duplicate
+    FROM t_p90017259_flo_rustic_shop.cities
+) ranked
+WHERE ranked.id = c.id;
+
+-- Уникален среди активных: неактивный город не держит slug за собой
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cities_slug_active
+    ON t_p90017259_flo_rustic_shop.cities(slug)
+    WHERE is_active = true;
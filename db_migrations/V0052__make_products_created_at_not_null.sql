@@ -0,0 +1,15 @@
+-- Keyset-пагинация идёт по (created_at, id): строка с NULL ломает курсор и
+-- выпадает из сравнения (created_at, id) < (...). Товары без даты уходят в конец списка.
+
+UPDATE t_p90017259_flo_rustic_shop.products
+SET created_at = TIMESTAMP 'epoch'
+WHERE created_at IS NULL;
+
+ALTER TABLE t_p90017259_flo_rustic_shop.products ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE t_p90017259_flo_rustic_shop.products ALTER COLUMN created_at SET NOT NULL;
+
+-- sort_key матрицы брал CURRENT_TIMESTAMP для таких товаров, выравниваем с products
+UPDATE t_p90017259_flo_rustic_shop.product_city_catalog pcc
+SET sort_key = p.created_at
+FROM t_p90017259_flo_rustic_shop.products p
+WHERE p.id = pcc.product_id AND pcc.sort_key <> p.created_at;
@@ -0,0 +1,4 @@
+-- lastmod статических страниц sitemap берётся из page_contents, а правка текстов
+-- не меняет catalog_version. Файл собран и из версии каталога, и из последней правки
+-- текстов: при расхождении любой из них sitemap пересобирается.
+ALTER TABLE t_p90017259_flo_rustic_shop.site_artifacts ADD COLUMN IF NOT EXISTS source_pages_updated_at TIMESTAMP;
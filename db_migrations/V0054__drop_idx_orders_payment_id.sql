@@ -0,0 +1,3 @@
+-- Webhook ЮKassa находит заказ по id из metadata, поиск заказа по payment_id
+-- нигде не выполняется: индекс только удорожает запись в orders.
+DROP INDEX IF EXISTS t_p90017259_flo_rustic_shop.idx_orders_payment_id;
@@ -0,0 +1,627 @@
+'''
+Local benchmark harness for the Python cloud functions in backend/.
+
+Each backend/<function>/index.py is imported in-process and its handler() is called
+with events built from that function's tests.json plus synthetic traffic mixes
+(catalog browsing, checkout). For every case the harness reports p50/p95/p99
+latency, SQL statements per request, DB time and Python allocations, and writes
+the numbers to a JSON file that can be diffed between commits.
+
+Needs a local Postgres and the functions' requirements (psycopg2-binary, requests, ...):
+
+    export BENCH_DATABASE_URL=postgresql://postgres@localhost/florustic_bench
+    python scripts/backend_bench.py --migrate                # apply db_migrations once
+    python scripts/generate_scale_data.py                    # optional: realistic data volume
+    python scripts/backend_bench.py --mix all -n 200 -o bench.json
+    python scripts/backend_bench.py --mix catalog --compare bench.json
+    python scripts/backend_bench.py --check-yukassa          # YooKassa client vs a local stub, no DB
+
+Write cases (POST/PUT/DELETE from tests.json, the checkout mix) change the database
+and run only with --include-writes. Outgoing HTTP triggers (IndexNow, sitemap
+refresh) are switched off by setting their URL variables to empty strings,
+and YooKassa calls go to YukassaStub, a local HTTP server started by the harness.
+'''
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+MIGRATIONS_DIR = ROOT / 'db_migrations'
+SCHEMA = 't_p90017259_flo_rustic_shop'
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+DISABLED_URL_VARS = ('INDEXNOW_URL', 'SEO_RENDER_URL', 'SITEMAP_FUNCTION_URL')
+
+# create_payment: SELECT заказа и ATTACH_PAYMENT_SQL, запрос в ЮKassa идёт вне транзакции
+CREATE_PAYMENT_MAX_QUERIES = 2
+
+# Статистика текущего запроса, её пополняют курсоры из _counting_cursor
+_request_stats = {'queries': 0, 'db_seconds': 0.0}
+
+
+class BenchContext:
+    '''Stand-in for the platform context object'''
+
+    def __init__(self, function_name: str):
+        self.request_id = f'bench-{random.getrandbits(48):012x}'
+        self.function_name = function_name
+        self.function_version = 'bench'
+        self.memory_limit_in_mb = 128
+
+
+def _counting_cursor(base):
+    '''Subclass of a psycopg2 cursor class that records statement count and time'''
+    cached = _counting_cursor.cache.get(base)
+    if cached:
+        return cached
+
+    class CountingCursor(base):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _request_stats['queries'] += 1
+                _request_stats['db_seconds'] += time.perf_counter() - started
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _request_stats['queries'] += 1
+                _request_stats['db_seconds'] += time.perf_counter() - started
+
+    CountingCursor.__name__ = f'Counting{base.__name__}'
+    _counting_cursor.cache[base] = CountingCursor
+    return CountingCursor
+
+
+_counting_cursor.cache = {}
+
+
+def install_query_counter() -> None:
+    '''
+    Route every psycopg2.connect() made by the handlers through a connection class whose
+    cursors count statements, whatever cursor_factory the handler asks for.
+    '''
+    import psycopg2
+    import psycopg2.extensions
+
+    def counting_connection(base):
+        '''Handlers pass their own InstrumentedConnection, so the counter is layered on top of it'''
+        cached = counting_connection.cache.get(base)
+        if cached:
+            return cached
+
+        class CountingConnection(base):
+            def cursor(self, *args, **kwargs):
+                factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs['cursor_factory'] = _counting_cursor(factory)
+                return super().cursor(*args, **kwargs)
+
+        counting_connection.cache[base] = CountingConnection
+        return CountingConnection
+
+    counting_connection.cache = {}
+    original_connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        base = kwargs.get('connection_factory') or psycopg2.extensions.connection
+        kwargs['connection_factory'] = counting_connection(base)
+        return original_connect(*args, **kwargs)
+
+    psycopg2.connect = connect
+
+
+def apply_migrations(dsn: str) -> int:
+    '''Apply db_migrations/V*.sql in version order, skipping files already recorded'''
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    applied = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+            cur.execute(f'SET search_path TO {SCHEMA}, public')
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS public.bench_schema_history (
+                    version VARCHAR(255) PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cur.execute('SELECT version FROM public.bench_schema_history')
+            done = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        migrations = sorted(MIGRATIONS_DIR.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0]))
+        for path in migrations:
+            if path.name in done:
+                continue
+            with conn.cursor() as cur:
+                cur.execute(f'SET search_path TO {SCHEMA}, public')
+                cur.execute(path.read_text(encoding='utf-8'))
+                cur.execute('INSERT INTO public.bench_schema_history (version) VALUES (%s)', (path.name,))
+            conn.commit()
+            applied += 1
+            print(f'applied {path.name}')
+    finally:
+        conn.close()
+    return applied
+
+
+def load_module(function_dir: Path):
+    '''Import backend/<function>/index.py under a unique module name'''
+    module_name = 'bench_' + function_dir.name.replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, function_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, str(function_dir))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(function_dir))
+    sys.modules[module_name] = module
+    return module
+
+
+def load_handler(function_dir: Path) -> Callable:
+    return load_module(function_dir).handler
+
+
+class YukassaStub:
+    '''
+    Local stand-in for the YooKassa API. POST /payments is answered with the scripted
+    statuses in turn, then with 200 and a pending payment; every request is recorded.
+    '''
+
+    def __init__(self, statuses: Tuple[int, ...] = ()):
+        self.statuses = list(statuses)
+        self.requests: List[Dict[str, Any]] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                stub.requests.append({
+                    'path': self.path,
+                    'headers': {k.lower(): v for k, v in self.headers.items()},
+                    'body': json.loads(body or b'{}')
+                })
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                key = self.headers.get('Idempotence-Key', '')
+                if status == 200:
+                    payload = {
+                        'id': f'stub-{key[:8]}',
+                        'status': 'pending',
+                        'confirmation': {'type': 'redirect', 'confirmation_url': f'{stub.url}/confirm/{key}'}
+                    }
+                else:
+                    payload = {'type': 'error', 'code': 'internal_server_error'}
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v3'
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'YukassaStub':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def check_yukassa_retry() -> List[str]:
+    '''
+    Drive orders.create_yukassa_payment against YukassaStub: a 5xx must be retried with the
+    same Idempotence-Key and the retry's payment returned, and a provider that keeps failing
+    must be given up on after YUKASSA_MAX_RETRIES retries. Returns the failed checks.
+    '''
+    failures = []
+    payment = {'amount': {'value': '2500.00', 'currency': 'RUB'}, 'capture': True}
+    with YukassaStub(statuses=(503,)) as stub:
+        os.environ['YUKASSA_API_URL'] = stub.url
+        orders = load_module(BACKEND_DIR / 'orders')
+        key = orders.payment_idempotence_key(1, '2500')
+        response = orders.create_yukassa_payment(payment, key, 'bench-shop', 'bench-secret')
+        keys = [r['headers'].get('idempotence-key') for r in stub.requests]
+        if response.status_code != 200 or response.json().get('id') != f'stub-{key[:8]}':
+            failures.append(f'503 then 200: caller got {response.status_code} {response.text[:200]}')
+        if keys != [key, key]:
+            failures.append(f'503 then 200: expected two requests with Idempotence-Key {key}, got {keys}')
+        if any(r['path'] != '/v3/payments' or not r['headers'].get('authorization', '').startswith('Basic ')
+               for r in stub.requests):
+            failures.append('503 then 200: request sent without Basic auth or to the wrong path')
+        if any(r['body'] != payment for r in stub.requests):
+            failures.append('503 then 200: retried request body differs from the original')
+
+    attempts = 1 + orders.YUKASSA_MAX_RETRIES
+    with YukassaStub(statuses=(503,) * (attempts + 1)) as stub:
+        orders.YUKASSA_API_URL = stub.url
+        response = orders.create_yukassa_payment(payment, key, 'bench-shop', 'bench-secret')
+        if response.status_code != 503 or len(stub.requests) != attempts:
+            failures.append(f'persistent 503: expected {attempts} attempts ending in 503, '
+                            f'got {len(stub.requests)} ending in {response.status_code}')
+    return failures
+
+
+def build_event(method: str, path: str = '/', body: Any = None,
+                headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''Platform-shaped HTTP event: query string split into queryStringParameters'''
+    parts = urlsplit(path)
+    event = {
+        'httpMethod': method,
+        'path': parts.path or '/',
+        'headers': dict(headers or {}),
+        'queryStringParameters': dict(parse_qsl(parts.query)),
+        'pathParams': {},
+        'requestContext': {'requestId': 'bench', 'identity': {'sourceIp': '127.0.0.1'}},
+        'isBase64Encoded': False
+    }
+    if body is not None:
+        event['body'] = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+    return event
+
+
+def load_test_cases(function_dir: Path) -> List[Dict[str, Any]]:
+    '''
+    Cases from tests.json. Both layouts used in the repo are accepted:
+    {"tests": [{method, path, body, headers, expectedStatus, maxQueries}]} and
+    [{"request": {method, path, body, headers}, "expected": {"status", "max_queries"}}].
+    A case whose slowest iteration runs more SQL statements than its budget fails the run.
+    '''
+    tests_path = function_dir / 'tests.json'
+    if not tests_path.exists():
+        return []
+    data = json.loads(tests_path.read_text(encoding='utf-8'))
+    tests = data.get('tests', []) if isinstance(data, dict) else data
+    cases = []
+    for test in tests:
+        request = test.get('request', test)
+        expected = test.get('expected', {})
+        method = request.get('method', 'GET').upper()
+        path = request.get('path', '/')
+        cases.append({
+            'name': test.get('name') or f'{method} {path}',
+            'function': function_dir.name,
+            'source': 'tests.json',
+            'event': build_event(method, path, request.get('body'), request.get('headers')),
+            'expected_status': test.get('expectedStatus', expected.get('status')),
+            'max_queries': test.get('maxQueries', expected.get('max_queries')),
+            'writes': method in WRITE_METHODS
+        })
+    return cases
+
+
+def sample_catalog(dsn: str) -> Dict[str, Any]:
+    '''Real city names, product ids and categories to build synthetic traffic from'''
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id, name FROM cities WHERE is_active = true ORDER BY id LIMIT 50')
+            cities = cur.fetchall()
+            cur.execute('SELECT id FROM products WHERE is_active = true ORDER BY id LIMIT 200')
+            product_ids = [row[0] for row in cur.fetchall()]
+            cur.execute('SELECT DISTINCT category FROM product_categories ORDER BY category LIMIT 20')
+            categories = [row[0] for row in cur.fetchall()]
+            cur.execute('SELECT id, total_amount FROM orders ORDER BY id DESC LIMIT 1')
+            order = cur.fetchone()
+    finally:
+        conn.close()
+    return {'cities': cities, 'product_ids': product_ids, 'categories': categories, 'order': order}
+
+
+def synthetic_cases(mix: str, catalog: Dict[str, Any], rng: random.Random) -> List[Dict[str, Any]]:
+    '''
+    Traffic shapes that tests.json does not cover. The catalog mix follows what a visitor
+    does on a city page; the checkout mix places an order, pays for the latest one
+    through YukassaStub and reads orders back.
+    '''
+    cases = []
+    cities = catalog['cities'] or [(1, 'Москва')]
+    product_ids = catalog['product_ids'] or [1]
+    categories = catalog['categories'] or ['Букеты']
+
+    def case(name, function, method, path, body=None, writes=False, expected_status=None, max_queries=None):
+        cases.append({
+            'name': name,
+            'function': function,
+            'source': f'mix:{mix}',
+            'event': build_event(method, path, body),
+            'expected_status': expected_status,
+            'max_queries': max_queries,
+            'writes': writes
+        })
+
+    if mix in ('catalog', 'all'):
+        city_id, city_name = rng.choice(cities)
+        category = rng.choice(categories)
+        case('catalog: city list', 'cities', 'GET', '/')
+        case('catalog: city products', 'products', 'GET', f'/?city={city_name}')
+        case('catalog: city category page', 'products', 'GET', f'/?city={city_name}&category={category}&limit=24')
+        case('catalog: product cards', 'products', 'GET', f'/?city={city_name}&fields=card&limit=24')
+        case('catalog: product page', 'products', 'GET', f'/?id={rng.choice(product_ids)}')
+        case('catalog: product availability', 'product-availability', 'GET', f'/?product_id={rng.choice(product_ids)}')
+        case('catalog: site texts', 'site-texts', 'GET', '/')
+        case('catalog: reviews', 'reviews', 'GET', '/')
+
+    if mix in ('checkout', 'all'):
+        city_id, city_name = rng.choice(cities)
+        items = [{'id': pid, 'name': f'Букет {pid}', 'quantity': 1, 'price': 2500}
+                 for pid in rng.sample(product_ids, min(2, len(product_ids)))]
+        case('checkout: create order', 'orders', 'POST', '/', {
+            'customer_name': 'Бенчмарк',
+            'customer_phone': '+79000000000',
+            'customer_email': 'bench@example.com',
+            'city_id': city_id,
+            'delivery_address': 'ул. Тестовая, д. 1',
+            'items': items,
+            'total_amount': sum(item['price'] for item in items),
+            'payment_method': 'cash'
+        }, writes=True)
+        if catalog['order']:
+            order_id, total_amount = catalog['order']
+            case('checkout: create payment', 'orders', 'POST', '/?action=create_payment', {
+                'order_id': order_id,
+                'amount': float(total_amount),
+                'return_url': 'https://example.com/'
+            }, writes=True, expected_status=200, max_queries=CREATE_PAYMENT_MAX_QUERIES)
+        case('checkout: admin orders page', 'orders', 'GET', '/?limit=50')
+        case('checkout: admin summary', 'orders', 'GET', '/?summary=true')
+
+    return cases
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    '''Nearest-rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def invoke(handler: Callable, case: Dict[str, Any]) -> Tuple[float, Optional[int], Optional[str]]:
+    _request_stats['queries'] = 0
+    _request_stats['db_seconds'] = 0.0
+    event = json.loads(json.dumps(case['event']))
+    started = time.perf_counter()
+    try:
+        response = handler(event, BenchContext(case['function']))
+        status, error = (response or {}).get('statusCode'), None
+    except Exception as e:
+        status, error = None, f'{type(e).__name__}: {e}'
+    return time.perf_counter() - started, status, error
+
+
+def run_case(handler: Callable, case: Dict[str, Any], iterations: int, warmup: int) -> Dict[str, Any]:
+    '''
+    Latency is measured without tracemalloc; allocations are taken from one extra
+    traced call, since tracing slows every allocation down several times.
+    '''
+    cold_seconds, _, _ = invoke(handler, case)
+    for _ in range(warmup):
+        invoke(handler, case)
+
+    latencies, queries, db_seconds = [], [], []
+    status_counts: Dict[str, int] = {}
+    errors: List[str] = []
+    for _ in range(iterations):
+        elapsed, status, error = invoke(handler, case)
+        latencies.append(elapsed)
+        queries.append(_request_stats['queries'])
+        db_seconds.append(_request_stats['db_seconds'])
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        if error and len(errors) < 3:
+            errors.append(error)
+
+    tracemalloc.start()
+    before_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    invoke(handler, case)
+    after_size, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    max_queries = case.get('max_queries')
+    over_query_budget = max_queries is not None and max(queries) > max_queries
+    expected = case.get('expected_status')
+    unexpected = sum(count for status, count in status_counts.items()
+                     if expected is not None and status != str(expected))
+    return {
+        'function': case['function'],
+        'name': case['name'],
+        'source': case['source'],
+        'iterations': iterations,
+        'cold_ms': round(cold_seconds * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'db_ms_per_request': round(sum(db_seconds) / len(db_seconds) * 1000, 3),
+        'peak_alloc_kb': round((peak_size - before_size) / 1024, 1),
+        'retained_alloc_kb': round((after_size - before_size) / 1024, 1),
+        'status_counts': status_counts,
+        'expected_status': expected,
+        'unexpected_status': unexpected,
+        'max_queries': max_queries,
+        'over_query_budget': over_query_budget,
+        'errors': errors
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str, threshold: float) -> int:
+    '''Print p95 and query-count changes against an earlier results file; return regressions'''
+    baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+    previous = {f"{r['function']} | {r['name']}": r for r in baseline.get('results', [])}
+    regressions = 0
+    print(f"\nvs {baseline_path} ({baseline.get('git_revision') or 'unknown revision'}):")
+    for result in current['results']:
+        key = f"{result['function']} | {result['name']}"
+        old = previous.get(key)
+        if not old:
+            print(f'  new   {key}')
+            continue
+        p95_change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        query_change = result['queries_per_request'] - old['queries_per_request']
+        regressed = p95_change > threshold or query_change > 0
+        regressions += regressed
+        print(f"  {'WORSE' if regressed else 'ok   '} {key}: p95 {old['p95_ms']} -> {result['p95_ms']} ms "
+              f"({p95_change:+.0%}), queries {old['queries_per_request']} -> {result['queries_per_request']}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL'))
+    parser.add_argument('--functions', help='comma-separated function directories (default: all)')
+    parser.add_argument('--mix', choices=('tests', 'catalog', 'checkout', 'all'), default='all')
+    parser.add_argument('-n', '--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--include-writes', action='store_true', help='also run POST/PUT/DELETE cases')
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations before running')
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON')
+    parser.add_argument('--threshold', type=float, default=0.15, help='p95 slowdown reported as regression')
+    parser.add_argument('--check-yukassa', action='store_true',
+                        help='only check the YooKassa client retries against a local stub server')
+    args = parser.parse_args()
+
+    if args.check_yukassa:
+        failures = check_yukassa_retry()
+        for failure in failures:
+            print(f'FAIL {failure}')
+        print('yukassa client: ' + ('FAILED' if failures else 'ok'))
+        return 1 if failures else 0
+
+    if not args.dsn:
+        parser.error('set BENCH_DATABASE_URL or pass --dsn')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('PGOPTIONS', f'-c search_path={SCHEMA},public')
+    for name in DISABLED_URL_VARS:
+        os.environ[name] = ''
+
+    if args.migrate:
+        print(f'{apply_migrations(args.dsn)} migrations applied')
+
+    install_query_counter()
+    rng = random.Random(args.seed)
+
+    # create_payment в checkout-миксе платит через локальную заглушку, а не через ЮKassa
+    yukassa = YukassaStub()
+    yukassa.start()
+    os.environ['YUKASSA_API_URL'] = yukassa.url
+    os.environ.setdefault('YUKASSA_SHOP_ID', 'bench-shop')
+    os.environ.setdefault('YUKASSA_SECRET_KEY', 'bench-secret')
+
+    selected = set(args.functions.split(',')) if args.functions else None
+    function_dirs = sorted(
+        path for path in BACKEND_DIR.iterdir()
+        if (path / 'index.py').exists() and (selected is None or path.name in selected)
+    )
+
+    cases: List[Dict[str, Any]] = []
+    if args.mix in ('tests', 'all'):
+        for function_dir in function_dirs:
+            cases.extend(load_test_cases(function_dir))
+    if args.mix != 'tests':
+        mix_cases = synthetic_cases(args.mix, sample_catalog(args.dsn), rng)
+        cases.extend(c for c in mix_cases if selected is None or c['function'] in selected)
+    if not args.include_writes:
+        cases = [c for c in cases if not c['writes']]
+
+    handlers: Dict[str, Callable] = {}
+    skipped: Dict[str, str] = {}
+    results = []
+    for case in cases:
+        function = case['function']
+        if function in skipped:
+            continue
+        if function not in handlers:
+            try:
+                handlers[function] = load_handler(BACKEND_DIR / function)
+            except Exception as e:
+                skipped[function] = f'{type(e).__name__}: {e}'
+                print(f'skip {function}: {skipped[function]}')
+                continue
+        result = run_case(handlers[function], case, args.iterations, args.warmup)
+        results.append(result)
+        print(f"{function:28} {case['name'][:44]:44} p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+              f"p99 {result['p99_ms']:8.2f} ms  q {result['queries_per_request']:5.1f}  "
+              f"alloc {result['peak_alloc_kb']:8.1f} KB  {result['status_counts']}")
+
+    report = {
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'iterations': args.iterations,
+        'mix': args.mix,
+        'seed': args.seed,
+        'skipped': skipped,
+        'results': results
+    }
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    yukassa.stop()
+    print(f'\n{len(results)} cases -> {args.output}')
+
+    for r in results:
+        if r['over_query_budget']:
+            print(f"QUERIES {r['function']} | {r['name']}: {r['queries_per_request']} per request, "
+                  f"budget {r['max_queries']}")
+    failed = sum(1 for r in results if r['unexpected_status'] or r['errors'] or r['over_query_budget'])
+    if args.compare:
+        failed += compare(report, args.compare, args.threshold)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,13 +20,22 @@ const generateSitemap = async () => {
     const xmlContent = await response.text();
     
     const urlCount = (xmlContent.match(/<url>/g) || []).length;
-    console.log(`Found ${urlCount} URLs in sitemap`);
+    const shardCount = (xmlContent.match(/<sitemap>/g) || []).length;
+    if (shardCount > 0) {
+      console.log(`Found sitemap index with ${shardCount} child sitemaps`);
+    } else {
+      console.log(`Found ${urlCount} URLs in sitemap`);
+    }
     
     const sitemapPath = path.join(__dirname, '..', 'public', 'sitemap.xml');
     fs.writeFileSync(sitemapPath, xmlContent, 'utf-8');
     
     console.log(`✅ Sitemap generated successfully!`);
-    console.log(`   Total URLs: ${urlCount}`);
+    if (shardCount > 0) {
+      console.log(`   Child sitemaps: ${shardCount}`);
+    } else {
+      console.log(`   Total URLs: ${urlCount}`);
+    }
     console.log(`   Saved to: ${sitemapPath}`);
     
   } catch (error) {
@@ -0,0 +1,438 @@
+'''
+Deterministic scale data for load tests and scripts/backend_bench.py.
+
+Fills a database migrated from db_migrations with regions, cities, products,
+multi-category links, city prices, city/region exclusions, settlements, reviews
+and orders. The same --seed always produces the same rows. Rows are streamed to
+Postgres with COPY, so a million orders take tens of seconds, not hours.
+
+    export BENCH_DATABASE_URL=postgresql://postgres@localhost/florustic_bench
+    python scripts/backend_bench.py --migrate
+    python scripts/generate_scale_data.py --products 10000 --cities 2000 --orders 1000000
+
+Generated rows get ids above the ones already present, so the handful of seed rows
+from the migrations stay. Use --reset to truncate the generated tables before a
+second run (region names are unique, so generating twice on top would clash). Afterwards
+product_city_catalog is rebuilt (skip with --skip-catalog-refresh) and
+catalog_version is bumped, so cached catalog responses are dropped.
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Iterator, List, Sequence
+
+import psycopg2
+
+SCHEMA = 't_p90017259_flo_rustic_shop'
+BASE_TIME = datetime(2025, 1, 1, 9, 0, 0)
+
+REGION_ROOTS = ['Бел', 'Крас', 'Нов', 'Стар', 'Зелен', 'Солн', 'Яр', 'Озер', 'Лесн', 'Речн',
+                'Камен', 'Сосн', 'Берёз', 'Лугов', 'Горн', 'Снеж', 'Серебр', 'Золот', 'Кедр', 'Вишн']
+REGION_KINDS = ['ая область', 'ий край', 'ая республика']
+CITY_PREFIXES = ['Ново', 'Старо', 'Верхне', 'Нижне', 'Красно', 'Бело', 'Усть-', 'Светло', 'Зелено', '']
+CITY_ROOTS = ['горск', 'дар', 'град', 'озёрск', 'реченск', 'полье', 'каменск', 'сосновск', 'ярск', 'луцк',
+              'боровск', 'дольск', 'мирск', 'холмск', 'ключевск', 'ольск', 'иваново', 'петровск']
+TIMEZONES = ['Europe/Moscow', 'Europe/Samara', 'Asia/Yekaterinburg', 'Asia/Omsk',
+             'Asia/Novosibirsk', 'Asia/Krasnoyarsk', 'Asia/Irkutsk', 'Asia/Vladivostok']
+
+CATEGORIES = ['Цветы', 'Шары', 'Подарки', 'Композиции']
+PRODUCT_KINDS = ['Букет', 'Композиция', 'Корзина', 'Коробка', 'Набор']
+PRODUCT_WORDS = ['Нежность', 'Весна', 'Романтика', 'Лето', 'Элегантность', 'Рассвет', 'Облако',
+                 'Вдохновение', 'Шёпот', 'Карамель', 'Жемчуг', 'Мечта', 'Акварель', 'Свидание',
+                 'Прованс', 'Полёт', 'Сияние', 'Бархат', 'Гармония', 'Улыбка']
+FLOWERS = ['розы', 'тюльпаны', 'пионы', 'хризантемы', 'альстромерии', 'эвкалипт',
+           'гипсофила', 'лилии', 'диантусы', 'фрезия', 'ромашки', 'гвоздики']
+IMAGE_IDS = ['1561181286-d3fee7d55364', '1490750967868-88aa4486c946', '1518709268805-4e9042af9f23',
+             '1563241527-3004b7be0ffd', '1582794543139-8ac9cb0f7b11']
+
+FIRST_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Ирина', 'Наталья', 'Иван', 'Алексей',
+               'Дмитрий', 'Сергей', 'Андрей', 'Михаил', 'Татьяна', 'Светлана', 'Павел']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов',
+              'Новиков', 'Морозов', 'Волков', 'Павлов', 'Фёдоров', 'Орлов', 'Егоров']
+STREETS = ['Ленина', 'Мира', 'Садовая', 'Цветочная', 'Советская', 'Лесная', 'Школьная', 'Набережная']
+REVIEW_TEXTS = ['Букет свежий, доставили вовремя', 'Очень красиво, спасибо флористам',
+                'Курьер приехал чуть позже, но цветы чудесные', 'Заказываю не первый раз, всё отлично',
+                'Цветы простояли больше недели', 'Получательница в восторге']
+SLUG_TRANSLITERATION = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'j', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', ' ': '-'
+}
+ORDER_STATUSES = [('delivered', 70), ('cancelled', 6), ('shipped', 6), ('processing', 8), ('new', 10)]
+DELIVERY_TIMES = ['any', 'morning', 'day', 'evening']
+
+GENERATED_TABLES = [
+    'payment_events', 'notification_outbox', 'orders', 'reviews', 'settlements',
+    'product_region_exclusions', 'product_city_exclusions', 'product_city_prices',
+    'product_subcategories', 'product_categories', 'product_city_catalog', 'products',
+    'city_contacts', 'cities', 'regions'
+]
+
+
+class CopyStream(io.RawIOBase):
+    '''
+    File-like view over a row generator for cursor.copy_expert(): rows are encoded as
+    CSV only when COPY reads, so a million orders never sit in memory at once.
+    '''
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows = iter(rows)
+        self._buffer = b''
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = io.StringIO()
+            writer = csv.writer(chunk, lineterminator='\n')
+            for row in self._rows:
+                writer.writerow(['\\N' if value is None else value for value in row])
+                self.count += 1
+                if chunk.tell() >= 65536:
+                    break
+            data = chunk.getvalue().encode('utf-8')
+            if not data:
+                break
+            self._buffer += data
+        if size < 0:
+            size = len(self._buffer)
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+
+def copy_rows(conn, table: str, columns: List[str], rows: Iterable[Sequence[Any]]) -> int:
+    started = time.monotonic()
+    stream = CopyStream(rows)
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY {SCHEMA}.{table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            stream
+        )
+    conn.commit()
+    print(f'{table:28} {stream.count:>10} rows  {time.monotonic() - started:6.1f}s')
+    return stream.count
+
+
+def max_id(conn, table: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT COALESCE(MAX(id), 0) FROM {SCHEMA}.{table}')
+        return cur.fetchone()[0]
+
+
+def sync_sequence(conn, table: str) -> None:
+    '''Explicit ids were copied in, so move the SERIAL sequence past them'''
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT setval(pg_get_serial_sequence('{SCHEMA}.{table}', 'id'),
+                          GREATEST((SELECT COALESCE(MAX(id), 0) FROM {SCHEMA}.{table}), 1))
+        ''')
+    conn.commit()
+
+
+def spread_time(rng: random.Random, days: int) -> datetime:
+    '''A moment within `days` days before BASE_TIME, denser toward recent dates'''
+    offset = days * (1 - rng.random() ** 0.6)
+    return BASE_TIME - timedelta(days=offset, seconds=rng.randrange(86400))
+
+
+def person(rng: random.Random) -> str:
+    last_name = rng.choice(LAST_NAMES)
+    first_name = rng.choice(FIRST_NAMES)
+    if first_name.endswith('а') or first_name.endswith('я'):
+        last_name += 'а'
+    return f'{first_name} {last_name}'
+
+
+def phone(rng: random.Random) -> str:
+    return f'+79{rng.randrange(10 ** 9):09d}'
+
+
+def create_slug(name: str) -> str:
+    '''Same transliteration as the city_slug() SQL function'''
+    return ''.join(SLUG_TRANSLITERATION.get(char, char) for char in name.lower())
+
+
+def active_city_slugs(conn) -> set:
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT slug FROM {SCHEMA}.cities WHERE is_active = true AND slug IS NOT NULL')
+        return {row[0] for row in cur.fetchall()}
+
+
+def sample_count(rng: random.Random, population: int, ratio: float) -> int:
+    '''Per-row sample size with mean population * ratio, clamped to the population'''
+    if ratio <= 0 or population == 0:
+        return 0
+    return min(population, int(rng.expovariate(1 / (population * ratio))))
+
+
+def generate(conn, args: argparse.Namespace) -> None:
+    rngs = {name: random.Random(f'{args.seed}:{name}') for name in (
+        'regions', 'cities', 'products', 'links', 'prices', 'exclusions',
+        'settlements', 'reviews', 'orders'
+    )}
+
+    # Регионы
+    region_base = max_id(conn, 'regions')
+    region_names: List[str] = []
+    seen = set()
+    rng = rngs['regions']
+    while len(region_names) < args.regions:
+        name = f'{rng.choice(REGION_ROOTS)}{rng.choice(REGION_KINDS)}'
+        if name in seen:
+            name = f'{name} {len(region_names) + 1}'
+        seen.add(name)
+        region_names.append(name)
+    region_ids = list(range(region_base + 1, region_base + len(region_names) + 1))
+    copy_rows(conn, 'regions', ['id', 'name', 'is_active'],
+              ((rid, name, True) for rid, name in zip(region_ids, region_names)))
+
+    # Города: несколько неактивных и дубликаты названий, как в реальных данных
+    city_base = max_id(conn, 'cities')
+    rng = rngs['cities']
+    cities = []
+    # slug уникален среди активных городов: одноимённые получают суффикс -<id>, как в city_slug_for()
+    taken_slugs = active_city_slugs(conn)
+    for index in range(args.cities):
+        region_index = rng.randrange(len(region_ids))
+        name = f'{rng.choice(CITY_PREFIXES)}{rng.choice(CITY_ROOTS)}'.capitalize()
+        if rng.random() < 0.9:
+            name = f'{name}-{index + 1}'
+        city_id = city_base + index + 1
+        is_active = rng.random() > 0.03
+        slug = create_slug(name)
+        if is_active:
+            attempt = 0
+            while slug in taken_slugs:
+                attempt += 1
+                slug = f'{create_slug(name)}-{city_id}' + (f'-{attempt}' if attempt > 1 else '')
+            taken_slugs.add(slug)
+        cities.append((
+            city_id, name, region_names[region_index], is_active,
+            spread_time(rng, 900), region_ids[region_index], rng.choice(TIMEZONES),
+            f'ул. {rng.choice(STREETS)}, {rng.randrange(1, 150)}',
+            rng.choice([0, 0, 0, 5, 10, 15, 20]), slug
+        ))
+    copy_rows(conn, 'cities',
+              ['id', 'name', 'region', 'is_active', 'created_at', 'region_id', 'timezone',
+               'address', 'price_markup_percent', 'slug'],
+              cities)
+    city_ids = [city[0] for city in cities]
+
+    # Товары
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT id FROM {SCHEMA}.subcategories ORDER BY id')
+        subcategory_ids = [row[0] for row in cur.fetchall()]
+    product_base = max_id(conn, 'products')
+    rng = rngs['products']
+    products = []
+    for index in range(args.products):
+        product_id = product_base + index + 1
+        flowers = rng.sample(FLOWERS, rng.randint(2, 4))
+        created_at = spread_time(rng, 720)
+        products.append((
+            product_id,
+            f'{rng.choice(PRODUCT_KINDS)} "{rng.choice(PRODUCT_WORDS)}" №{product_id}',
+            f'Авторская работа: {", ".join(flowers)}',
+            f'https://images.unsplash.com/photo-{rng.choice(IMAGE_IDS)}?w=400',
+            rng.randrange(15, 150) * 100,
+            rng.choice(CATEGORIES),
+            rng.random() > 0.05,
+            created_at,
+            created_at + timedelta(days=rng.randrange(30)),
+            rng.choice(subcategory_ids) if subcategory_ids and rng.random() < 0.7 else None,
+            ', '.join(f'{flower} — {rng.randint(3, 25)} шт.' for flower in flowers),
+            rng.random() < 0.05,
+            rng.random() < 0.1,
+            rng.random() < 0.08
+        ))
+    copy_rows(conn, 'products',
+              ['id', 'name', 'description', 'image_url', 'base_price', 'category', 'is_active',
+               'created_at', 'updated_at', 'subcategory_id', 'composition', 'is_featured',
+               'is_gift', 'is_recommended'],
+              products)
+    product_ids = [product[0] for product in products]
+    product_prices = {product[0]: product[4] for product in products}
+
+    rng = rngs['links']
+    copy_rows(conn, 'product_categories', ['product_id', 'category'], (
+        (product[0], category)
+        for product in products
+        for category in sorted({product[5], *rng.sample(CATEGORIES, rng.randint(0, 2))})
+    ))
+    if subcategory_ids:
+        copy_rows(conn, 'product_subcategories', ['product_id', 'subcategory_id'], (
+            (product[0], subcategory_id)
+            for product in products
+            for subcategory_id in sorted(
+                {product[9]} - {None} | set(rng.sample(subcategory_ids, rng.randint(0, min(2, len(subcategory_ids)))))
+            )
+        ))
+
+    # Цены и исключения по городам и регионам
+    rng = rngs['prices']
+    copy_rows(conn, 'product_city_prices', ['product_id', 'city_id', 'price'], (
+        (product_id, city_id, int(product_prices[product_id] * rng.uniform(0.9, 1.4)))
+        for product_id in product_ids
+        for city_id in sorted(rng.sample(city_ids, sample_count(rng, len(city_ids), args.city_price_ratio)))
+    ))
+    rng = rngs['exclusions']
+    copy_rows(conn, 'product_city_exclusions', ['product_id', 'city_id'], (
+        (product_id, city_id)
+        for product_id in product_ids
+        for city_id in sorted(rng.sample(city_ids, sample_count(rng, len(city_ids), args.city_exclusion_ratio)))
+    ))
+    copy_rows(conn, 'product_region_exclusions', ['product_id', 'region_id'], (
+        (product_id, region_id)
+        for product_id in product_ids
+        for region_id in sorted(rng.sample(region_ids, sample_count(rng, len(region_ids), args.region_exclusion_ratio)))
+    ))
+
+    rng = rngs['settlements']
+    copy_rows(conn, 'settlements', ['city_id', 'name', 'delivery_price', 'is_active'], (
+        row
+        for city in cities
+        for row in [(city[0], city[1], 0, True)] + [
+            (city[0], f'{rng.choice(CITY_PREFIXES)}{rng.choice(CITY_ROOTS)} (р-н {city[1]})'.strip(),
+             rng.choice([200, 300, 400, 500, 600]), rng.random() > 0.05)
+            for _ in range(rng.randint(0, args.settlements_per_city))
+        ]
+    ))
+
+    rng = rngs['reviews']
+    copy_rows(conn, 'reviews', ['name', 'city', 'email', 'rating', 'comment', 'is_approved', 'created_at'], (
+        (person(rng), rng.choice(cities)[1], f'review{index}@example.com',
+         rng.choices([5, 4, 3, 2, 1], weights=[60, 25, 8, 4, 3])[0],
+         rng.choice(REVIEW_TEXTS), rng.random() < 0.8, spread_time(rng, 720))
+        for index in range(args.reviews)
+    ))
+
+    generate_orders(conn, args, rngs['orders'], cities, product_ids, product_prices)
+
+    for table in ('regions', 'cities', 'products', 'product_categories', 'product_subcategories',
+                  'product_city_prices', 'product_city_exclusions', 'product_region_exclusions',
+                  'settlements', 'reviews', 'orders'):
+        sync_sequence(conn, table)
+
+
+def generate_orders(conn, args: argparse.Namespace, rng: random.Random, cities: List[tuple],
+                    product_ids: List[int], product_prices: dict) -> None:
+    '''Orders continue order_number_counter, and the counter is moved past them afterwards'''
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT last_value FROM {SCHEMA}.order_number_counter WHERE id = 1')
+        row = cur.fetchone()
+    first_number = (row[0] if row else 0) + 1
+    order_base = max_id(conn, 'orders')
+    active_cities = [city for city in cities if city[3]] or cities
+    statuses, status_weights = zip(*ORDER_STATUSES)
+
+    def rows() -> Iterator[tuple]:
+        for index in range(args.orders):
+            items = []
+            for product_id in rng.sample(product_ids, rng.randint(1, min(3, len(product_ids)))):
+                items.append({'id': product_id, 'name': f'Товар {product_id}',
+                              'quantity': rng.randint(1, 2), 'price': product_prices[product_id]})
+            total = sum(item['price'] * item['quantity'] for item in items)
+            created_at = spread_time(rng, 730)
+            status = rng.choices(statuses, weights=status_weights)[0]
+            online = rng.random() < 0.6
+            payment_status = 'paid' if online and status != 'cancelled' else ('failed' if online else 'pending')
+            city = rng.choice(active_cities)
+            customer = person(rng)
+            yield (
+                order_base + index + 1, str(first_number + index), customer, phone(rng),
+                f'customer{index % 50000}@example.com', city[0],
+                f'г. {city[1]}, ул. {rng.choice(STREETS)}, д. {rng.randrange(1, 200)}',
+                json.dumps(items, ensure_ascii=False), total, status, created_at,
+                created_at + timedelta(hours=rng.randrange(1, 72)),
+                f'bench-{order_base + index + 1:08d}' if online else None, payment_status,
+                'online' if online else 'cash', person(rng), phone(rng),
+                customer if rng.random() < 0.5 else None,
+                (created_at + timedelta(days=rng.randrange(0, 5))).date(),
+                rng.choice(DELIVERY_TIMES),
+                'С днём рождения!' if rng.random() < 0.3 else None, 0
+            )
+
+    count = copy_rows(conn, 'orders', [
+        'id', 'order_number', 'customer_name', 'customer_phone', 'customer_email', 'city_id',
+        'delivery_address', 'items', 'total_amount', 'status', 'created_at', 'updated_at',
+        'payment_id', 'payment_status', 'payment_method', 'recipient_name', 'recipient_phone',
+        'sender_name', 'delivery_date', 'delivery_time', 'postcard_text', 'discount_amount'
+    ], rows())
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            UPDATE {SCHEMA}.order_number_counter
+            SET last_value = GREATEST(last_value, %s), updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+        ''', (first_number + count - 1,))
+    conn.commit()
+
+
+def reset(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(f'{SCHEMA}.{t}' for t in GENERATED_TABLES)} RESTART IDENTITY CASCADE")
+        cur.execute(f'UPDATE {SCHEMA}.order_number_counter SET last_value = 0 WHERE id = 1')
+    conn.commit()
+    print('generated tables truncated')
+
+
+def finish(conn, refresh_catalog: bool) -> None:
+    '''Rebuild the catalog matrix, refresh planner statistics and invalidate catalog caches'''
+    started = time.monotonic()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        if refresh_catalog:
+            cur.execute(f'SELECT {SCHEMA}.refresh_product_city_catalog()')
+            print(f'product_city_catalog refreshed in {time.monotonic() - started:.1f}s')
+        cur.execute('ANALYZE')
+        cur.execute(f'UPDATE {SCHEMA}.catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1')
+    conn.autocommit = False
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--regions', type=int, default=85)
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--settlements-per-city', type=int, default=4)
+    parser.add_argument('--city-price-ratio', type=float, default=0.01,
+                        help='mean share of cities with an explicit price per product')
+    parser.add_argument('--city-exclusion-ratio', type=float, default=0.005)
+    parser.add_argument('--region-exclusion-ratio', type=float, default=0.02)
+    parser.add_argument('--reset', action='store_true', help='truncate generated tables before filling')
+    parser.add_argument('--skip-catalog-refresh', action='store_true')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('set BENCH_DATABASE_URL or pass --dsn')
+    if args.regions < 1 or args.cities < 1 or args.products < 1:
+        parser.error('--regions, --cities and --products must be positive')
+
+    started = time.monotonic()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.reset:
+            reset(conn)
+        generate(conn, args)
+        finish(conn, refresh_catalog=not args.skip_catalog_refresh)
+    finally:
+        conn.close()
+    print(f'done in {time.monotonic() - started:.1f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
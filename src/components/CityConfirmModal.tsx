@@ -38,8 +38,8 @@ export const CityConfirmModal = () => {
     setShowSelector(true);
   };
 
-  const handleCitySelect = (city: string, cityId: number, region?: string) => {
-    setCity(city, cityId, region);
+  const handleCitySelect = (city: string, cityId: number, region?: string, slug?: string) => {
+    setCity(city, cityId, region, slug);
     sessionStorage.setItem('cityConfirmedThisSession', 'true');
     setIsOpen(false);
     setShowSelector(false);
@@ -7,12 +7,13 @@ import API_ENDPOINTS from '@/config/api';
 interface City {
   id: number;
   name: string;
+  slug?: string;
   region: string;
 }
 
 interface CitySelectorProps {
   value: string;
-  onChange: (city: string, cityId: number, region?: string) => void;
+  onChange: (city: string, cityId: number, region?: string, slug?: string) => void;
 }
 
 const createSlug = (name: string): string => {
@@ -42,7 +43,7 @@ const CitySelector = ({ value, onChange }: CitySelectorProps) => {
     if (!isOpen) return;
 
     const fetchCities = async () => {
-      const CACHE_KEY = 'cities_cache_v2';
+      const CACHE_KEY = 'cities_cache_v3';
       const CACHE_DURATION = 24 * 60 * 60 * 1000;
 
       try {
@@ -89,12 +90,12 @@ const CitySelector = ({ value, onChange }: CitySelectorProps) => {
     return acc;
   }, {} as Record<string, City[]>);
 
-  const handleSelect = (cityName: string, cityId: number, region: string) => {
-    onChange(cityName, cityId, region);
+  const handleSelect = (cityName: string, cityId: number, region: string, citySlug?: string) => {
+    onChange(cityName, cityId, region, citySlug);
     setIsOpen(false);
     setSearchQuery('');
     
-    const slug = createSlug(cityName);
+    const slug = citySlug || createSlug(cityName);
     if (!location.pathname.startsWith('/admin')) {
       navigate(`/city/${slug}`);
     }
@@ -178,7 +179,7 @@ const CitySelector = ({ value, onChange }: CitySelectorProps) => {
                         {regionCities.map((city) => (
                           <button
                             key={city.id}
-                            onClick={() => handleSelect(city.name, city.id, region)}
+                            onClick={() => handleSelect(city.name, city.id, region, city.slug)}
                             className="w-full px-2 py-1.5 text-left text-sm rounded-md hover:bg-primary hover:text-primary-foreground transition-colors"
                           >
                             {city.name}
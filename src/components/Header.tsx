@@ -9,23 +9,8 @@ interface HeaderProps {
   cartCount: number;
 }
 
-const createSlug = (name: string): string => {
-  return name
-    .toLowerCase()
-    .replace(/ё/g, 'e')
-    .replace(/ /g, '-')
-    .replace(/а/g, 'a').replace(/б/g, 'b').replace(/в/g, 'v').replace(/г/g, 'g')
-    .replace(/д/g, 'd').replace(/е/g, 'e').replace(/ж/g, 'zh').replace(/з/g, 'z')
-    .replace(/и/g, 'i').replace(/й/g, 'j').replace(/к/g, 'k').replace(/л/g, 'l')
-    .replace(/м/g, 'm').replace(/н/g, 'n').replace(/о/g, 'o').replace(/п/g, 'p')
-    .replace(/р/g, 'r').replace(/с/g, 's').replace(/т/g, 't').replace(/у/g, 'u')
-    .replace(/ф/g, 'f').replace(/х/g, 'h').replace(/ц/g, 'c').replace(/ч/g, 'ch')
-    .replace(/ш/g, 'sh').replace(/щ/g, 'sch').replace(/ъ/g, '').replace(/ы/g, 'y')
-    .replace(/ь/g, '').replace(/э/g, 'e').replace(/ю/g, 'yu').replace(/я/g, 'ya');
-};
-
 const Header = ({ cartCount }: HeaderProps) => {
-  const { selectedCity, setCity } = useCity();
+  const { selectedCity, selectedCitySlug: citySlug, setCity } = useCity();
   const { getText } = useSiteTexts();
   const [isMenuOpen, setIsMenuOpen] = useState(false);
   const [showCitySelector, setShowCitySelector] = useState(false);
@@ -33,7 +18,6 @@ const Header = ({ cartCount }: HeaderProps) => {
   const [showMobileSocial, setShowMobileSocial] = useState(false);
   const socialMenuRef = useRef<HTMLDivElement>(null);
   const mobileSocialRef = useRef<HTMLDivElement>(null);
-  const citySlug = createSlug(selectedCity);
 
   const socialLinks = [
     {
@@ -274,8 +258,8 @@ const Header = ({ cartCount }: HeaderProps) => {
             </div>
             <CitySelector
               value={selectedCity}
-              onChange={(city, cityId, region) => {
-                setCity(city, cityId, region);
+              onChange={(city, cityId, region, slug) => {
+                setCity(city, cityId, region, slug);
                 setShowCitySelector(false);
               }}
             />
@@ -12,6 +12,7 @@ type Category = 'Цветы' | 'Шары' | 'Подарки';
 
 interface CityHeaderProps {
   cityName: string;
+  citySlug: string;
   activeCategory: Category;
   activeSubcategory: number | null;
   subcategories: Subcategory[];
@@ -19,23 +20,9 @@ interface CityHeaderProps {
   onSubcategoryChange: (subcategoryId: number | null) => void;
 }
 
-const createSlug = (name: string): string => {
-  return name
-    .toLowerCase()
-    .replace(/ё/g, 'e')
-    .replace(/ /g, '-')
-    .replace(/а/g, 'a').replace(/б/g, 'b').replace(/в/g, 'v').replace(/г/g, 'g')
-    .replace(/д/g, 'd').replace(/е/g, 'e').replace(/ж/g, 'zh').replace(/з/g, 'z')
-    .replace(/и/g, 'i').replace(/й/g, 'j').replace(/к/g, 'k').replace(/л/g, 'l')
-    .replace(/м/g, 'm').replace(/н/g, 'n').replace(/о/g, 'o').replace(/п/g, 'p')
-    .replace(/р/g, 'r').replace(/с/g, 's').replace(/т/g, 't').replace(/у/g, 'u')
-    .replace(/ф/g, 'f').replace(/х/g, 'h').replace(/ц/g, 'c').replace(/ч/g, 'ch')
-    .replace(/ш/g, 'sh').replace(/щ/g, 'sch').replace(/ъ/g, '').replace(/ы/g, 'y')
-    .replace(/ь/g, '').replace(/э/g, 'e').replace(/ю/g, 'yu').replace(/я/g, 'ya');
-};
-
 const CityHeader = ({
   cityName,
+  citySlug,
   activeCategory,
   activeSubcategory,
   subcategories,
@@ -43,7 +30,6 @@ const CityHeader = ({
   onSubcategoryChange
 }: CityHeaderProps) => {
   const navigate = useNavigate();
-  const citySlug = createSlug(cityName);
 
   return (
     <div className="text-center mb-6 md:mb-12">
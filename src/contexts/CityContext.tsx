@@ -4,7 +4,8 @@ interface CityContextType {
   selectedCity: string;
   selectedCityId: number;
   selectedCityRegion: string;
-  setCity: (city: string, cityId: number, region?: string) => void;
+  selectedCitySlug: string;
+  setCity: (city: string, cityId: number, region?: string, slug?: string) => void;
   initAutoDetection: (fromHomePage?: boolean) => void;
   setCityFromSlug: (citySlug: string) => Promise<boolean>;
 }
@@ -40,6 +41,7 @@ const calculateDistance = (lat1: number, lon1: number, lat2: number, lon2: numbe
 interface CityData {
   id: number;
   name: string;
+  slug?: string;
   region?: string;
   latitude?: number;
   longitude?: number;
@@ -49,15 +51,18 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
   const [selectedCity, setSelectedCity] = useState('Москва');
   const [selectedCityId, setSelectedCityId] = useState(1);
   const [selectedCityRegion, setSelectedCityRegion] = useState('Москва');
+  const [selectedCitySlug, setSelectedCitySlug] = useState(createSlug('Москва'));
 
   useEffect(() => {
     const savedCity = localStorage.getItem('selectedCity');
     const savedCityId = localStorage.getItem('selectedCityId');
     const savedCityRegion = localStorage.getItem('selectedCityRegion');
+    const savedCitySlug = localStorage.getItem('selectedCitySlug');
     
     if (savedCity && savedCityId) {
       setSelectedCity(savedCity);
       setSelectedCityId(parseInt(savedCityId, 10));
+      setSelectedCitySlug(savedCitySlug || createSlug(savedCity));
       if (savedCityRegion) {
         setSelectedCityRegion(savedCityRegion);
       }
@@ -79,6 +84,7 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
       setSelectedCity('Москва');
       setSelectedCityId(1);
       setSelectedCityRegion('Москва');
+      setSelectedCitySlug(createSlug('Москва'));
     }
   };
 
@@ -95,7 +101,7 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
 
       const { latitude, longitude } = position.coords;
 
-      const CACHE_KEY = 'cities_cache';
+      const CACHE_KEY = 'cities_list_cache';
       let data;
       
       const cached = localStorage.getItem(CACHE_KEY);
@@ -219,14 +225,7 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
         });
 
         if (nearestCity) {
-          setSelectedCity(nearestCity.name);
-          setSelectedCityId(nearestCity.id);
-          if (nearestCity.region) {
-            setSelectedCityRegion(nearestCity.region);
-            localStorage.setItem('selectedCityRegion', nearestCity.region);
-          }
-          localStorage.setItem('selectedCity', nearestCity.name);
-          localStorage.setItem('selectedCityId', nearestCity.id.toString());
+          setCity(nearestCity.name, nearestCity.id, nearestCity.region, nearestCity.slug);
           localStorage.setItem('hasDetectedLocation', 'true');
         }
       }
@@ -236,20 +235,24 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
     }
   };
 
-  const setCity = (city: string, cityId: number, region?: string) => {
+  // slug приходит из API городов: у одноимённых городов он с суффиксом -<id>
+  const setCity = (city: string, cityId: number, region?: string, slug?: string) => {
+    const citySlug = slug || createSlug(city);
     setSelectedCity(city);
     setSelectedCityId(cityId);
+    setSelectedCitySlug(citySlug);
     if (region) {
       setSelectedCityRegion(region);
       localStorage.setItem('selectedCityRegion', region);
     }
     localStorage.setItem('selectedCity', city);
     localStorage.setItem('selectedCityId', cityId.toString());
+    localStorage.setItem('selectedCitySlug', citySlug);
   };
 
   const setCityFromSlug = async (citySlug: string): Promise<boolean> => {
     try {
-      const CACHE_KEY = 'cities_cache';
+      const CACHE_KEY = 'cities_list_cache';
       let data;
       
       const cached = localStorage.getItem(CACHE_KEY);
@@ -279,10 +282,10 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
           allCities.push(...regionCities);
         });
 
-        const foundCity = allCities.find(c => createSlug(c.name) === citySlug);
+        const foundCity = allCities.find(c => (c.slug || createSlug(c.name)) === citySlug);
         
         if (foundCity) {
-          setCity(foundCity.name, foundCity.id, foundCity.region);
+          setCity(foundCity.name, foundCity.id, foundCity.region, foundCity.slug);
           return true;
         }
       }
@@ -300,6 +303,7 @@ export const CityProvider = ({ children }: { children: ReactNode }) => {
         selectedCity,
         selectedCityId,
         selectedCityRegion,
+        selectedCitySlug,
         setCity,
         initAutoDetection,
         setCityFromSlug,
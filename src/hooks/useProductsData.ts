@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useToast } from '@/hooks/use-toast';
 import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 
 interface Product {
   id: number;
@@ -42,9 +43,7 @@ export const useProductsData = () => {
   const loadProducts = async () => {
     setLoading(true);
     try {
-      const response = await fetch(`${API_ENDPOINTS.products}?with_relations=true&show_all=true`);
-      const data = await response.json();
-      setProducts(data.products || []);
+      setProducts(await fetchAllProducts<Product>({ with_relations: 'true', show_all: 'true' }));
     } catch (error) {
       toast({
         title: 'Ошибка',
@@ -9,6 +9,7 @@ import Icon from '@/components/ui/icon';
 import { useCart } from '@/contexts/CartContext';
 import { useAdminAuth } from '@/contexts/AdminAuthContext';
 import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 import {
   Dialog,
   DialogContent,
@@ -49,25 +50,23 @@ const AdminDashboard = () => {
   const loadStats = async () => {
     setLoading(true);
     try {
-      const [ordersRes, productsRes, citiesRes] = await Promise.all([
-        fetch(API_ENDPOINTS.orders),
-        fetch(API_ENDPOINTS.products),
+      const [ordersRes, productsArray, citiesRes] = await Promise.all([
+        fetch(`${API_ENDPOINTS.orders}?summary=true`),
+        fetchAllProducts({}),
         fetch(API_ENDPOINTS.cities)
       ]);
 
-      const orders = await ordersRes.json();
-      const products = await productsRes.json();
+      const ordersData = await ordersRes.json();
       const citiesData = await citiesRes.json();
 
-      const ordersArray = Array.isArray(orders) ? orders : [];
-      const newOrdersCount = ordersArray.filter((o: any) => o.status === 'new').length;
-      const totalRevenue = ordersArray.reduce((sum: number, o: any) => sum + parseFloat(o.total_amount || 0), 0);
+      const summary = ordersData.summary || { total: { count: 0, revenue: 0 }, by_status: [] };
+      const newOrdersCount = summary.by_status.find((s: any) => s.status === 'new')?.count || 0;
+      const totalRevenue = summary.total.revenue || 0;
       
-      const productsArray = Array.isArray(products) ? products : [];
       const citiesCount = Object.values(citiesData.cities || {}).flat().length;
 
       setStats({
-        totalOrders: ordersArray.length,
+        totalOrders: summary.total.count,
         newOrders: newOrdersCount,
         totalRevenue: Math.round(totalRevenue),
         totalProducts: productsArray.length,
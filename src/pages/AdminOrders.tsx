@@ -66,6 +66,8 @@ const statusColors: Record<string, string> = {
   'cancelled': 'bg-red-500/20 text-red-700 border-red-500/30'
 };
 
+const ORDERS_PAGE_SIZE = 50;
+
 const AdminOrders = () => {
   const { totalItems } = useCart();
   const { toast } = useToast();
@@ -74,17 +76,28 @@ const AdminOrders = () => {
   const [loading, setLoading] = useState(false);
   const [selectedOrder, setSelectedOrder] = useState<Order | null>(null);
   const [filterStatus, setFilterStatus] = useState<string>('all');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const fetchOrdersPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(ORDERS_PAGE_SIZE) });
+    if (filterStatus !== 'all') params.set('status', filterStatus);
+    if (cursor) params.set('cursor', cursor);
+
+    const response = await fetch(`${API_ENDPOINTS.orders}?${params.toString()}`);
+    const data = await response.json();
+    return {
+      orders: Array.isArray(data.orders) ? data.orders as Order[] : [],
+      nextCursor: (data.next_cursor as string | null) ?? null
+    };
+  };
 
   const loadOrders = async () => {
     setLoading(true);
     try {
-      const url = filterStatus === 'all' 
-        ? API_ENDPOINTS.orders
-        : `${API_ENDPOINTS.orders}?status=${filterStatus}`;
-      
-      const response = await fetch(url);
-      const data = await response.json();
-      setOrders(Array.isArray(data) ? data : []);
+      const page = await fetchOrdersPage(null);
+      setOrders(page.orders);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       toast({
         title: 'Ошибка',
@@ -96,6 +109,24 @@ const AdminOrders = () => {
     }
   };
 
+  const loadMoreOrders = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await fetchOrdersPage(nextCursor);
+      setOrders(prev => [...prev, ...page.orders]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      toast({
+        title: 'Ошибка',
+        description: 'Не удалось загрузить заказы',
+        variant: 'destructive'
+      });
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     loadOrders();
   }, [filterStatus]);
@@ -246,6 +277,13 @@ const AdminOrders = () => {
                   onClick={() => setSelectedOrder(order)}
                 />
               ))}
+              {nextCursor && (
+                <div className="flex justify-center">
+                  <Button variant="outline" onClick={loadMoreOrders} disabled={loadingMore}>
+                    {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </div>
@@ -6,6 +6,7 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@
 import { Badge } from '@/components/ui/badge';
 import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 
 interface Product {
   id: number;
@@ -41,17 +42,16 @@ const AdminProductAvailability = () => {
 
   const loadData = async () => {
     try {
-      const [productsRes, regionsRes, exclusionsRes] = await Promise.all([
-        fetch('https://functions.poehali.dev/f3ffc9b4-fbea-48e8-959d-c34ea68e6531?show_all=true'),
+      const [productsList, regionsRes, exclusionsRes] = await Promise.all([
+        fetchAllProducts<Product>({ show_all: 'true' }),
         fetch('https://functions.poehali.dev/3f4d37f0-b84f-4157-83b7-55bdb568e459'),
         fetch('https://functions.poehali.dev/f1685790-c2c6-4e36-b81b-aa4a25d7c812')
       ]);
 
-      const productsData = await productsRes.json();
       const citiesData = await regionsRes.json();
       const exclusionsData = await exclusionsRes.json();
 
-      setProducts(productsData.products || []);
+      setProducts(productsList);
       
       // Извлекаем список регионов из структуры с городами
       const regionsMap = new Map<number, Region>();
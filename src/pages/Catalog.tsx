@@ -8,7 +8,7 @@ import PageSEO from '@/components/PageSEO';
 import ProductCard from '@/components/ProductCard';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
-import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 
 interface Product {
   id: number;
@@ -31,7 +31,8 @@ const Catalog = () => {
     const fetchProducts = async () => {
       setLoading(true);
       try {
-        const CACHE_KEY = `products_${selectedCity}`;
+        // Отдельный ключ: в сетке урезанные карточки (fields=card), а products_<город> читает страница товара
+        const CACHE_KEY = `products_card_${selectedCity}`;
         const cached = localStorage.getItem(CACHE_KEY);
         
         if (cached) {
@@ -44,10 +45,7 @@ const Catalog = () => {
           }
         }
         
-        const url = `${API_ENDPOINTS.products}?city=${encodeURIComponent(selectedCity)}`;
-        const response = await fetch(url);
-        const data = await response.json();
-        const productsList = data.products || [];
+        const productsList = await fetchAllProducts<Product>({ city: selectedCity, fields: 'card' });
         
         setProducts(productsList);
         
@@ -8,6 +8,7 @@ import PageSEO from '@/components/PageSEO';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 import CityHeader from '@/components/city/CityHeader';
 import ProductsGrid from '@/components/city/ProductsGrid';
 import CityContent from '@/components/city/CityContent';
@@ -32,6 +33,7 @@ interface Product {
 interface City {
   id: number;
   name: string;
+  slug?: string;
   region: string;
   work_hours?: {
     [key: string]: {
@@ -110,7 +112,7 @@ const City = () => {
           allCities.push(...regionCities);
         });
         
-        const foundCity = allCities.find((c: City) => createSlug(c.name) === citySlug);
+        const foundCity = allCities.find((c: City) => (c.slug || createSlug(c.name)) === citySlug);
         
         if (!foundCity) {
           setError('Город не найден');
@@ -121,18 +123,12 @@ const City = () => {
         foundCityName = foundCity.name;
         setCityName(foundCityName);
         setCityData(foundCity);
-        setCity(foundCity.name, foundCity.id, foundCity.region);
+        setCity(foundCity.name, foundCity.id, foundCity.region, foundCity.slug);
         
-        let productsUrl = `${API_ENDPOINTS.products}?city=${encodeURIComponent(foundCityName)}`;
-        if (activeSubcategory) {
-          productsUrl += `&subcategory_id=${activeSubcategory}`;
-        } else {
-          productsUrl += `&category=${encodeURIComponent(activeCategory)}`;
-        }
-        const productsResponse = await fetch(productsUrl);
-        const productsData = await productsResponse.json();
-        
-        setProducts(productsData.products || []);
+        const productsQuery: Record<string, string> = activeSubcategory
+          ? { city: foundCityName, subcategory_id: String(activeSubcategory) }
+          : { city: foundCityName, category: activeCategory };
+        setProducts(await fetchAllProducts<Product>(productsQuery));
       } catch (err) {
         console.error('Failed to fetch data:', err);
         setError('Ошибка загрузки данных');
@@ -207,6 +203,7 @@ const City = () => {
         
         <CityHeader
           cityName={cityName}
+          citySlug={citySlug || ''}
           activeCategory={activeCategory}
           activeSubcategory={activeSubcategory}
           subcategories={subcategories}
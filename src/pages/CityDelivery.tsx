@@ -19,6 +19,7 @@ interface Settlement {
 interface City {
   id: number;
   name: string;
+  slug?: string;
   region: string;
 }
 
@@ -70,7 +71,7 @@ const CityDelivery = () => {
           allCities.push(...regionCities);
         });
         
-        const foundCity = allCities.find((c: City) => createSlug(c.name) === citySlug);
+        const foundCity = allCities.find((c: City) => (c.slug || createSlug(c.name)) === citySlug);
         
         if (!foundCity) {
           setError('Город не найден');
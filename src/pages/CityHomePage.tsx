@@ -10,6 +10,7 @@ import PageSEO from '@/components/PageSEO';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 import CityHomePageHero from '@/components/city-home/CityHomePageHero';
 import CityHomePageProducts from '@/components/city-home/CityHomePageProducts';
 
@@ -108,7 +109,7 @@ const CityHomePage = () => {
           allCities.push(...regionCities);
         });
         
-        const foundCity = allCities.find((c: any) => createSlug(c.name) === citySlug);
+        const foundCity = allCities.find((c: any) => (c.slug || createSlug(c.name)) === citySlug);
         
         if (!foundCity) {
           setError(true);
@@ -118,7 +119,7 @@ const CityHomePage = () => {
         
         foundCityName = foundCity.name;
         setCityName(foundCityName);
-        setCity(foundCity.name, foundCity.id, foundCity.region);
+        setCity(foundCity.name, foundCity.id, foundCity.region, foundCity.slug);
 
         const CACHE_KEY = `products_${foundCityName}`;
         const cached = localStorage.getItem(CACHE_KEY);
@@ -140,9 +141,7 @@ const CityHomePage = () => {
           }
         }
         
-        const response = await fetch(`${API_ENDPOINTS.products}?city=${encodeURIComponent(foundCityName)}`);
-        const data = await response.json();
-        const products = data.products || [];
+        const products = await fetchAllProducts<Product>({ city: foundCityName });
         
         localStorage.setItem(CACHE_KEY, JSON.stringify({
           data: products,
@@ -11,7 +11,7 @@ import HeroSection from '@/components/home/HeroSection';
 import FeaturedProductsSection from '@/components/home/FeaturedProductsSection';
 import ProductsSection from '@/components/home/ProductsSection';
 import WhyUsSection from '@/components/home/WhyUsSection';
-import API_ENDPOINTS from '@/config/api';
+import { fetchAllProducts } from '@/utils/fetchAllProducts';
 
 interface Product {
   id: number;
@@ -26,27 +26,11 @@ interface Product {
   is_recommended?: boolean;
 }
 
-const createSlug = (name: string): string => {
-  return name
-    .toLowerCase()
-    .replace(/ё/g, 'e')
-    .replace(/ /g, '-')
-    .replace(/а/g, 'a').replace(/б/g, 'b').replace(/в/g, 'v').replace(/г/g, 'g')
-    .replace(/д/g, 'd').replace(/е/g, 'e').replace(/ж/g, 'zh').replace(/з/g, 'z')
-    .replace(/и/g, 'i').replace(/й/g, 'j').replace(/к/g, 'k').replace(/л/g, 'l')
-    .replace(/м/g, 'm').replace(/н/g, 'n').replace(/о/g, 'o').replace(/п/g, 'p')
-    .replace(/р/g, 'r').replace(/с/g, 's').replace(/т/g, 't').replace(/у/g, 'u')
-    .replace(/ф/g, 'f').replace(/х/g, 'h').replace(/ц/g, 'c').replace(/ч/g, 'ch')
-    .replace(/ш/g, 'sh').replace(/щ/g, 'sch').replace(/ъ/g, '').replace(/ы/g, 'y')
-    .replace(/ь/g, '').replace(/э/g, 'e').replace(/ю/g, 'yu').replace(/я/g, 'ya');
-};
-
 const Index = () => {
   const location = useLocation();
   const { addToCart, totalItems } = useCart();
   const { getText } = useSiteTexts();
-  const { selectedCity, initAutoDetection } = useCity();
-  const citySlug = createSlug(selectedCity);
+  const { selectedCity, selectedCitySlug: citySlug, initAutoDetection } = useCity();
   const [featuredProducts, setFeaturedProducts] = useState<Product[]>([]);
   const [giftProducts, setGiftProducts] = useState<Product[]>([]);
   const [recommendedProducts, setRecommendedProducts] = useState<Product[]>([]);
@@ -85,9 +69,7 @@ const Index = () => {
         }
         
         if (shouldFetchFresh) {
-          const response = await fetch(`${API_ENDPOINTS.products}?city=${encodeURIComponent(selectedCity)}`);
-          const data = await response.json();
-          const products = data.products || [];
+          const products = await fetchAllProducts<Product>({ city: selectedCity });
           
           localStorage.setItem(CACHE_KEY, JSON.stringify({
             data: products,
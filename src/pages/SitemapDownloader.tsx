@@ -10,7 +10,7 @@ export default function SitemapDownloader() {
     try {
       const response = await fetch('https://functions.poehali.dev/2acdad81-deba-4cdd-8cd1-feb9e24f4226');
       const xmlContent = await response.text();
-      const count = (xmlContent.match(/<url>/g) || []).length;
+      const count = Number(response.headers.get('X-URL-Count')) || (xmlContent.match(/<url>/g) || []).length;
       setXml(xmlContent);
       setUrlCount(count);
     } catch (error) {
@@ -0,0 +1,24 @@
+import API_ENDPOINTS from '@/config/api';
+
+// Каталог отдаётся страницами с next_cursor. Витрина фильтрует и сортирует весь список
+// на клиенте, поэтому забираем страницы до конца, по максимальному размеру страницы.
+const PRODUCTS_PAGE_SIZE = 200;
+
+export const fetchAllProducts = async <T = any>(query: Record<string, string>): Promise<T[]> => {
+  const products: T[] = [];
+  let cursor: string | null = null;
+
+  do {
+    const params = new URLSearchParams({ ...query, limit: String(PRODUCTS_PAGE_SIZE) });
+    if (cursor) params.set('cursor', cursor);
+
+    const response = await fetch(`${API_ENDPOINTS.products}?${params.toString()}`);
+    const data = await response.json();
+    if (Array.isArray(data.products)) {
+      products.push(...data.products);
+    }
+    cursor = (data.next_cursor as string | null) ?? null;
+  } while (cursor);
+
+  return products;
+};